@@ -0,0 +1,174 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import tempfile
+import multiprocessing as mp
+from core.tracing import percentiles
+from utils.logger import default_logger as logger
+
+# 规模测试：在合成数据集（datasets/synthetic.py）上用确定性 stub 模型（models/synthetic.py）跑完整的评估流程，
+# 测量每个任务的端到端吞吐、各阶段耗时分位数与峰值 RSS，写出 JSON 报告。
+# 每个任务在单独的（spawn）进程中运行，峰值 RSS 互不影响。
+#   python benchmark.py --slides 100000 --data_root /data/synthetic --encoder_latency_ms 20
+# 阶段：
+#   load     每张 slide 的特征读取（SyntheticDataset.__getitem__，特征库为 mmap，缺页发生在 collate / encode 中；
+#            process 预取后端下在子进程中，不统计）
+#   encode   每个 batch 的 model.encode_batch
+#   head     每个 batch 的任务 head（*_from_latents）
+#   save     save_results（metrics.json / predictions.npz）
+# wall 中除 encode / head 以外的部分（等待预取、collate、指标累加）记为 harness。
+
+
+def _peak_rss_mb() -> float:
+    # Linux 上 ru_maxrss 的单位为 KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _task_runs(task_names, task_configs, output_root):
+    from main import build_task
+    runs = []
+    for task_name in task_names:
+        task_config = dict(task_configs[task_name], result_dir=output_root)
+        test_configs = (task_config["datasets"][0].get("configs") or {}) if task_config.get("datasets") else {}
+        runs.append((build_task(task_name, task_config), test_configs))
+    return runs
+
+
+def _run(task_names, task_configs, args, queue):
+    # 子进程：构建数据集 / 模型 / 任务，评估并保存，返回统计
+    import torch
+    from core.multi_task import evaluate_multi_task
+    from core.registry import DATASETS, MODELS
+    torch.set_num_threads(args.threads)
+
+    dataset = DATASETS.get("SYNTHETIC")(data_root=args.data_root, prefetch={
+        "num_workers": args.prefetch_workers, "depth": args.prefetch_depth, "backend": args.prefetch_backend})
+    model = MODELS.get("SyntheticModel")(device="cpu", precision=args.precision, hidden_dim=args.hidden_dim,
+                                         encoder_latency_ms=args.encoder_latency_ms,
+                                         head_latency_ms=args.head_latency_ms)
+    with tempfile.TemporaryDirectory() as output_root:
+        runs = _task_runs(task_names, task_configs, output_root)
+        for task, _ in runs:
+            task.batch_size = args.batch_size
+        rss_before = _peak_rss_mb()
+
+        start = time.perf_counter()
+        if len(runs) == 1:
+            task, test_configs = runs[0]
+            results = [task.evaluate(model, dataset, **test_configs)]
+        else:
+            results = evaluate_multi_task(model, dataset, runs)
+        wall = time.perf_counter() - start
+
+        save_times, metrics = [], {}
+        for (task, _), result in zip(runs, results):
+            if result is None:
+                continue
+            save_start = time.perf_counter()
+            task.save_results("SyntheticModel", "Synthetic", *result)
+            save_times.append(time.perf_counter() - save_start)
+            result[1].journal.close()
+            metrics[task.task_name] = result[0]
+
+    timings = model.pop_timings()
+    model_time = sum(timings["encode"]) + sum(timings["head"])
+    num_slides = len(dataset)
+    queue.put({
+        "tasks": list(task_names),
+        "num_slides": num_slides,
+        "wall_seconds": wall,
+        "slides_per_sec": num_slides / wall if wall > 0 else float("inf"),
+        "stages": {"load": percentiles(dataset.load_times), "encode": percentiles(timings["encode"]),
+                   "head": percentiles(timings["head"]), "save": percentiles(save_times)},
+        "time_split": {"model": model_time / wall if wall > 0 else 0.0,
+                       "harness": 1 - model_time / wall if wall > 0 else 0.0},
+        "rss_mb": {"before_evaluation": rss_before, "peak": _peak_rss_mb()},
+        "metrics": metrics,
+    })
+
+
+def run_isolated(task_names, task_configs, args) -> dict:
+    ctx = mp.get_context("spawn")
+    queue = ctx.Queue()
+    process = ctx.Process(target=_run, args=(task_names, task_configs, args, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def _describe(name: str, result: dict) -> str:
+    stages = ", ".join(f"{stage} p50/p95/p99 {s['p50_ms']:.1f}/{s['p95_ms']:.1f}/{s['p99_ms']:.1f} ms"
+                       for stage, s in result["stages"].items() if s["count"])
+    return (f"{name}: {result['num_slides']} slides in {result['wall_seconds']:.1f}s "
+            f"({result['slides_per_sec']:.1f} slides/sec), model {result['time_split']['model']:.0%} / "
+            f"harness {result['time_split']['harness']:.0%} of wall time, peak RSS {result['rss_mb']['peak']:.0f} MB; "
+            f"{stages}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Scale benchmark of the evaluation harness on a synthetic dataset")
+    parser.add_argument("--config", default="configs/config.json", help="task grid (metrics and test configs)")
+    parser.add_argument("--tasks", nargs="+", default=None, help="tasks to run (default: all tasks in the config)")
+    parser.add_argument("--no_multi_task", action="store_true", help="skip the shared-encoder multi-task run")
+    parser.add_argument("--data_root", default=None, help="synthetic dataset root (default: a directory under /tmp)")
+    # 默认规模约 0.8 GB 特征（fp16）；生成前会记录预计的特征大小
+    parser.add_argument("--slides", type=int, default=200)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--tiles_median", type=int, default=2000)
+    parser.add_argument("--tiles_sigma", type=float, default=0.8)
+    parser.add_argument("--max_tiles", type=int, default=150000)
+    parser.add_argument("--hidden_dim", type=int, default=256, help="stub encoder cost (real CPU matmul)")
+    parser.add_argument("--encoder_latency_ms", type=float, default=0.0, help="simulated encoder time per slide")
+    parser.add_argument("--head_latency_ms", type=float, default=0.0, help="simulated head time per slide")
+    parser.add_argument("--precision", default=None)
+    parser.add_argument("--batch_size", type=int, default=8)
+    parser.add_argument("--prefetch_workers", type=int, default=2)
+    parser.add_argument("--prefetch_depth", type=int, default=16)
+    parser.add_argument("--prefetch_backend", default="thread")
+    parser.add_argument("--threads", type=int, default=1, help="torch threads per run")
+    parser.add_argument("--output", default=None, help="report path (default: results/benchmark/scale_<slides>.json)")
+    args = parser.parse_args(argv)
+
+    from datasets.synthetic import generate_synthetic_dataset
+    from core.predictions import atomic_write
+    args.data_root = args.data_root or os.path.join(tempfile.gettempdir(), f"synthetic_{args.slides}_{args.dim}")
+    dataset_meta = generate_synthetic_dataset(args.data_root, num_slides=args.slides, dim=args.dim,
+                                              tiles_median=args.tiles_median, tiles_sigma=args.tiles_sigma,
+                                              max_tiles=args.max_tiles)
+
+    with open(args.config, "r") as f:
+        task_configs = json.load(f)
+    task_names = args.tasks or list(task_configs)
+    runs = [[task_name] for task_name in task_names]
+    if len(task_names) > 1 and not args.no_multi_task:
+        runs.append(task_names)
+
+    results = {}
+    for run in runs:
+        name = run[0] if len(run) == 1 else "multi_task"
+        results[name] = run_isolated(run, task_configs, args)
+        logger.info(_describe(name, results[name]))
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "settings": vars(args),
+        "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                        "cpu_count": os.cpu_count()},
+        "dataset": dataset_meta,
+        "runs": results,
+    }
+    output = args.output or os.path.join("results", "benchmark", f"scale_{args.slides}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with atomic_write(output) as f:
+        json.dump(report, f, indent=4, default=str)
+    logger.info(f"Benchmark report written to {output}")
+    return report
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,7 +1,113 @@
 from abc import ABC, abstractmethod
-from typing import Any, Dict, List, Tuple
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from functools import partial
 import os
+import hashlib
+import numpy as np
+import pandas as pd
+import torch
+from torch.nn.utils.rnn import pad_sequence
 from torch.utils.data import Dataset
+from .feature_store import FeatureStore
+from utils.logger import default_logger as logger
+
+
+def _to_python(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+
+class LabelTable:
+    """
+    一种标签（一个 CSV 文件）的列式存储：每列一个 numpy 数组，slide_name -> 行号的哈希索引，O(1) 查找。
+    pickle 时只序列化 numpy 列，索引在 DataLoader worker 中按需重建。
+    """
+
+    def __init__(self, columns: Dict[str, np.ndarray], key_column: str = "slide_name"):
+        self.columns = columns
+        self.key_column = key_column
+        self.value_columns = [c for c in columns if c != key_column]
+        self._index = None
+
+    @classmethod
+    def from_csv(cls, path: str, key_column: str = "slide_name") -> "LabelTable":
+        df = pd.read_csv(path)
+        return cls({c: df[c].to_numpy() for c in df.columns}, key_column=key_column)
+
+    @property
+    def index(self) -> Dict[str, int]:
+        if self._index is None:
+            self._index = {str(k): i for i, k in enumerate(self.columns[self.key_column])}
+        return self._index
+
+    def __len__(self) -> int:
+        return len(self.columns[self.key_column])
+
+    def check_columns(self, columns: List[str]):
+        missing = [c for c in columns if c not in self.columns]
+        if missing:
+            raise ValueError(f"Label column(s) {missing} not found, available: {self.value_columns}")
+
+    def get(self, slide_name: str, default: Any = None, columns: Optional[List[str]] = None) -> Any:
+        """
+        单列标签返回标量，多列（如 survival_time, event）返回 tuple。
+        columns: 按该顺序返回的值列（生存标签为 [time_column, event_column]）；None 表示 CSV 中的列顺序
+        """
+        row = self.index.get(slide_name)
+        if row is None:
+            return default
+        if columns is not None:
+            self.check_columns(columns)
+        values = tuple(_to_python(self.columns[c][row]) for c in (self.value_columns if columns is None else columns))
+        return values[0] if len(values) == 1 else values
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_index"] = None
+        return state
+
+
+class LabelStore:
+    """
+    数据集的标签仓库：label_dir 下每个 CSV 是一种标签，标签类型名即文件名（如 classification.csv -> "classification"）。
+    每种标签只在第一次被请求时读入一次。
+    """
+
+    def __init__(self, label_dir: str, key_column: str = "slide_name"):
+        self.label_dir = label_dir
+        self.key_column = key_column
+        self._paths = {}
+        if os.path.isdir(label_dir):
+            for name in sorted(os.listdir(label_dir)):
+                if name.endswith(".csv"):
+                    self._paths[name[:-4]] = os.path.join(label_dir, name)
+        self._tables = {}
+
+    @property
+    def label_types(self) -> List[str]:
+        return list(self._paths)
+
+    def table(self, label_type: str) -> Optional[LabelTable]:
+        if label_type not in self._tables:
+            path = self._paths.get(label_type)
+            self._tables[label_type] = None if path is None else LabelTable.from_csv(path, key_column=self.key_column)
+        return self._tables[label_type]
+
+    def get(self, label_type: str, slide_name: str, default: Any = None, columns: Optional[List[str]] = None) -> Any:
+        table = self.table(label_type)
+        return default if table is None else table.get(slide_name, default, columns)
+
+    def checksum(self, label_types: Optional[List[str]] = None) -> str:
+        """标签文件内容的 sha256（计入结果指纹，标签文件被修正后不会沿用旧结果）；缺失的标签类型记为空。"""
+        digest = hashlib.sha256()
+        for label_type in sorted(self._paths if label_types is None else label_types):
+            digest.update(label_type.encode() + b"\0")
+            path = self._paths.get(label_type)
+            if path is not None:
+                with open(path, "rb") as f:
+                    for block in iter(lambda: f.read(1 << 20), b""):
+                        digest.update(block)
+            digest.update(b"\0")
+        return digest.hexdigest()
 
 
 class BaseDataset(Dataset, ABC):
@@ -20,6 +126,115 @@ class BaseDataset(Dataset, ABC):
         self.processed_base_dir = os.path.join(self.data_root, "preprocessed")
         self.label_base_dir = os.path.join(self.data_root, "label")
         self.data_list = {}  # 用于存储样本信息（例如，WSI路径和标签的元组）
+        self.prefetch = kwargs.get("prefetch") or {}  # 预取配置（datasets.yaml 中的 prefetch: num_workers / depth / backend）
+        self.labels = None  # LabelStore，由子类在确定 dataset_name 后创建
+        self.label_types = None  # 需要返回的标签类型，None 表示 LabelStore 中的全部类型
+        self.label_columns = {}  # label_type -> 按顺序返回的值列（如生存标签的 [time_column, event_column]）
+        self._feature_store = None
+        self.feature_extractor = None  # datasets.preprocessing.FeatureExtractor，特征缺失时按需提取
+
+    def enable_feature_extraction(self, extractor):
+        """特征文件缺失时，用 extractor 从 slide 按需提取并写回 preprocessed/。"""
+        self.feature_extractor = extractor
+
+    def __getstate__(self):
+        # 进程池不能跨进程传递，DataLoader worker 进程中不做按需提取（缺失的特征由 extract_missing_features 预先提取）
+        state = self.__dict__.copy()
+        state["feature_extractor"] = None
+        return state
+
+    def extract_missing_features(self, indices: List[int]):
+        """
+        在本进程中提取 indices 中所有缺失特征的 slide（提取进程池并行处理）。
+        process 预取后端在把数据集交给 DataLoader worker 之前调用，worker 中没有 feature_extractor。
+        """
+        if self.feature_extractor is None:
+            return
+        futures = []
+        for index in indices:
+            slide_name = self.slides[index]
+            if not self.has_features(slide_name):
+                futures.append((slide_name, self.feature_extractor.submit(self.slide_path(slide_name),
+                                                                          self.feature_path(slide_name))))
+        for slide_name, future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(f"Erro: feature extraction failed for {slide_name}: {str(e)}")
+
+    @property
+    def feature_dir(self) -> str:
+        # 子类需设置 dataset_name 与 method（特征提取方法/encoder 名）
+        return os.path.join(self.processed_base_dir, self.dataset_name, self.method)
+
+    @property
+    def feature_store(self) -> Optional[FeatureStore]:
+        """feature_dir/store 下的打包特征库（由 core.feature_store 转换生成），不存在时为 None。"""
+        if self._feature_store is None:
+            store_dir = os.path.join(self.feature_dir, "store")
+            if FeatureStore.exists(store_dir):
+                self._feature_store = FeatureStore(store_dir)
+        return self._feature_store
+
+    def slide_path(self, slide_name: str) -> str:
+        return os.path.join(self.slide_base_dir, self.dataset_name, slide_name)
+
+    def feature_path(self, slide_name: str) -> str:
+        return os.path.join(self.feature_dir, slide_name + ".pt")  # 特征文件假设为pt文件
+
+    def has_features(self, slide_name: str) -> bool:
+        store = self.feature_store
+        return (store is not None and slide_name in store) or os.path.exists(self.feature_path(slide_name))
+
+    def load_embedding(self, slide_name: str) -> Tuple[Any, str]:
+        """
+        读取一张 slide 的 tile 特征：优先从打包特征库 mmap 读取，否则读取单独的 <slide>.pt 文件。
+        Returns:
+            (embedding, feature_path)；特征不存在时 embedding 为 None
+        """
+        store = self.feature_store
+        if store is not None and slide_name in store:
+            return store.get(slide_name), store.shard_path(slide_name)
+        feature = self.feature_path(slide_name)
+        # 校验特征文件是否存在
+        if os.path.exists(feature):
+            return torch.load(feature, map_location="cpu"), feature
+        # 触发预处理流程生成文件(用slide)
+        if self.feature_extractor is not None:
+            try:
+                self.feature_extractor.extract(self.slide_path(slide_name), feature)
+                return torch.load(feature, map_location="cpu"), feature
+            except Exception as e:
+                logger.error(f"Erro: feature extraction failed for {slide_name}: {str(e)}")
+        return None, feature
+
+    def select_labels(self, label_types: List[str], columns: Optional[Dict[str, List[str]]] = None):
+        """
+        只加载、返回任务需要的标签类型（例如 ["classification"]）。
+        columns: label_type -> 按顺序返回的值列；列不存在时立即报错
+        """
+        self.label_types = list(label_types)
+        self.label_columns = {label_type: list(cols) for label_type, cols in (columns or {}).items() if cols}
+        if self.labels is not None:
+            for label_type, cols in self.label_columns.items():
+                table = self.labels.table(label_type)
+                if table is not None:
+                    table.check_columns(cols)
+
+    def label_lookup(self, label_type: str, columns: Optional[List[str]] = None) -> Optional[Callable[[str], Any]]:
+        """slide_name -> 当前标签文件中的标签（columns 同 select_labels）；没有 LabelStore 的数据集返回 None。"""
+        return None if self.labels is None else partial(self.labels.get, label_type, columns=columns)
+
+    def label_checksum(self, label_types: List[str]) -> Optional[str]:
+        return None if self.labels is None else self.labels.checksum(label_types)
+
+    def slide_labels(self, slide_name: str) -> Dict[str, Any]:
+        """{"<label type>_label": label}，缺失的标签为 None。"""
+        if self.labels is None:
+            return {}
+        label_types = self.label_types if self.label_types is not None else self.labels.label_types
+        return {f"{label_type}_label": self.labels.get(label_type, slide_name, columns=self.label_columns.get(label_type))
+                for label_type in label_types}
 
     @abstractmethod
     def __getitem__(self, index: int) -> Dict[str, Any]:
@@ -29,4 +244,44 @@ class BaseDataset(Dataset, ABC):
     @abstractmethod
     def __len__(self) -> int:
 
-        return len(self.data_list)
\ No newline at end of file
+        return len(self.data_list)
+
+
+def _as_tile_bag(embedding):
+    # 统一成 [n_tiles, dim] 的 float tensor；特征文件可能是 {"embeddings": tensor, ...} 的字典
+    if embedding is None:
+        return None
+    if isinstance(embedding, dict):
+        embedding = embedding["embeddings"]
+    bag = torch.as_tensor(embedding, dtype=torch.float32)
+    if bag.ndim == 1:
+        bag = bag.unsqueeze(0)
+    elif bag.ndim == 3 and bag.shape[0] == 1:
+        bag = bag.squeeze(0)
+    return bag
+
+
+def _bag_coords(embedding):
+    return embedding.get("coords") if isinstance(embedding, dict) else None
+
+
+def collate_tile_bags(batch: List[Dict[str, Any]], long_bag=None) -> Dict[str, Any]:
+    """
+    DataLoader 的 collate_fn：把长度不一的 tile bag 补齐为 [B, N_max, D]，并生成 attention mask [B, N_max]。
+    若 batch 中有样本缺少特征（embedding 为 None），则不做补齐，embedding 以 list 返回，mask 为 None。
+    long_bag: 可选的 core.long_bag.LongBagPolicy，补齐前把每个超过 max_tiles 的 bag 缩减到上限以内
+              （用 functools.partial 绑定后作为 collate_fn；不补齐时同样对每个非 None 的 bag 生效）
+    """
+    bags = [_as_tile_bag(item.get("embedding")) for item in batch]
+    slide_infos = [item.get("slide_info") for item in batch]
+    if long_bag is not None:
+        bags = [None if bag is None else long_bag.reduce(bag, _bag_coords(item.get("embedding")))[0]
+                for bag, item in zip(bags, batch)]
+    if any(bag is None for bag in bags):
+        embeddings = bags if long_bag is not None else [item.get("embedding") for item in batch]
+        return {"embedding": embeddings, "mask": None, "slide_info": slide_infos}
+
+    lengths = torch.tensor([bag.shape[0] for bag in bags])
+    embeddings = pad_sequence(bags, batch_first=True)
+    mask = torch.arange(embeddings.shape[1])[None, :] < lengths[:, None]
+    return {"embedding": embeddings, "mask": mask, "slide_info": slide_infos}
@@ -1,24 +1,99 @@
 from abc import ABC, abstractmethod
-from transformers import AutoModel
 import os
+import hashlib
 from utils.logger import default_logger as logger
 
+def weights_checksum(model_path: str) -> str:
+    """Checksum over the files under model_path (relative names, sizes, mtimes); cheap, no weights are read."""
+    digest = hashlib.sha256()
+    if model_path is not None and os.path.exists(model_path):
+        for root, _, files in sorted(os.walk(model_path)):
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                digest.update(f"{os.path.relpath(path, model_path)}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+    return digest.hexdigest()
+
+
+# 推理精度，见 core/precision.py
+PRECISIONS = ("fp32", "fp16", "bf16", "int8_dynamic", "int8_weight_only")
+
+
+def resolve_precision(precision, device) -> str:
+    """None 时沿用原来的默认：CUDA 上 fp16 autocast，其余设备 fp32。不 import torch，可在调度进程中调用。"""
+    on_cuda = str(device).startswith("cuda")
+    if precision is None:
+        return "fp16" if on_cuda else "fp32"
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision '{precision}', expected one of {', '.join(PRECISIONS)}")
+    if precision == "int8_dynamic" and on_cuda:
+        raise ValueError("precision 'int8_dynamic' is CPU only; use 'int8_weight_only' or 'fp16' on CUDA")
+    if precision == "fp16" and not on_cuda:
+        raise ValueError(f"precision 'fp16' needs a CUDA device (got '{device}'); use 'bf16' on CPU")
+    return precision
+
+
 class BaseModel(ABC):
-    def __init__(self, model_path: str, device: str, model_name: str):
+    # 是否有独立的 slide encoder（encode_batch 的输出是每张 slide 的表征，可被缓存、被多个 head 共享）
+    has_slide_encoder = False
+
+    def __init__(self, model_path: str, device: str, model_name: str, low_memory: bool = True,
+                 precision: str = None, long_bag: dict = None, generation: dict = None):
         self.model_name = model_name
         self.model_path = model_path
         self.device = device
+        self.precision = resolve_precision(precision, device)
+        # 超长 tile bag 的处理策略（configs/models.yaml 中的 long_bag，见 core/long_bag.py），None 表示整包推理
+        self.long_bag = None
+        if long_bag:
+            from core.long_bag import LongBagPolicy
+            self.long_bag = LongBagPolicy(**long_bag)
+            if self.long_bag.strategy == "chunked" and not self.supports_chunked_encoding():
+                logger.info(f"⚠️ Warning: {model_name} does not implement encode_chunk; long_bag strategy 'chunked' "
+                            f"only caps bags at max_tiles and each bag is encoded as a whole.")
+        # 报告生成的解码设置（configs/models.yaml 中的 generation，见 core/generation.py）
+        self.generation = dict(generation or {})
+        self._generator = None
         if self.model_path is None or not os.path.exists(self.model_path):
             logger.info(f"⚠️ Warning: Model path '{self.model_path}' is None or does not exist. Model will not be loaded.")
             self.model = None
             # raise ValueError(f"Model path {self.model_path} does not exist.")
         else:
-            self.model = AutoModel.from_pretrained(
-                model_path,
-                trust_remote_code=True
-            ).to(self.device)
+            # low_memory: meta device 上构建结构 + mmap 权重，多个 worker 共享只读权重页（见 core/weights.py）
+            from core.weights import load_pretrained
+            from core.precision import apply_precision
+            self.model = apply_precision(load_pretrained(model_path, device=self.device, low_memory=low_memory),
+                                         self.precision)
+        self._weights_checksum = None
         logger.info(f"🚀 Successfully loaded {self.model_name}")
-        
+
+    def weights_checksum(self) -> str:
+        """Checksum over the weight files under model_path (relative names, sizes, mtimes); computed once."""
+        if self._weights_checksum is None:
+            self._weights_checksum = weights_checksum(self.model_path)
+        return self._weights_checksum
+
+    def inference_settings(self) -> dict:
+        """Settings that change the model outputs; part of every cache key / result fingerprint."""
+        settings = {"device": self.device, "precision": self.precision}
+        if self.long_bag is not None:
+            settings["long_bag"] = self.long_bag.settings()
+        if self.generation:
+            settings["generation"] = self.generation
+        return settings
+
+    def autocast(self):
+        """Context for inference code: autocast for fp16 / bf16, a no-op for the other precisions."""
+        from core.precision import autocast
+        return autocast(self.device, self.precision)
+
+    def memory_footprint(self) -> int:
+        """Approximate bytes held by the loaded weights (parameters + buffers)."""
+        if self.model is None:
+            return 0
+        tensors = list(self.model.parameters()) + list(self.model.buffers())
+        return sum(t.numel() * t.element_size() for t in tensors)
+
     @abstractmethod
     def report_generate(self, feature):
         """Generate pathology report (if supported by the model)"""
@@ -39,4 +114,120 @@ class BaseModel(ABC):
         Returns:
             Survival probability or risk score
         """
-        pass
\ No newline at end of file
+        pass
+
+    @staticmethod
+    def iter_bags(features, mask=None):
+        """Split a collated batch back into per-slide tile bags, dropping padded tiles."""
+        for i, feature in enumerate(features):
+            if mask is not None:
+                feature = feature[mask[i]]
+            yield feature
+
+    def classify_batch(self, features, num_classes, mask=None):
+        """
+        Batched classification. Default implementation loops over `classify`.
+        Args:
+            features: padded tile bags [B, N, D] (or a list of per-slide features)
+            num_classes: number of classes
+            mask: optional bool attention mask [B, N], True for real tiles
+        Returns:
+            List of per-slide prediction dicts
+        """
+        return [self.classify(feature, num_classes) for feature in self.iter_bags(features, mask)]
+
+    def survival_predict_batch(self, features, time_horizon=None, mask=None):
+        """Batched survival prediction. Default implementation loops over `survival_predict`."""
+        return [self.survival_predict(feature, time_horizon) for feature in self.iter_bags(features, mask)]
+
+    def report_generate_batch(self, features, mask=None):
+        """Batched report generation. Default implementation loops over `report_generate`."""
+        return [self.report_generate(feature) for feature in self.iter_bags(features, mask)]
+
+    def encode_batch(self, features, mask=None):
+        """
+        Slide encoder shared by all task heads.
+        Models with `has_slide_encoder = True` return one representation per slide
+        (a tensor or a dict of tensors). The default has no shared encoder and passes
+        the padded batch through, so the heads fall back to the `*_batch` methods.
+        Returns:
+            Slide representations accepted by the `*_from_latents` heads
+        """
+        return features, mask
+
+    def encode_chunk(self, chunk):
+        """
+        Tile encoder for one chunk of a long bag (long_bag strategy "chunked").
+        Args:
+            chunk: [n, D] tiles of one slide, n <= long_bag.chunk_size
+        Returns:
+            (values [n, D'], attention logits [n, H] or None for mean pooling)
+        """
+        raise NotImplementedError(f"{self.model_name} does not implement encode_chunk for chunked long-bag inference")
+
+    def supports_chunked_encoding(self) -> bool:
+        return type(self).encode_chunk is not BaseModel.encode_chunk
+
+    def use_chunked_encoding(self) -> bool:
+        """encode_batch 是否应逐 slide 走 pool_long_bag（long_bag.strategy 为 chunked 且模型实现了 encode_chunk）。"""
+        return self.long_bag is not None and self.long_bag.strategy == "chunked" and self.supports_chunked_encoding()
+
+    def pool_long_bag(self, bag):
+        """
+        Slide representation of one tile bag with bounded memory: the bag is encoded chunk by chunk
+        (`encode_chunk`) and the attention pooling is merged with a streaming softmax, so peak memory
+        depends on long_bag.chunk_size rather than on the number of tiles.
+        """
+        from core.long_bag import LongBagPolicy, StreamingAttentionPool
+        policy = self.long_bag or LongBagPolicy("chunked", max_tiles=None)
+        pool = StreamingAttentionPool()
+        for chunk in policy.chunks(bag):
+            pool.update(*self.encode_chunk(chunk))
+        return pool.compute()
+
+    def decode_step(self, input_ids, encoder_states, encoder_mask, past):
+        """
+        One decoder step for report generation, used by `generate_reports`.
+        Args:
+            input_ids: [N, 1] latest token of every beam ([N, T] on the first step / without cache)
+            encoder_states: padded cross-attention states [N, S, D]
+            encoder_mask: [N, S], True for real positions
+            past: KV cache returned by the previous step (None on the first step)
+        Returns:
+            (logits [N, V], updated KV cache)
+        """
+        raise NotImplementedError(f"{self.model_name} does not implement decode_step for report generation")
+
+    def generate_reports(self, encoder_states):
+        """
+        Beam search over several slides at once (core.generation.BeamSearchGenerator): the slides'
+        cross-attention states are padded into one batch, the KV cache is reused across steps and
+        slides leave the batch as soon as their search is finished.
+        Args:
+            encoder_states: per-slide cross-attention states [S_i, D]
+        Returns:
+            Token ids of the best hypothesis per slide
+        """
+        if self._generator is None:
+            from core.generation import BeamSearchGenerator, GenerationConfig
+            self._generator = BeamSearchGenerator(self.decode_step, GenerationConfig(**self.generation))
+        return self._generator.generate(encoder_states)
+
+    def pop_generation_stats(self):
+        """Tokens/sec and per-report latency accumulated since the last call (None if nothing was generated)."""
+        return None if self._generator is None else self._generator.pop_stats()
+
+    def classify_from_latents(self, latents, num_classes):
+        """Classification head on the output of `encode_batch`."""
+        features, mask = latents
+        return self.classify_batch(features, num_classes, mask=mask)
+
+    def survival_predict_from_latents(self, latents, time_horizon=None):
+        """Survival head on the output of `encode_batch`."""
+        features, mask = latents
+        return self.survival_predict_batch(features, time_horizon, mask=mask)
+
+    def report_generate_from_latents(self, latents):
+        """Report generation head on the output of `encode_batch`."""
+        features, mask = latents
+        return self.report_generate_batch(features, mask=mask)
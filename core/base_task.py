@@ -2,39 +2,167 @@ from abc import ABC, abstractmethod
 import os
 import numpy as np
 import json
-from typing import Dict, Any
+import time
+from functools import partial
+from typing import Dict, Any, List, Optional
 from .base_model import BaseModel
-from .base_dataset import BaseDataset
+from .base_dataset import BaseDataset, collate_tile_bags
+from .slide_cache import SlideEmbeddingCache, encode_slides
+from .prefetch import PrefetchLoader
+from .journal import JournalPredictions, PredictionJournal, pending_indices
+from .predictions import atomic_write, prediction_columns, write_predictions
+from .results_db import ResultsIndex
+from . import tracing
 from utils.logger import default_logger as logger
+from utils.accumulators import StreamingMetrics
 
 class BaseTask(ABC):
-    def __init__(self, task_name: str, metrics: list, output_root: str = "results"):
+    # 本任务使用的标签类型（对应 label/<dataset>/<label_type>.csv），由子类指定
+    label_type = None
+    # 标签 CSV 中按顺序返回的值列，None 表示按文件中的列顺序
+    label_columns = None
+    # config.json 任务配置中传给构造函数的额外键
+    config_options = ()
+
+    def __init__(self, task_name: str, metrics: list, output_root: str = "results", batch_size: int = 1,
+                 slide_cache: Optional[SlideEmbeddingCache] = None, bootstrap: Optional[Dict[str, Any]] = None,
+                 results_index: Optional[ResultsIndex] = None, auc_bins: Optional[int] = None):
         self.task_name = task_name
         self.metrics = metrics
         self.output_root = output_root
+        self.batch_size = batch_size
+        self.slide_cache = slide_cache
+        # bootstrap 置信区间的设置（n_resamples / confidence / seed），None 表示只计算点估计
+        self.bootstrap = bootstrap
+        # AUC 直方图的桶数（runtime.yaml / config.json 中的 auc_bins），None 为精确模式
+        self.auc_bins = auc_bins
+        # 可选的 SQLite 结果索引，save_results 时 upsert 本次的指标
+        self.results_index = results_index
         os.makedirs(output_root, exist_ok=True)
-        
+
+    @property
+    def label_key(self) -> str:
+        # slide_info 中对应本任务标签的字段名
+        return f"{self.label_type}_label"
+
+    def build_loader(self, dataset: BaseDataset, journal: Optional[PredictionJournal] = None,
+                     long_bag=None) -> PrefetchLoader:
+        dataset.select_labels([self.label_type], {self.label_type: self.label_columns})
+        # journal 中已有预测的 slide 不再读取特征；long_bag 为模型的长 bag 设置，超长的 bag 在 collate 时缩减
+        return PrefetchLoader(dataset, batch_size=self.batch_size,
+                              collate_fn=partial(collate_tile_bags, long_bag=long_bag),
+                              indices=pending_indices(dataset.slides, [journal]), **dataset.prefetch)
+
+    def result_dir(self, model_name: str, dataset_name: str) -> str:
+        return os.path.join(self.output_root, self.task_name, model_name, dataset_name)
+
+    def is_complete(self, model_name: str, dataset_name: str, journal: PredictionJournal, slide_names: List[str]) -> bool:
+        """结果已按同一 fingerprint（及 bootstrap / auc_bins 设置）保存，且日志覆盖了数据集当前的全部 slide。"""
+        run_path = os.path.join(self.result_dir(model_name, dataset_name), 'run.json')
+        if not os.path.exists(run_path) or not journal.covers(slide_names):
+            return False
+        with open(run_path, 'r') as f:
+            run = json.load(f)
+        return (run.get("fingerprint") == journal.fingerprint and run.get("bootstrap") == self.bootstrap
+                and run.get("auc_bins") == self.auc_bins)
+
+    def open_journal(self, model_name: str, dataset_name: str, fingerprint: str) -> PredictionJournal:
+        path = os.path.join(self.result_dir(model_name, dataset_name), f"journal_{fingerprint[:16]}.jsonl")
+        return PredictionJournal(path, fingerprint)
+
+    def log_throughput(self, model: BaseModel, num_slides: int, elapsed: float):
+        slides_per_sec = num_slides / elapsed if elapsed > 0 else float("inf")
+        logger.info(f"{self.task_name} - {model.model_name}: {num_slides} slides in {elapsed:.2f}s "
+                    f"({slides_per_sec:.2f} slides/sec, batch_size={self.batch_size})")
+
+    def log_task_stats(self, model: BaseModel):
+        """评估结束后记录任务特有的统计，由子类按需实现。"""
+        pass
+
     @abstractmethod
-    def evaluate(self, model: BaseModel, dataset: BaseDataset, **kwargs) -> Dict[str, Any]:
+    def predict_from_latents(self, model: BaseModel, latents, **kwargs) -> List[Any]:
+        """Run this task's head on slide representations produced by `model.encode_batch`."""
         pass
+
+    def metric_kwargs(self, test_configs: Dict[str, Any]) -> Dict[str, Any]:
+        """除 (labels, preds) 外传给本任务指标函数的参数，由子类按需指定。"""
+        return {}
+
+    def metric_state(self, **metric_kwargs) -> StreamingMetrics:
+        """本任务全部指标的流式累加器（开启 bootstrap 时附带置信区间）。"""
+        return StreamingMetrics(self.metrics, self.bootstrap, auc_bins=self.auc_bins, **metric_kwargs)
+
+    def compute_metrics(self, all_labels: list, all_preds: list, **metric_kwargs) -> Dict[str, Any]:
+        state = self.metric_state(**metric_kwargs)
+        state.update(all_labels, all_preds)
+        return state.compute(lambda: (all_labels, all_preds))
+
+    def evaluate(self, model: BaseModel, dataset: BaseDataset, journal: Optional[PredictionJournal] = None, **kwargs):
+        """
+        指标按 batch 流式累加，预测逐 batch 追加进预测日志，内存中不保留整个队列的标签与预测。
+
+        Args:
+            journal: 可选的逐 slide 预测日志；已记录的 slide 被跳过（其预测直接从日志计入指标）。
+                     不给出时使用临时日志
+
+        Returns:
+            (metric_results, predictions)，predictions 为 JournalPredictions，保存时按 dataset.slides 的顺序从日志读出
+        """
+        journal = journal if journal is not None else PredictionJournal.temporary()
+        # 日志中已有的 slide 用当前标签文件中的标签计入指标
+        label_lookup = dataset.label_lookup(self.label_type, self.label_columns)
+        state = self.metric_state(**self.metric_kwargs(kwargs))
+        for labels, preds in journal.iter_batches(dataset.slides, label_lookup=label_lookup):
+            state.update(labels, preds)
+
+        loader = self.build_loader(dataset, journal, model.long_bag)
+        start = time.perf_counter()
+        num_slides = 0
+        for batch in loader:
+            with tracing.span("encode"):
+                latents = encode_slides(model, batch, self.slide_cache)
+            with tracing.span("head", self.task_name):
+                preds = self.predict_from_latents(model, latents, **kwargs)
+            labels = [slide_info.get(self.label_key) for slide_info in batch.get("slide_info")]
+            slide_names = [slide_info.get("slide_name") for slide_info in batch.get("slide_info")]
+            journal.append(slide_names, preds, labels)
+            with tracing.span("metrics_update", self.task_name):
+                state.update(labels, preds)
+            num_slides += len(preds)
+        self.log_throughput(model, num_slides, time.perf_counter() - start)
+        self.log_task_stats(model)
+        loader.log_stats(f"{self.task_name} - {model.model_name}")
+
+        predictions = JournalPredictions(journal, dataset.slides, label_lookup)
+        with tracing.span("metrics_compute", self.task_name):
+            metric_results = state.compute(predictions.samples)
+        return metric_results, predictions
   
-    def save_results(self, model_name: str, dataset_name: str, 
-                    metrics: Dict[str, Any], predictions: Dict[str, Any]):
-        
-        os.makedirs(self.output_root, exist_ok=True)
-        task_dir = os.path.join(self.output_root, self.task_name)
-        os.makedirs(task_dir, exist_ok=True)
-        model_dir = os.path.join(task_dir, model_name)
-        os.makedirs(model_dir, exist_ok=True)
-        dataset_dir = os.path.join(model_dir, dataset_name)
+    def save_results(self, model_name: str, dataset_name: str,
+                     metrics: Dict[str, Any], predictions: JournalPredictions, fingerprint: Optional[str] = None):
+        """
+        metrics.json 为指标；预测以列式 predictions.npz 保存（另附给人看的 predictions_summary.json），
+        读取见 core.predictions.read_predictions。所有文件都是原子写入。
+        开启 tracing 时 metrics.json 另有 "timings"：本 (task, model, dataset) 各阶段耗时的分位数（见 core/tracing.py）。
+        """
+        dataset_dir = self.result_dir(model_name, dataset_name)
         os.makedirs(dataset_dir, exist_ok=True)
-        
-        metrics_path = os.path.join(dataset_dir, 'metrics.json')
-        with open(metrics_path, 'w') as f:
-            json.dump(metrics, f, indent=4)
-            
-        pred_path = os.path.join(dataset_dir, 'predictions.json')
-        with open(pred_path, 'w') as f:
-            json.dump(predictions, f, indent=4)
-
-        logger.info(f"Results saved to: {dataset_dir}")
\ No newline at end of file
+
+        with tracing.span("save", self.task_name):
+            slide_names, labels, preds = predictions.collect()
+            write_predictions(dataset_dir, prediction_columns(slide_names, labels, preds))
+
+        timings = tracing.summary(self.task_name, model_name, dataset_name)
+        with atomic_write(os.path.join(dataset_dir, 'metrics.json')) as f:
+            json.dump(metrics if timings is None else {**metrics, "timings": timings}, f, indent=4)
+
+        if fingerprint is not None:
+            # 记录这份结果对应的 fingerprint，用于判断下次运行能否整体跳过
+            with atomic_write(os.path.join(dataset_dir, 'run.json')) as f:
+                json.dump({"fingerprint": fingerprint, "num_predictions": len(preds),
+                           "bootstrap": self.bootstrap, "auc_bins": self.auc_bins}, f, indent=4)
+
+        if self.results_index is not None:
+            self.results_index.upsert(self.task_name, model_name, dataset_name, metrics, fingerprint)
+
+        logger.info(f"Results saved to: {dataset_dir}")
@@ -0,0 +1,182 @@
+import os
+import time
+import traceback
+import multiprocessing as mp
+from collections import deque
+from multiprocessing.connection import wait
+from typing import Any, Callable, Dict, List, Optional, Sequence
+from utils.logger import default_logger as logger
+
+# 计算库读取这些环境变量决定线程池大小，必须在 worker 进程 import torch 之前设置
+_THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS")
+
+
+def available_cpus() -> List[int]:
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def split_cpus(cpus: Sequence[int], num_slots: int) -> List[List[int]]:
+    """把 CPU 均分成 num_slots 份互不重叠的集合；CPU 少于 slot 数时循环复用。"""
+    if len(cpus) < num_slots:
+        return [[cpus[i % len(cpus)]] for i in range(num_slots)]
+    size, extra = divmod(len(cpus), num_slots)
+    slots, start = [], 0
+    for i in range(num_slots):
+        end = start + size + (1 if i < extra else 0)
+        slots.append(list(cpus[start:end]))
+        start = end
+    return slots
+
+
+def _worker_loop(conn, cpus: Optional[List[int]], num_threads: int, job_fn: Callable, job_args: tuple):
+    """worker 进程入口：绑定 CPU、限定线程数后，循环执行父进程发来的 job，直到收到 None。"""
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+    import torch
+    torch.set_num_threads(num_threads)
+
+    while True:
+        job = conn.recv()
+        if job is None:
+            break
+        try:
+            conn.send(("ok", job_fn(job, *job_args)))
+        except Exception as e:
+            conn.send(("error", f"{e}\n{traceback.format_exc()}"))
+    conn.close()
+
+
+class _Slot:
+    def __init__(self, index: int, cpus: Optional[List[int]], num_threads: int):
+        self.index = index
+        self.cpus = cpus
+        self.num_threads = num_threads
+        self.process = None
+        self.conn = None
+        self.job = None
+        self.started = 0.0
+
+
+class GridExecutor:
+    """
+    在进程池中并行执行 task × model × dataset 网格中相互独立的 job。
+    每个 worker 常驻（进程内的模型池/缓存可跨 job 复用），绑定一组互不重叠的 CPU，
+    torch 线程数按 CPU 预算设置，避免多个 job 争抢同一批核心。
+    某个 job 抛异常只记为失败；worker 进程崩溃（OOM、段错误）时只有它正在执行的 job 失败，并重启该 worker。
+
+    Args:
+        num_workers: 并行 job 数，<= 1 时在当前进程中顺序执行
+        threads_per_job: 每个 job 的 torch 线程数，None 表示按 CPU 数 / num_workers 均分
+        pin_cpus: 是否把每个 worker 绑定到独立的 CPU 集合
+    """
+
+    def __init__(self, num_workers: int = 1, threads_per_job: Optional[int] = None, pin_cpus: bool = True):
+        self.num_workers = max(1, int(num_workers))
+        cpus = available_cpus()
+        self.cpu_slots = split_cpus(cpus, self.num_workers)
+        self.threads_per_job = threads_per_job or max(1, len(cpus) // self.num_workers)
+        self.pin_cpus = pin_cpus
+        self.failed = 0
+
+    def run(self, jobs: Sequence[Dict[str, Any]], job_fn: Callable, *job_args) -> List[Any]:
+        """按 jobs 的顺序返回每个 job 的结果，失败的 job 对应 None。"""
+        self.failed = 0
+        if self.num_workers <= 1:
+            return [self._run_inline(i, job, job_fn, job_args) for i, job in enumerate(jobs)]
+        return self._run_parallel(jobs, job_fn, job_args)
+
+    def _run_inline(self, index: int, job: Dict[str, Any], job_fn: Callable, job_args: tuple):
+        try:
+            return job_fn(job, *job_args)
+        except Exception as e:
+            self._fail(index, job, str(e))
+            return None
+
+    def _fail(self, index: int, job: Dict[str, Any], reason: str):
+        self.failed += 1
+        logger.error(f"Erro: job {index} ({job.get('name', '')}) Execution failed: {reason}")
+
+    def _start(self, slot: _Slot, job_fn: Callable, job_args: tuple):
+        ctx = mp.get_context("spawn")
+        parent_conn, child_conn = ctx.Pipe()
+        # spawn 出的子进程继承父进程此刻的环境变量
+        saved = {name: os.environ.get(name) for name in _THREAD_ENV_VARS}
+        os.environ.update({name: str(slot.num_threads) for name in _THREAD_ENV_VARS})
+        try:
+            # 非 daemon：job 内部还会启动子进程（指标进程池、DataLoader worker、特征提取 / 切 tile 进程池），
+            # daemon 进程不允许有子进程；worker 由 _run_parallel 的 finally 中 _stop 显式关闭
+            slot.process = ctx.Process(target=_worker_loop, name=f"grid-worker-{slot.index}",
+                                       args=(child_conn, slot.cpus, slot.num_threads, job_fn, job_args))
+            slot.process.start()
+        finally:
+            for name, value in saved.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+        child_conn.close()
+        slot.conn = parent_conn
+
+    def _run_parallel(self, jobs: Sequence[Dict[str, Any]], job_fn: Callable, job_args: tuple) -> List[Any]:
+        slots = [_Slot(i, cpus if self.pin_cpus else None, self.threads_per_job)
+                 for i, cpus in enumerate(self.cpu_slots[:len(jobs)])]
+        logger.info(f"Running {len(jobs)} jobs on {len(slots)} workers, {self.threads_per_job} threads each"
+                    + (f", CPUs {[slot.cpus for slot in slots]}" if self.pin_cpus else ""))
+        results = [None] * len(jobs)
+        pending = deque(range(len(jobs)))
+
+        try:
+            while pending or any(slot.job is not None for slot in slots):
+                for slot in slots:
+                    if slot.job is None and pending:
+                        if slot.process is None:
+                            self._start(slot, job_fn, job_args)
+                        slot.job = pending.popleft()
+                        slot.started = time.perf_counter()
+                        slot.conn.send(jobs[slot.job])
+
+                busy = [slot for slot in slots if slot.job is not None]
+                ready = wait([slot.conn for slot in busy] + [slot.process.sentinel for slot in busy])
+                for slot in busy:
+                    message = None
+                    if slot.conn in ready:
+                        try:
+                            message = slot.conn.recv()
+                        except EOFError:
+                            slot.process.join()
+                    if message is not None:
+                        index, slot.job = slot.job, None
+                        status, payload = message
+                        if status == "ok":
+                            results[index] = payload
+                            logger.info(f"Job {index} ({jobs[index].get('name', '')}) done on worker {slot.index} "
+                                        f"in {time.perf_counter() - slot.started:.1f}s")
+                        else:
+                            self._fail(index, jobs[index], payload)
+                    elif not slot.process.is_alive():
+                        # worker 进程异常退出：只有它手上的 job 失败，下一轮重新拉起一个 worker
+                        slot.process.join()
+                        self._fail(slot.job, jobs[slot.job], f"worker exited with code {slot.process.exitcode}")
+                        slot.conn.close()
+                        slot.job, slot.process = None, None
+        finally:
+            for slot in slots:
+                self._stop(slot)
+        return results
+
+    @staticmethod
+    def _stop(slot: _Slot):
+        if slot.process is None:
+            return
+        try:
+            slot.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        slot.process.join(timeout=10)
+        if slot.process.is_alive():
+            slot.process.terminate()
+            slot.process.join()
+        slot.conn.close()
+        slot.process = None
@@ -0,0 +1,176 @@
+import os
+import json
+import argparse
+from typing import Any, Dict, Optional
+import numpy as np
+import torch
+from utils.logger import default_logger as logger
+
+INDEX_FILE = "index.json"
+
+
+def _shard_name(kind: str, shard_id: int) -> str:
+    return f"{kind}_{shard_id:05d}.bin"
+
+
+class FeatureStoreWriter:
+    """
+    打包写入 tile 特征：大量 slide 的特征首尾相接写进少数几个大的 shard 文件，
+    index.json 记录 slide_name -> (shard, offset, n_tiles, dim)。
+
+    store_dir/
+        index.json
+        embeddings_00000.bin   # 原始行主序数组，无 pickle 头
+        coords_00000.bin       # 对应的 tile 坐标 [n_tiles, 2]（可选）
+
+    Args:
+        store_dir: 特征库目录
+        shard_size_gb: 单个 shard 的目标大小，写满后开启新 shard
+    """
+
+    def __init__(self, store_dir: str, shard_size_gb: float = 4.0):
+        self.store_dir = store_dir
+        self.shard_size_bytes = int(shard_size_gb * 1024 ** 3)
+        os.makedirs(store_dir, exist_ok=True)
+        self.index = {"version": 1, "slides": {}}
+        self._shard_id = -1
+        self._embedding_file = None
+        self._coords_file = None
+        self._shard_bytes = 0
+        self._open_shard()
+
+    def _open_shard(self):
+        self._close_shard()
+        self._shard_id += 1
+        self._embedding_file = open(os.path.join(self.store_dir, _shard_name("embeddings", self._shard_id)), "wb")
+        self._coords_file = open(os.path.join(self.store_dir, _shard_name("coords", self._shard_id)), "wb")
+        self._shard_bytes = 0
+
+    def _close_shard(self):
+        for f in (self._embedding_file, self._coords_file):
+            if f is not None:
+                f.close()
+
+    def add(self, slide_name: str, embeddings, coords=None):
+        embeddings = np.ascontiguousarray(torch.as_tensor(embeddings).detach().cpu().numpy())
+        if embeddings.ndim == 3 and embeddings.shape[0] == 1:
+            embeddings = embeddings[0]
+        if embeddings.ndim != 2:
+            raise ValueError(f"Expected [n_tiles, dim] embeddings for {slide_name}, got shape {embeddings.shape}")
+        if self._shard_bytes > 0 and self._shard_bytes + embeddings.nbytes > self.shard_size_bytes:
+            self._open_shard()
+
+        entry = {
+            "shard": self._shard_id,
+            "offset": self._embedding_file.tell(),
+            "n_tiles": int(embeddings.shape[0]),
+            "dim": int(embeddings.shape[1]),
+            "dtype": embeddings.dtype.str,
+        }
+        self._embedding_file.write(embeddings.tobytes())
+        if coords is not None:
+            coords = np.ascontiguousarray(torch.as_tensor(coords).detach().cpu().numpy()).reshape(embeddings.shape[0], -1)
+            entry["coords_offset"] = self._coords_file.tell()
+            entry["coords_dtype"] = coords.dtype.str
+            entry["coords_dim"] = int(coords.shape[1])
+            self._coords_file.write(coords.tobytes())
+        self._shard_bytes += embeddings.nbytes
+        self.index["slides"][slide_name] = entry
+
+    @property
+    def num_shards(self) -> int:
+        return self._shard_id + 1
+
+    def close(self):
+        self._close_shard()
+        # 先写临时文件再替换，读者看到的 index 总是完整的
+        tmp_path = os.path.join(self.store_dir, INDEX_FILE + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(self.index, f)
+        os.replace(tmp_path, os.path.join(self.store_dir, INDEX_FILE))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class FeatureStore:
+    """
+    只读的打包特征库。shard 文件整体 mmap（copy-on-write），按 index 切片，读取不做拷贝也不反序列化。
+    pickle 时不携带 mmap，DataLoader worker 中按需重新打开。
+    """
+
+    def __init__(self, store_dir: str):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, INDEX_FILE), "r") as f:
+            self.slides = json.load(f)["slides"]
+        self._maps = {}
+
+    @staticmethod
+    def exists(store_dir: str) -> bool:
+        return os.path.exists(os.path.join(store_dir, INDEX_FILE))
+
+    def __contains__(self, slide_name: str) -> bool:
+        return slide_name in self.slides
+
+    def __len__(self) -> int:
+        return len(self.slides)
+
+    def shard_path(self, slide_name: str, kind: str = "embeddings") -> str:
+        return os.path.join(self.store_dir, _shard_name(kind, self.slides[slide_name]["shard"]))
+
+    def _map(self, path: str) -> Optional[np.memmap]:
+        if path not in self._maps:
+            self._maps[path] = np.memmap(path, dtype=np.uint8, mode="c") if os.path.getsize(path) > 0 else None
+        return self._maps[path]
+
+    def _slice(self, path: str, offset: int, dtype: str, rows: int, cols: int) -> torch.Tensor:
+        dtype = np.dtype(dtype)
+        if rows * cols == 0:
+            return torch.from_numpy(np.empty((rows, cols), dtype=dtype))
+        buffer = self._map(path)[offset: offset + rows * cols * dtype.itemsize]
+        return torch.from_numpy(buffer.view(dtype).reshape(rows, cols))
+
+    def get(self, slide_name: str) -> Dict[str, Any]:
+        entry = self.slides[slide_name]
+        embeddings = self._slice(self.shard_path(slide_name), entry["offset"], entry["dtype"],
+                                 entry["n_tiles"], entry["dim"])
+        coords = None
+        if "coords_offset" in entry:
+            coords = self._slice(self.shard_path(slide_name, "coords"), entry["coords_offset"],
+                                 entry["coords_dtype"], entry["n_tiles"], entry["coords_dim"])
+        return {"embeddings": embeddings, "coords": coords}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_maps"] = {}
+        return state
+
+
+def convert_pt_dir(pt_dir: str, store_dir: Optional[str] = None, shard_size_gb: float = 4.0) -> str:
+    """
+    把 preprocessed/<dataset>/<method>/<slide>.pt 的旧布局转换为打包特征库（默认写到 <pt_dir>/store）。
+    .pt 文件可以是 tensor，也可以是包含 "embeddings"（和可选 "coords"）的字典。
+    """
+    store_dir = store_dir or os.path.join(pt_dir, "store")
+    names = sorted(name for name in os.listdir(pt_dir) if name.endswith(".pt"))
+    with FeatureStoreWriter(store_dir, shard_size_gb=shard_size_gb) as writer:
+        for name in names:
+            data = torch.load(os.path.join(pt_dir, name), map_location="cpu")
+            if isinstance(data, dict):
+                writer.add(name[:-3], data["embeddings"], data.get("coords"))
+            else:
+                writer.add(name[:-3], data)
+    logger.info(f"Packed {len(names)} feature files from {pt_dir} into {writer.num_shards} shard(s) at {store_dir}")
+    return store_dir
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a directory of per-slide .pt features into a packed feature store")
+    parser.add_argument("pt_dir", help="preprocessed/<dataset>/<method>/ directory holding <slide>.pt files")
+    parser.add_argument("--store_dir", default=None, help="output directory, defaults to <pt_dir>/store")
+    parser.add_argument("--shard_size_gb", type=float, default=4.0)
+    args = parser.parse_args()
+    convert_pt_dir(args.pt_dir, args.store_dir, args.shard_size_gb)
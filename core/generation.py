@@ -0,0 +1,317 @@
+import time
+import argparse
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+import torch
+import torch.nn.functional as F
+from utils.logger import default_logger as logger
+
+# 多张 slide 一起做 beam search 的报告生成引擎：
+#   - 各 slide 的 cross-attention 状态（image latents，长度可不同）补齐成 [B, S_max, D] 并附带 mask，
+#     每个 beam 一行，整批共用一次 decoder 调用；
+#   - decoder 的 KV cache 在步与步之间复用，每步只输入最新的 token，beam 重排时按行 index_select；
+#   - 某张 slide 的 beam search 结束（已有 num_beams 个完成的假设且不可能更优）后立刻从 batch 中移除，
+#     剩余 slide 的每一步计算量随之减小；
+#   - 新 token 数以 max_new_tokens 为上限。
+# 模型通过 decode_step(input_ids, encoder_states, encoder_mask, past) -> (logits, past) 接入（见 BaseModel.decode_step）。
+
+StepFn = Callable[[torch.Tensor, torch.Tensor, torch.Tensor, Any], Tuple[torch.Tensor, Any]]
+
+
+class GenerationConfig:
+    """
+    解码设置（configs/models.yaml 中每个模型的 generation）。
+
+    Args:
+        num_beams: 每张 slide 的 beam 数
+        max_new_tokens: 每份报告最多生成的 token 数
+        length_penalty: 假设得分 = 对数概率和 / 长度 ** length_penalty
+        early_stopping: True 时一张 slide 有 num_beams 个完成的假设即结束
+        bos_token_id / eos_token_id / pad_token_id: 特殊 token
+    """
+
+    def __init__(self, num_beams: int = 5, max_new_tokens: int = 128, length_penalty: float = 1.0,
+                 early_stopping: bool = True, bos_token_id: int = 0, eos_token_id: int = 1,
+                 pad_token_id: Optional[int] = None):
+        self.num_beams = num_beams
+        self.max_new_tokens = max_new_tokens
+        self.length_penalty = length_penalty
+        self.early_stopping = early_stopping
+        self.bos_token_id = bos_token_id
+        self.eos_token_id = eos_token_id
+        self.pad_token_id = eos_token_id if pad_token_id is None else pad_token_id
+
+    def settings(self) -> Dict[str, Any]:
+        return dict(self.__dict__)
+
+
+class GenerationStats:
+    """累计的生成统计：token 数、报告数、解码耗时与每份报告的延迟（从所在 batch 开始解码到该报告完成）。"""
+
+    def __init__(self):
+        self.num_tokens = 0
+        self.elapsed = 0.0
+        self.latencies: List[float] = []
+
+    def merge(self, other: "GenerationStats"):
+        self.num_tokens += other.num_tokens
+        self.elapsed += other.elapsed
+        self.latencies.extend(other.latencies)
+        return self
+
+    def summary(self) -> Dict[str, float]:
+        latencies = np.asarray(self.latencies) if self.latencies else np.zeros(1)
+        return {"reports": len(self.latencies), "tokens": self.num_tokens,
+                "tokens_per_sec": self.num_tokens / self.elapsed if self.elapsed > 0 else float("inf"),
+                "latency_mean": float(latencies.mean()), "latency_p50": float(np.percentile(latencies, 50)),
+                "latency_p95": float(np.percentile(latencies, 95))}
+
+    def describe(self) -> str:
+        s = self.summary()
+        return (f"{s['reports']} reports, {s['tokens']} tokens, {s['tokens_per_sec']:.1f} tokens/sec, "
+                f"latency per report mean {s['latency_mean']:.3f}s / p50 {s['latency_p50']:.3f}s / "
+                f"p95 {s['latency_p95']:.3f}s")
+
+
+def pad_encoder_states(states: Sequence[torch.Tensor]) -> Tuple[torch.Tensor, torch.Tensor]:
+    """[S_i, D] 的列表 -> (补齐的 [B, S_max, D], mask [B, S_max]，True 为真实位置)。"""
+    lengths = torch.tensor([state.shape[0] for state in states])
+    padded = torch.nn.utils.rnn.pad_sequence(list(states), batch_first=True)
+    mask = torch.arange(padded.shape[1])[None, :] < lengths[:, None]
+    return padded, mask.to(padded.device)
+
+
+def select_cache(cache, index: torch.Tensor):
+    """按行选择 / 重排 KV cache：支持 tensor 的嵌套 tuple / list / dict，以及带 reorder_cache 的 cache 对象。"""
+    if cache is None:
+        return None
+    if isinstance(cache, torch.Tensor):
+        return cache.index_select(0, index.to(cache.device))
+    if isinstance(cache, (tuple, list)):
+        return type(cache)(select_cache(item, index) for item in cache)
+    if isinstance(cache, dict):
+        return {key: select_cache(value, index) for key, value in cache.items()}
+    if hasattr(cache, "reorder_cache"):
+        # transformers 的 Cache 对象
+        cache.reorder_cache(index)
+        return cache
+    raise TypeError(f"Unsupported KV cache type: {type(cache).__name__}")
+
+
+class BeamSearchGenerator:
+    """
+    Args:
+        step: decoder 的单步函数 step(input_ids [N, T], encoder_states [N, S, D], encoder_mask [N, S], past)
+              -> (logits [N, V] 或 [N, T, V], past)。use_cache 时 input_ids 只有最新一个 token。
+        config: GenerationConfig
+        use_cache: 复用 KV cache（False 时每步重新输入完整序列，用于对比）
+        drop_finished: 结束的 slide 立即移出 batch（False 时保留到整批结束，用于对比）
+    """
+
+    def __init__(self, step: StepFn, config: Optional[GenerationConfig] = None, use_cache: bool = True,
+                 drop_finished: bool = True):
+        self.step = step
+        self.config = config or GenerationConfig()
+        self.use_cache = use_cache
+        self.drop_finished = drop_finished
+        self.stats = GenerationStats()
+
+    def pop_stats(self) -> GenerationStats:
+        stats, self.stats = self.stats, GenerationStats()
+        return stats
+
+    @torch.inference_mode()
+    def generate(self, encoder_states: Sequence[torch.Tensor]) -> List[List[int]]:
+        """
+        Args:
+            encoder_states: 每张 slide 的 cross-attention 状态 [S_i, D]
+        Returns:
+            每张 slide 得分最高的假设（不含 BOS / EOS 的 token id 列表）
+        """
+        cfg = self.config
+        num_slides, num_beams = len(encoder_states), cfg.num_beams
+        if num_slides == 0:
+            return []
+        start = time.perf_counter()
+        states, mask = pad_encoder_states(encoder_states)
+        rows = torch.arange(num_slides, device=states.device).repeat_interleave(num_beams)
+        states, mask = states.index_select(0, rows), mask.index_select(0, rows)
+        sequences = torch.full((num_slides * num_beams, 1), cfg.bos_token_id, dtype=torch.long, device=states.device)
+        # 第一步只从每张 slide 的第 0 个 beam 展开，避免 num_beams 个相同的假设
+        beam_scores = torch.zeros(num_slides, num_beams, device=states.device)
+        beam_scores[:, 1:] = float("-inf")
+
+        active = list(range(num_slides))  # 当前 batch 中的 slide（每张占 num_beams 行）
+        frozen = set()  # drop_finished=False 时已结束但仍留在 batch 中的 slide
+        hypotheses: List[List[Tuple[float, List[int]]]] = [[] for _ in range(num_slides)]
+        results: List[Optional[List[int]]] = [None] * num_slides
+        past = None
+        for length in range(1, cfg.max_new_tokens + 1):
+            inputs = sequences[:, -1:] if self.use_cache else sequences
+            logits, new_past = self.step(inputs, states, mask, past)
+            past = new_past if self.use_cache else None
+            if logits.dim() == 3:
+                logits = logits[:, -1]
+            vocab_size = logits.shape[-1]
+            scores = (beam_scores.view(-1, 1) + F.log_softmax(logits.float(), dim=-1)).view(len(active), -1)
+            top_scores, top_index = scores.topk(2 * num_beams, dim=1)
+            top_scores, top_index = top_scores.tolist(), top_index.tolist()
+            normalizer = length ** cfg.length_penalty
+            last_step = length == cfg.max_new_tokens
+
+            keep_rows, keep_tokens, keep_scores, still_active = [], [], [], []
+            for a, slide in enumerate(active):
+                if slide in frozen:
+                    keep_rows.extend(range(a * num_beams, (a + 1) * num_beams))
+                    keep_tokens.extend([cfg.pad_token_id] * num_beams)
+                    keep_scores.extend([float("-inf")] * num_beams)
+                    still_active.append(slide)
+                    continue
+                rows_a, tokens_a, scores_a = [], [], []
+                for rank, (score, index) in enumerate(zip(top_scores[a], top_index[a])):
+                    beam, token = divmod(index, vocab_size)
+                    row = a * num_beams + beam
+                    if token == cfg.eos_token_id:
+                        # 排名在前 num_beams 之外的 EOS 候选不计入（与 transformers 的 beam search 一致）
+                        if rank < num_beams and score > float("-inf"):
+                            hypotheses[slide].append((score / normalizer, sequences[row, 1:].tolist()))
+                    else:
+                        rows_a.append(row)
+                        tokens_a.append(token)
+                        scores_a.append(score)
+                    if len(rows_a) == num_beams:
+                        break
+                hyps = hypotheses[slide]
+                hyps.sort(key=lambda hyp: hyp[0], reverse=True)
+                del hyps[num_beams:]
+                done = len(hyps) >= num_beams and (cfg.early_stopping or hyps[-1][0] >= scores_a[0] / normalizer)
+                if last_step and not done:
+                    # 达到 max_new_tokens：未结束的 beam 也作为假设参与排序
+                    for row, token, score in zip(rows_a, tokens_a, scores_a):
+                        hyps.append((score / normalizer, sequences[row, 1:].tolist() + [token]))
+                    hyps.sort(key=lambda hyp: hyp[0], reverse=True)
+                    done = True
+                if done:
+                    results[slide] = hyps[0][1]
+                    self.stats.num_tokens += len(hyps[0][1])
+                    self.stats.latencies.append(time.perf_counter() - start)
+                    if self.drop_finished:
+                        continue
+                    frozen.add(slide)
+                    rows_a, tokens_a, scores_a = [a * num_beams + b for b in range(num_beams)], \
+                        [cfg.pad_token_id] * num_beams, [float("-inf")] * num_beams
+                keep_rows.extend(rows_a)
+                keep_tokens.extend(tokens_a)
+                keep_scores.extend(scores_a)
+                still_active.append(slide)
+
+            if len(frozen) == len(still_active):
+                break
+            index = torch.tensor(keep_rows, device=sequences.device)
+            sequences = torch.cat([sequences.index_select(0, index),
+                                   torch.tensor(keep_tokens, device=sequences.device)[:, None]], dim=1)
+            beam_scores = torch.tensor(keep_scores, device=sequences.device).view(len(still_active), num_beams)
+            if len(still_active) < len(active):
+                # 同一 slide 的各行 cross-attention 状态相同，只在有 slide 移出时才需要重新选择
+                states, mask = states.index_select(0, index), mask.index_select(0, index)
+            past = select_cache(past, index)
+            active = still_active
+
+        self.stats.elapsed += time.perf_counter() - start
+        return results
+
+
+# ---------------------------------------------------------------- benchmark
+class _ToyDecoder(torch.nn.Module):
+    # 带 cross-attention 与 KV cache 的小型 transformer decoder；EOS 的 logit 随位置与图像状态增大，使报告长度各不相同
+    def __init__(self, vocab_size: int = 2000, dim: int = 256, depth: int = 4, num_heads: int = 4,
+                 eos_token_id: int = 1):
+        super().__init__()
+        self.num_heads = num_heads
+        self.eos_token_id = eos_token_id
+        self.embed = torch.nn.Embedding(vocab_size, dim)
+        self.position = torch.nn.Embedding(1024, dim)
+        self.layers = torch.nn.ModuleList()
+        for _ in range(depth):
+            self.layers.append(torch.nn.ModuleDict({
+                "self_qkv": torch.nn.Linear(dim, 3 * dim), "self_out": torch.nn.Linear(dim, dim),
+                "cross_q": torch.nn.Linear(dim, dim), "cross_kv": torch.nn.Linear(dim, 2 * dim),
+                "cross_out": torch.nn.Linear(dim, dim),
+                "mlp": torch.nn.Sequential(torch.nn.Linear(dim, 4 * dim), torch.nn.GELU(), torch.nn.Linear(4 * dim, dim)),
+                "norm1": torch.nn.LayerNorm(dim), "norm2": torch.nn.LayerNorm(dim), "norm3": torch.nn.LayerNorm(dim)}))
+        self.head = torch.nn.Linear(dim, vocab_size)
+        self.eos_gate = torch.nn.Linear(dim, 1)
+
+    def _heads(self, x):
+        return x.view(x.shape[0], x.shape[1], self.num_heads, -1).transpose(1, 2)
+
+    def forward(self, input_ids, encoder_states, encoder_mask, past=None):
+        offset = 0 if past is None else past[0][0].shape[2]
+        positions = torch.arange(offset, offset + input_ids.shape[1], device=input_ids.device)
+        x = self.embed(input_ids) + self.position(positions)[None]
+        cross_mask = encoder_mask[:, None, None, :]
+        new_past = []
+        for i, layer in enumerate(self.layers):
+            q, k, v = layer["self_qkv"](layer["norm1"](x)).chunk(3, dim=-1)
+            q, k, v = self._heads(q), self._heads(k), self._heads(v)
+            if past is not None:
+                k, v = torch.cat([past[i][0], k], dim=2), torch.cat([past[i][1], v], dim=2)
+            attn = F.scaled_dot_product_attention(q, k, v, is_causal=past is None and input_ids.shape[1] > 1)
+            x = x + layer["self_out"](attn.transpose(1, 2).reshape(x.shape))
+            if past is None:
+                cross_k, cross_v = (self._heads(t) for t in layer["cross_kv"](encoder_states).chunk(2, dim=-1))
+            else:
+                # cross-attention 的 K/V 只在第一步计算，之后随 cache 复用
+                cross_k, cross_v = past[i][2], past[i][3]
+            q = self._heads(layer["cross_q"](layer["norm2"](x)))
+            attn = F.scaled_dot_product_attention(q, cross_k, cross_v, attn_mask=cross_mask)
+            x = x + layer["cross_out"](attn.transpose(1, 2).reshape(x.shape))
+            x = x + layer["mlp"](layer["norm3"](x))
+            new_past.append((k, v, cross_k, cross_v))
+        logits = self.head(x[:, -1])
+        pooled = (encoder_states * encoder_mask[..., None]).sum(1) / encoder_mask.sum(1, keepdim=True)
+        eos_boost = 0.35 * (offset + input_ids.shape[1]) - 8 + 4 * torch.tanh(self.eos_gate(pooled))[:, 0]
+        logits[:, self.eos_token_id] += eos_boost
+        return logits, tuple(new_past)
+
+
+def benchmark(num_slides: int = 32, batch_size: int = 8, num_beams: int = 5, max_new_tokens: int = 64,
+              dim: int = 256, seed: int = 0):
+    """
+    随机初始化的 decoder 上比较：逐张 slide 生成（原实现）、整批生成但不复用 KV cache、整批生成但结束的 slide 不移出、
+    以及整批 + KV cache + 移除已结束 slide。报告 tokens/sec、每份报告的延迟，以及与逐张生成结果一致的比例。
+    """
+    torch.manual_seed(seed)
+    decoder = _ToyDecoder(dim=dim).eval()
+    generator = torch.Generator().manual_seed(seed)
+    # 每张 slide 的 image latents 长度不同，考察补齐后的 cross-attention
+    latents = [torch.randn(int(n), dim, generator=generator)
+               for n in torch.randint(32, 129, (num_slides,), generator=generator)]
+    config = GenerationConfig(num_beams=num_beams, max_new_tokens=max_new_tokens)
+    torch.set_num_threads(1)
+
+    modes = [("per-slide", 1, True, True), ("batched, no KV cache", batch_size, False, True),
+             ("batched, keep finished", batch_size, True, False), ("batched", batch_size, True, True)]
+    reference = None
+    for name, size, use_cache, drop_finished in modes:
+        engine = BeamSearchGenerator(decoder, config, use_cache=use_cache, drop_finished=drop_finished)
+        engine.generate(latents[:1])  # warmup
+        engine.pop_stats()
+        outputs = []
+        for start in range(0, num_slides, size):
+            outputs.extend(engine.generate(latents[start:start + size]))
+        if reference is None:
+            reference = outputs
+        same = sum(a == b for a, b in zip(outputs, reference)) / num_slides
+        logger.info(f"{name:>22}: {engine.pop_stats().describe()}; identical to per-slide {same:.0%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Batched beam-search report generation benchmark")
+    parser.add_argument("--slides", type=int, default=32)
+    parser.add_argument("--batch_size", type=int, default=8)
+    parser.add_argument("--num_beams", type=int, default=5)
+    parser.add_argument("--max_new_tokens", type=int, default=64)
+    parser.add_argument("--dim", type=int, default=256)
+    args = parser.parse_args()
+    benchmark(args.slides, args.batch_size, args.num_beams, args.max_new_tokens, args.dim)
@@ -0,0 +1,163 @@
+import os
+import json
+import hashlib
+import tempfile
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+from utils.logger import default_logger as logger
+
+
+def run_fingerprint(**ingredients) -> str:
+    """Fingerprint of everything that determines a task's predictions (model identity + configs)."""
+    return hashlib.sha256(json.dumps(ingredients, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class PredictionJournal:
+    """
+    每个 (task, model, dataset, fingerprint) 一个只追加的逐 slide 预测日志（JSON Lines）。
+    每个 batch 推理完就追加并 fsync，进程中途退出时已完成的 slide 不会丢失；
+    重新运行时跳过日志中已有的 slide，只推理新增/未完成的部分，指标由日志整体重算。
+    fingerprint 写在文件名里，模型或配置变化时自然落到一个新的日志。
+    记录本身只在文件中，内存里是每张 slide 在文件中的位置，读取时按位置 pread。
+    path 为 None 时是一个匿名临时文件（不续跑时的预测存放处），关闭或对象释放后自动删除。
+
+    每行: {"slide": slide_name, "pred": ..., "label": ...}
+    """
+
+    def __init__(self, path: Optional[str], fingerprint: Optional[str] = None):
+        self.path = path
+        self.fingerprint = fingerprint
+        self._index: Dict[str, Tuple[int, int]] = {}  # slide -> (offset, length)
+        if path is None:
+            self._file = tempfile.TemporaryFile()
+        else:
+            self._load()
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._file = open(path, "a+b")
+        self._size = os.fstat(self._file.fileno()).st_size
+
+    @classmethod
+    def temporary(cls) -> "PredictionJournal":
+        return cls(None)
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        valid_bytes = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                # 崩溃时写了一半的最后一行：截掉，从上一条完整记录之后继续追加。
+                # 没有换行符的行即使恰好能解析（如截断在数字中间）也不完整
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                self._index[record["slide"]] = (valid_bytes, len(line))
+                valid_bytes += len(line)
+        if valid_bytes < os.path.getsize(self.path):
+            logger.info(f"Truncating partial record at the end of {self.path}")
+            os.truncate(self.path, valid_bytes)
+
+    def __contains__(self, slide_name: str) -> bool:
+        return slide_name in self._index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def covers(self, slide_names: Iterable[str]) -> bool:
+        return all(name in self._index for name in slide_names)
+
+    def append(self, slide_names: Sequence[str], preds: Sequence[Any], labels: Sequence[Any]) -> List[bool]:
+        """追加尚未记录的 slide；返回每个 slide 是否为新增（已记录的不会重复写入）。"""
+        lines, added = [], []
+        offset = self._size
+        for name, pred, label in zip(slide_names, preds, labels):
+            added.append(name not in self._index)
+            if not added[-1]:
+                continue
+            line = (json.dumps({"slide": name, "pred": pred, "label": label}, default=_to_json) + "\n").encode()
+            self._index[name] = (offset, len(line))
+            offset += len(line)
+            lines.append(line)
+        if lines:
+            self._file.write(b"".join(lines))
+            self._file.flush()
+            if self.path is not None:
+                os.fsync(self._file.fileno())
+            self._size = offset
+        return added
+
+    def _read(self, slide_name: str) -> Tuple[Any, Any]:
+        # 读出的是 JSON 往返后的值，本次运行与恢复后重算的指标看到的是同样的类型（tuple -> list 等）
+        offset, length = self._index[slide_name]
+        record = json.loads(os.pread(self._file.fileno(), length, offset))
+        return record.get("pred"), record.get("label")
+
+    def collect(self, slide_names: Sequence[str], label_lookup: Optional[Callable[[str], Any]] = None
+                ) -> Tuple[List[str], List[Any], List[Any]]:
+        """
+        按 slide_names 的顺序返回 (names, labels, preds)，日志中没有的 slide 跳过。
+        label_lookup: slide_name -> 当前的标签；给出时不使用日志中记录的标签（标签文件可能已被修正）
+        """
+        names, labels, preds = [], [], []
+        for name in slide_names:
+            if name in self._index:
+                pred, label = self._read(name)
+                names.append(name)
+                preds.append(pred)
+                labels.append(label if label_lookup is None else label_lookup(name))
+        return names, labels, preds
+
+    def iter_batches(self, slide_names: Sequence[str], batch_size: int = 1024,
+                     label_lookup: Optional[Callable[[str], Any]] = None) -> Iterator[Tuple[List[Any], List[Any]]]:
+        """按 slide_names 的顺序分批产出已记录 slide 的 (labels, preds)，用于流式累加指标；label_lookup 同 collect。"""
+        labels, preds = [], []
+        for name in slide_names:
+            if name in self._index:
+                pred, label = self._read(name)
+                preds.append(pred)
+                labels.append(label if label_lookup is None else label_lookup(name))
+                if len(preds) == batch_size:
+                    yield labels, preds
+                    labels, preds = [], []
+        if preds:
+            yield labels, preds
+
+    def close(self):
+        self._file.close()
+
+
+class JournalPredictions:
+    """evaluate 返回的逐 slide 预测：记录留在预测日志中，保存结果或计算 bootstrap 时才按 slide 顺序读出。"""
+
+    def __init__(self, journal: PredictionJournal, slide_names: Sequence[str],
+                 label_lookup: Optional[Callable[[str], Any]] = None):
+        self.journal = journal
+        self.slide_names = slide_names
+        self.label_lookup = label_lookup
+
+    def __len__(self) -> int:
+        return sum(name in self.journal for name in self.slide_names)
+
+    def collect(self) -> Tuple[List[str], List[Any], List[Any]]:
+        return self.journal.collect(self.slide_names, self.label_lookup)
+
+    def samples(self) -> Tuple[List[Any], List[Any]]:
+        """(labels, preds)，供 StreamingMetrics.compute 的 bootstrap 使用。"""
+        return self.collect()[1:]
+
+
+def _to_json(value):
+    # tensor / numpy 标量与数组
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def pending_indices(slide_names: Sequence[str], journals: Sequence[Optional[PredictionJournal]]) -> Optional[List[int]]:
+    """至少有一个 journal 尚未记录的 slide 的下标；没有 journal 时返回 None（全部推理）。"""
+    journals = [journal for journal in journals if journal is not None]
+    if not journals:
+        return None
+    return [i for i, name in enumerate(slide_names) if any(name not in journal for journal in journals)]
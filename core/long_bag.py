@@ -0,0 +1,317 @@
+import os
+import json
+import math
+import time
+import argparse
+import resource
+import multiprocessing as mp
+from typing import Dict, Iterator, Optional, Tuple
+import numpy as np
+import torch
+from utils.logger import default_logger as logger
+
+# 超长 tile bag（5 万 ~ 15 万个 tile 的整张切片）的推理策略，在 configs/models.yaml 中按模型设置 long_bag：
+#   chunked    按 chunk_size 分块送入 tile 编码器（注意力只在块内计算，内存 ~ chunk_size²），
+#              块的注意力池化结果用 streaming softmax 合并，与整包一次性池化在数学上等价
+#   subsample  按空间分层抽样到 max_tiles 个 tile（每个空间格子按 tile 数比例抽取，保留组织的空间分布）
+#   grid       把坐标网格逐级加粗，直到非空格子数不超过 max_tiles，每个格子内的 tile 特征取平均
+# max_tiles 是每张 slide 的硬上限：subsample / grid 把 bag 缩减到 max_tiles 以内；
+# chunked 时超出 max_tiles 的 bag 先分层抽样，特征本身的内存同样有界。
+# 缩减在 collate 中完成（见 core.base_dataset.collate_tile_bags），补齐后的 batch 不会超过 [B, max_tiles, D]。
+STRATEGIES = ("chunked", "subsample", "grid")
+
+
+def _as_numpy_coords(coords, n_tiles: int) -> Optional[np.ndarray]:
+    if coords is None:
+        return None
+    coords = np.asarray(torch.as_tensor(coords).detach().cpu().numpy(), dtype=np.float64).reshape(n_tiles, -1)
+    return coords[:, :2]
+
+
+def _grid_cells(coords: np.ndarray, cell_size: float) -> np.ndarray:
+    """每个 tile 所在格子的编号（只对非空格子编号，0..n_cells-1）。"""
+    cells = np.floor((coords - coords.min(axis=0)) / cell_size).astype(np.int64)
+    _, cell_ids = np.unique(cells, axis=0, return_inverse=True)
+    return cell_ids.reshape(-1)
+
+
+def _tile_step(coords: np.ndarray) -> float:
+    # tile 的步长：相邻坐标的最小正间距（坐标通常是 tile 左上角的像素位置）
+    steps = [np.diff(np.unique(coords[:, axis])) for axis in range(coords.shape[1])]
+    steps = [step[step > 0].min() for step in steps if (step > 0).any()]
+    return float(min(steps)) if steps else 1.0
+
+
+def stratified_subsample(n_tiles: int, budget: int, coords=None, seed: int = 0) -> np.ndarray:
+    """
+    空间分层抽样：把 tile 坐标的外接框划成约 budget 个格子，每个格子按其 tile 数比例抽取，
+    组织少的区域也能被抽到。没有坐标时按下标等间隔抽取（tile 通常按光栅顺序存放）。
+
+    Returns:
+        升序的 tile 下标，长度为 min(n_tiles, budget)
+    """
+    if n_tiles <= budget:
+        return np.arange(n_tiles)
+    coords = _as_numpy_coords(coords, n_tiles)
+    if coords is None:
+        return np.unique(np.linspace(0, n_tiles - 1, budget).round().astype(np.int64))
+
+    extent = np.maximum(coords.max(axis=0) - coords.min(axis=0), 1e-6)
+    cell_size = float(np.sqrt(np.prod(extent) / budget))
+    cell_ids = _grid_cells(coords, cell_size)
+    rng = np.random.default_rng(seed)
+    # 格子内随机排序后的名次 / 格子内 tile 数 = tile 在本格配额中的位置；取该值最小的 budget 个，
+    # 即每个格子按比例分到名额，且每个非空格子先于任何格子的第二个 tile 被选中（在名额允许时）
+    order = np.lexsort((rng.random(n_tiles), cell_ids))
+    sorted_cells = cell_ids[order]
+    starts = np.r_[0, np.flatnonzero(np.diff(sorted_cells)) + 1]
+    counts = np.diff(np.r_[starts, n_tiles])
+    rank = np.arange(n_tiles) - np.repeat(starts, counts)
+    quota = np.empty(n_tiles)
+    quota[order] = (rank + 0.5) / np.repeat(counts, counts)
+    return np.sort(np.argsort(quota, kind="stable")[:budget])
+
+
+def grid_downsample(bag: torch.Tensor, budget: int, coords=None) -> Tuple[torch.Tensor, Optional[torch.Tensor]]:
+    """
+    坐标网格降采样：格子边长从 tile 步长开始逐级放大（每级 1.25 倍），直到非空格子数 <= budget，格子内的特征取平均。
+    没有坐标时把相邻的 ceil(n / budget) 个 tile（光栅顺序）合为一组。
+
+    Returns:
+        (pooled bag [n_cells, D], 格子内 tile 坐标的均值 [n_cells, 2] 或 None)
+    """
+    n_tiles = bag.shape[0]
+    if n_tiles <= budget:
+        return bag, None if coords is None else torch.as_tensor(coords)
+    np_coords = _as_numpy_coords(coords, n_tiles)
+    if np_coords is None:
+        cell_ids = np.arange(n_tiles) // math.ceil(n_tiles / budget)
+    else:
+        cell_size = _tile_step(np_coords)
+        cell_ids = _grid_cells(np_coords, cell_size)
+        while cell_ids.max() + 1 > budget:
+            cell_size *= 1.25
+            cell_ids = _grid_cells(np_coords, cell_size)
+
+    n_cells = int(cell_ids.max()) + 1
+    index = torch.from_numpy(cell_ids)
+    counts = torch.bincount(index, minlength=n_cells).clamp(min=1).unsqueeze(1)
+    pooled = torch.zeros(n_cells, bag.shape[1], dtype=torch.float32).index_add_(0, index, bag.float()) / counts
+    pooled_coords = None
+    if np_coords is not None:
+        pooled_coords = torch.zeros(n_cells, 2, dtype=torch.float64).index_add_(
+            0, index, torch.from_numpy(np_coords)) / counts
+    return pooled.to(bag.dtype), pooled_coords
+
+
+class StreamingAttentionPool:
+    """
+    注意力池化 sum_i softmax(logits)_i * values_i 的流式版本（online softmax）：
+    逐块 update，只保留每个注意力头的当前最大 logit、指数和与加权和；多个部分结果可以 merge（与 utils/accumulators 相同的模式）。
+    logits 为 None 时等价于均值池化。
+    """
+
+    def __init__(self):
+        self.max_logit = None  # [H]
+        self.denominator = None  # [H]
+        self.numerator = None  # [H, D]
+
+    def update(self, values: torch.Tensor, logits: Optional[torch.Tensor] = None):
+        """values: [n, D]；logits: [n, H] 或 [n]（单头）"""
+        values = values.float()
+        if logits is None:
+            logits = values.new_zeros(values.shape[0], 1)
+        logits = logits.float().reshape(values.shape[0], -1)
+        chunk_max = logits.max(dim=0).values
+        weights = torch.exp(logits - chunk_max)  # [n, H]
+        self._merge(chunk_max, weights.sum(dim=0), weights.t() @ values)
+
+    def _merge(self, max_logit, denominator, numerator):
+        if self.max_logit is None:
+            self.max_logit, self.denominator, self.numerator = max_logit, denominator, numerator
+            return
+        new_max = torch.maximum(self.max_logit, max_logit)
+        old_scale, new_scale = torch.exp(self.max_logit - new_max), torch.exp(max_logit - new_max)
+        self.denominator = self.denominator * old_scale + denominator * new_scale
+        self.numerator = self.numerator * old_scale[:, None] + numerator * new_scale[:, None]
+        self.max_logit = new_max
+
+    def merge(self, other: "StreamingAttentionPool"):
+        if other.max_logit is not None:
+            self._merge(other.max_logit, other.denominator, other.numerator)
+        return self
+
+    def compute(self) -> torch.Tensor:
+        """[H, D]；单头时为 [D]。"""
+        pooled = self.numerator / self.denominator[:, None]
+        return pooled[0] if pooled.shape[0] == 1 else pooled
+
+
+class LongBagPolicy:
+    """
+    一个模型的长 bag 设置（configs/models.yaml 中的 long_bag），可 pickle 到 DataLoader worker。
+
+    Args:
+        strategy: "chunked" | "subsample" | "grid"
+        max_tiles: 每张 slide 的 tile（token）上限，超出时缩减；None 表示不设上限（只对 chunked 有意义）
+        chunk_size: chunked 时每次送入编码器的 tile 数
+        seed: 分层抽样的随机种子
+    """
+
+    def __init__(self, strategy: str = "chunked", max_tiles: Optional[int] = 16384, chunk_size: int = 4096,
+                 seed: int = 0):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown long-bag strategy '{strategy}', expected one of {', '.join(STRATEGIES)}")
+        if strategy != "chunked" and not max_tiles:
+            raise ValueError(f"long-bag strategy '{strategy}' needs max_tiles")
+        self.strategy = strategy
+        self.max_tiles = max_tiles
+        self.chunk_size = chunk_size
+        self.seed = seed
+
+    def settings(self) -> Dict:
+        """影响模型输出的设置，进入 slide 缓存的 key。"""
+        return {"strategy": self.strategy, "max_tiles": self.max_tiles, "chunk_size": self.chunk_size,
+                "seed": self.seed}
+
+    def reduce(self, bag: torch.Tensor, coords=None) -> Tuple[torch.Tensor, Optional[torch.Tensor]]:
+        """把一张 slide 的 bag 缩减到 max_tiles 以内：grid 时网格平均，其余策略分层抽样。"""
+        if not self.max_tiles or bag.shape[0] <= self.max_tiles:
+            return bag, coords
+        if self.strategy == "grid":
+            return grid_downsample(bag, self.max_tiles, coords)
+        index = torch.from_numpy(stratified_subsample(bag.shape[0], self.max_tiles, coords, self.seed))
+        return bag[index], None if coords is None else torch.as_tensor(coords)[index]
+
+    def chunks(self, bag: torch.Tensor) -> Iterator[torch.Tensor]:
+        """chunked 时按 chunk_size 切分（视图，不复制）；其他策略整包作为一个块。"""
+        size = self.chunk_size if self.strategy == "chunked" else bag.shape[0]
+        for start in range(0, bag.shape[0], max(size, 1)):
+            yield bag[start:start + size]
+
+
+# ---------------------------------------------------------------- benchmark
+class _SlideEncoder(torch.nn.Module):
+    # 块内 self-attention 的 tile 编码器 + gated attention (ABMIL) 池化，结构接近常见的 slide encoder
+    def __init__(self, dim: int, num_heads: int = 4):
+        super().__init__()
+        self.layer = torch.nn.TransformerEncoderLayer(dim, nhead=num_heads, dim_feedforward=2 * dim, batch_first=True)
+        self.attention_v = torch.nn.Linear(dim, dim // 2)
+        self.attention_u = torch.nn.Linear(dim, dim // 2)
+        self.attention_w = torch.nn.Linear(dim // 2, 1)
+
+    def encode_chunk(self, chunk: torch.Tensor):
+        hidden = self.layer(chunk.unsqueeze(0))[0]
+        logits = self.attention_w(torch.tanh(self.attention_v(hidden)) * torch.sigmoid(self.attention_u(hidden)))
+        return hidden, logits
+
+
+def _encode(encoder, bag, policy: Optional[LongBagPolicy]):
+    pool = StreamingAttentionPool()
+    chunks = policy.chunks(bag) if policy is not None else [bag]
+    for chunk in chunks:
+        pool.update(*encoder.encode_chunk(chunk))
+    return pool.compute()
+
+
+def _synthetic_slide(n_tiles: int, dim: int, seed: int):
+    # 不规则形状的组织区域：从椭圆区域中取 n_tiles 个网格点，特征随空间平滑变化
+    rng = np.random.default_rng(seed)
+    side = int(np.ceil(np.sqrt(n_tiles / 0.6)))
+    ys, xs = np.mgrid[0:side, 0:side]
+    inside = ((xs - side / 2) / (side / 2)) ** 2 + ((ys - side / 2) / (side / 2.6)) ** 2 <= 1.2
+    grid = np.stack([xs[inside], ys[inside]], axis=1)[:n_tiles]
+    coords = torch.from_numpy(grid * 224)
+    basis = torch.from_numpy(rng.standard_normal((4, dim))).float()
+    position = torch.from_numpy(grid / side).float()
+    features = torch.cat([position, position ** 2], dim=1) @ basis + 0.5 * torch.randn(len(grid), dim)
+    return features, coords
+
+
+def _rss_mb() -> float:
+    with open("/proc/self/status", "r") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def _benchmark_worker(strategy, n_tiles, dim, max_tiles, chunk_size, seed, queue):
+    torch.set_num_threads(1)
+    torch.manual_seed(seed)
+    encoder = _SlideEncoder(dim).eval()
+    features, coords = _synthetic_slide(n_tiles, dim, seed)
+    # chunked 不设 tile 上限，编码整个 bag，以体现峰值内存只取决于 chunk_size
+    policy = None if strategy == "full" else \
+        LongBagPolicy(strategy, None if strategy == "chunked" else max_tiles, chunk_size, seed)
+    with torch.inference_mode():
+        _encode(encoder, features[:256], None)  # warmup，排除首次调用的初始化开销
+    baseline = _rss_mb()
+    start = time.perf_counter()
+    with torch.inference_mode():
+        bag = features
+        if policy is not None:
+            bag, _ = policy.reduce(features, coords)
+        embedding = _encode(encoder, bag, policy)
+    latency = time.perf_counter() - start
+    # ru_maxrss（KB）是进程启动以来的峰值，减去推理前的常驻内存即推理的峰值增量
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 - baseline
+    queue.put({"strategy": strategy, "n_tiles": n_tiles, "tokens": int(bag.shape[0]), "latency_s": latency,
+               "peak_mb": peak, "embedding": embedding.tolist()})
+
+
+def benchmark(tile_counts=(8192, 32768), strategies=("full",) + STRATEGIES, dim: int = 192, max_tiles: int = 4096,
+              chunk_size: int = 2048, full_max_tiles: int = 16384, seed: int = 0, output: Optional[str] = None):
+    """
+    每个 (策略, tile 数) 在单独的进程中编码一张合成 slide，记录推理延迟与峰值内存增量，
+    以及 slide 表征与整包编码（full）的余弦相似度。full 只在 tile 数不超过 full_max_tiles 时运行；
+    chunked 编码整个 bag（不做 max_tiles 缩减）。
+    """
+    ctx = mp.get_context("spawn")
+    records = []
+    for n_tiles in tile_counts:
+        reference = None
+        for strategy in strategies:
+            if strategy == "full" and n_tiles > full_max_tiles:
+                logger.info(f"{n_tiles:>7} tiles {'full':>9}: skipped (attention over the whole bag needs "
+                            f"~{n_tiles ** 2 * 4 / 1024 ** 3:.1f} GB per head)")
+                continue
+            queue = ctx.Queue()
+            worker = ctx.Process(target=_benchmark_worker,
+                                 args=(strategy, n_tiles, dim, max_tiles, chunk_size, seed, queue))
+            worker.start()
+            worker.join()
+            if worker.exitcode != 0:
+                logger.error(f"Erro: {strategy} on {n_tiles} tiles exited with code {worker.exitcode}")
+                continue
+            record = queue.get()
+            embedding = torch.tensor(record.pop("embedding"))
+            if strategy == "full":
+                reference = embedding
+            record["cosine_to_full"] = None if reference is None else \
+                float(torch.nn.functional.cosine_similarity(embedding, reference, dim=0))
+            records.append(record)
+            similarity = "" if record["cosine_to_full"] is None else f", cosine to full {record['cosine_to_full']:.4f}"
+            logger.info(f"{n_tiles:>7} tiles {strategy:>9}: {record['tokens']:>6} tokens, "
+                        f"{record['latency_s']:.2f}s, peak +{record['peak_mb']:.0f} MB{similarity}")
+    if output:
+        os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+        with open(output, "w") as f:
+            json.dump({"dim": dim, "max_tiles": max_tiles, "chunk_size": chunk_size, "results": records}, f, indent=4)
+        logger.info(f"Long-bag benchmark written to {output}")
+    return records
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Peak memory and latency of the long-bag strategies")
+    parser.add_argument("--tiles", type=int, nargs="+", default=[8192, 32768])
+    parser.add_argument("--strategies", nargs="+", default=["full"] + list(STRATEGIES))
+    parser.add_argument("--dim", type=int, default=192)
+    parser.add_argument("--max_tiles", type=int, default=4096)
+    parser.add_argument("--chunk_size", type=int, default=2048)
+    parser.add_argument("--full_max_tiles", type=int, default=16384,
+                        help="skip whole-bag encoding above this many tiles")
+    parser.add_argument("--output", default="results/long_bag_benchmark.json")
+    args = parser.parse_args()
+    benchmark(args.tiles, args.strategies, args.dim, args.max_tiles, args.chunk_size, args.full_max_tiles,
+              output=args.output)
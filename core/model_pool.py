@@ -0,0 +1,75 @@
+from collections import OrderedDict
+from typing import Any, Optional, Tuple, Type
+import gc
+import json
+from .base_model import BaseModel
+from utils.logger import default_logger as logger
+
+
+class ModelPool:
+    """
+    模型常驻池：跨任务、跨数据集复用已加载的 BaseModel 实例，避免重复 from_pretrained。
+    key: (model_name, model_path, device, options)，options 为影响模型行为的其余设置（precision / long_bag / generation）
+    max_memory_gb: 池内模型的显存/内存预算（近似值），超出时按 LRU 淘汰；None 表示不限制。
+    low_memory_loading: 以 meta 构建 + mmap 权重的方式加载模型（不影响模型输出，因此不进入指纹）。
+    """
+
+    def __init__(self, max_memory_gb: Optional[float] = None, low_memory_loading: bool = True):
+        self.max_memory_bytes = None if max_memory_gb is None else int(max_memory_gb * 1024 ** 3)
+        self.low_memory_loading = low_memory_loading
+        self._models = OrderedDict()  # key -> (model, nbytes)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def memory_bytes(self) -> int:
+        return sum(nbytes for _, nbytes in self._models.values())
+
+    def get(self, model_class: Type[BaseModel], model_name: str, model_path: str, device: str,
+            **options: Any) -> BaseModel:
+        key = (model_name, model_path, device, json.dumps(options, sort_keys=True, default=str))
+        if key in self._models:
+            self.hits += 1
+            self._models.move_to_end(key)
+            logger.info(f"♻️ Reusing resident model {model_name} ({device})")
+            return self._models[key][0]
+
+        self.misses += 1
+        model = model_class(model_path=model_path, model_name=model_name, device=device,
+                            low_memory=self.low_memory_loading, **options)
+        self._models[key] = (model, model.memory_footprint())
+        self._evict(keep=key)
+        return model
+
+    def _evict(self, keep: Tuple):
+        if self.max_memory_bytes is None:
+            return
+        for key in list(self._models.keys()):
+            if self.memory_bytes <= self.max_memory_bytes:
+                break
+            if key == keep:
+                continue
+            model, nbytes = self._models.pop(key)
+            self.evictions += 1
+            logger.info(f"Evicting model {key[0]} ({key[2]}) from pool, freed ~{nbytes / 1024 ** 2:.1f} MB")
+            del model
+            self._release_memory()
+
+    def clear(self):
+        self._models.clear()
+        self._release_memory()
+
+    @staticmethod
+    def _release_memory():
+        gc.collect()
+        try:
+            import torch
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+        except ImportError:
+            pass
+
+    def log_stats(self):
+        logger.info(f"Model pool: hits={self.hits}, misses={self.misses}, evictions={self.evictions}, "
+                    f"resident={len(self._models)}, memory~{self.memory_bytes / 1024 ** 2:.1f} MB")
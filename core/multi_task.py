@@ -0,0 +1,96 @@
+import time
+from functools import partial
+from typing import Any, Dict, List, Optional, Tuple
+from .base_model import BaseModel
+from .base_dataset import BaseDataset, collate_tile_bags
+from .base_task import BaseTask
+from .slide_cache import SlideEmbeddingCache, encode_slides
+from .prefetch import PrefetchLoader
+from .journal import JournalPredictions, PredictionJournal, pending_indices
+from . import tracing
+from utils.logger import default_logger as logger
+
+
+def evaluate_multi_task(model: BaseModel, dataset: BaseDataset,
+                        task_runs: List[Tuple[BaseTask, Dict[str, Any]]],
+                        slide_cache: Optional[SlideEmbeddingCache] = None,
+                        journals: Optional[List[Optional[PredictionJournal]]] = None) -> List[Any]:
+    """
+    多任务评估：每个 batch 的 tile 只经过一次 slide encoder（model.encode_batch），
+    得到的 slide 表征再分别送入各任务的 head。
+
+    Args:
+        model: 已加载的模型
+        dataset: 数据集
+        task_runs: [(task, test_configs), ...]，同一 (model, dataset) 下需要评估的所有任务
+        slide_cache: 可选的 slide 表征缓存，命中的 slide 不再重新编码
+        journals: 可选，与 task_runs 对齐的逐 slide 预测日志；只推理至少一个任务尚未记录的 slide。
+                  没有日志的任务使用临时日志，预测不在内存中累积
+
+    Returns:
+        与 task_runs 对齐的列表，元素为 (metric_results, predictions)，格式同 BaseTask.evaluate；某任务的 head 失败时为 None
+    """
+    failed = [False for _ in task_runs]
+    journals = [PredictionJournal.temporary() if journal is None else journal
+                for journal in (journals or [None for _ in task_runs])]
+    # 每个任务的指标按 batch 流式累加；日志中已有的 slide 先计入
+    states = [task.metric_state(**task.metric_kwargs(test_configs)) for task, test_configs in task_runs]
+    # 日志中已有的 slide 用当前标签文件中的标签
+    label_lookups = [dataset.label_lookup(task.label_type, task.label_columns) for task, _ in task_runs]
+    for state, journal, label_lookup in zip(states, journals, label_lookups):
+        for labels, preds in journal.iter_batches(dataset.slides, label_lookup=label_lookup):
+            state.update(labels, preds)
+
+    # 多个任务共享一个 loader，batch size 取各任务中最小的，避免超出任一任务的显存设定
+    batch_size = min(task.batch_size for task, _ in task_runs)
+    dataset.select_labels([task.label_type for task, _ in task_runs],
+                          {task.label_type: task.label_columns for task, _ in task_runs})
+    loader = PrefetchLoader(dataset, batch_size=batch_size,
+                            collate_fn=partial(collate_tile_bags, long_bag=model.long_bag),
+                            indices=pending_indices(dataset.slides, journals), **dataset.prefetch)
+
+    start = time.perf_counter()
+    num_slides = 0
+    for batch in loader:
+        with tracing.span("encode"):
+            latents = encode_slides(model, batch, slide_cache)
+        slide_infos = batch.get("slide_info")
+        slide_names = [slide_info.get("slide_name") for slide_info in slide_infos]
+        num_slides += len(slide_infos)
+        for i, (task, test_configs) in enumerate(task_runs):
+            if failed[i]:
+                continue
+            try:
+                with tracing.span("head", task.task_name):
+                    preds = task.predict_from_latents(model, latents, **test_configs)
+                labels = [slide_info.get(task.label_key) for slide_info in slide_infos]
+                # 其他任务还缺这些 slide 时，本任务已记录过的 slide 也会被重新推理，不能重复计入指标
+                added = journals[i].append(slide_names, preds, labels)
+                labels_added = [label for label, new in zip(labels, added) if new]
+                preds_added = [pred for pred, new in zip(preds, added) if new]
+                with tracing.span("metrics_update", task.task_name):
+                    states[i].update(labels_added, preds_added)
+            except Exception as e:
+                logger.error(f"Erro: task {task.task_name} - model {model.model_name} head failed: {str(e)}")
+                failed[i] = True
+
+    elapsed = time.perf_counter() - start
+    slides_per_sec = num_slides / elapsed if elapsed > 0 else float("inf")
+    logger.info(f"Multi-task ({', '.join(task.task_name for task, _ in task_runs)}) - {model.model_name}: "
+                f"{num_slides} slides encoded once in {elapsed:.2f}s ({slides_per_sec:.2f} slides/sec)")
+
+    for (task, _), task_failed in zip(task_runs, failed):
+        if not task_failed:
+            task.log_task_stats(model)
+    loader.log_stats(f"Multi-task - {model.model_name}")
+
+    results = []
+    for i, (task, test_configs) in enumerate(task_runs):
+        if failed[i]:
+            results.append(None)
+        else:
+            predictions = JournalPredictions(journals[i], dataset.slides, label_lookups[i])
+            with tracing.span("metrics_compute", task.task_name):
+                metric_results = states[i].compute(predictions.samples)
+            results.append((metric_results, predictions))
+    return results
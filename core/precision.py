@@ -0,0 +1,195 @@
+import copy
+import time
+import argparse
+import warnings
+from contextlib import nullcontext
+import numpy as np
+import torch
+import torch.nn.functional as F
+from .base_model import PRECISIONS, resolve_precision
+from utils.logger import default_logger as logger
+
+# 推理精度（configs/models.yaml 中每个模型的 precision）：
+#   fp32              非 fp32 的权重转换为 fp32
+#   fp16 / bf16       fp32 与同精度的权重保持原样（不复制 mmap 的权重），推理时 autocast
+#                     （fp16 只适用于 CUDA；bf16 在支持 AVX512-BF16/AMX 的 CPU 上也很快）
+#   int8_dynamic      nn.Linear 权重量化为 int8，激活在每次前向时动态量化（只支持 CPU）
+#   int8_weight_only  nn.Linear 权重按输出通道量化为 int8，前向时反量化，激活保持浮点；权重内存约为 1/4
+
+
+class WeightOnlyInt8Linear(torch.nn.Module):
+    """替代 nn.Linear：权重按输出通道对称量化为 int8（每通道一个 scale），前向时反量化到激活的 dtype。"""
+
+    def __init__(self, linear: torch.nn.Linear):
+        super().__init__()
+        self.in_features = linear.in_features
+        self.out_features = linear.out_features
+        weight = linear.weight.detach().float()
+        scale = weight.abs().amax(dim=1).clamp(min=1e-8) / 127
+        self.register_buffer("weight_int8", torch.round(weight / scale[:, None]).to(torch.int8))
+        self.register_buffer("scale", scale)
+        self.register_buffer("bias", None if linear.bias is None else linear.bias.detach().float())
+
+    @property
+    def weight(self) -> torch.Tensor:
+        # 部分模块（如 nn.MultiheadAttention 的 out_proj）直接读取 .weight
+        return self.weight_int8.float() * self.scale[:, None]
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        weight = self.weight_int8.to(x.dtype) * self.scale.to(x.dtype)[:, None]
+        return F.linear(x, weight, None if self.bias is None else self.bias.to(x.dtype))
+
+    def extra_repr(self) -> str:
+        return f"in_features={self.in_features}, out_features={self.out_features}, bias={self.bias is not None}"
+
+
+def _replace_linears(module: torch.nn.Module, factory):
+    for name, child in module.named_children():
+        if isinstance(child, torch.nn.Linear):
+            setattr(module, name, factory(child))
+        else:
+            _replace_linears(child, factory)
+
+
+# 每种精度下可以保持原样的浮点权重 dtype，其余转换为 fp32（int8 下未量化的模块与激活保持 fp32）
+_KEPT_DTYPES = {
+    "fp16": (torch.float32, torch.float16),
+    "bf16": (torch.float32, torch.bfloat16),
+}
+
+
+def _cast_weights(model: torch.nn.Module, precision: str) -> torch.nn.Module:
+    # 逐 tensor 转换：dtype 已可用的 tensor（包括 mmap 视图）原样保留，不产生副本
+    kept = _KEPT_DTYPES.get(precision, (torch.float32,))
+    return model._apply(lambda t: t.float() if t.is_floating_point() and t.dtype not in kept else t)
+
+
+def apply_precision(model: torch.nn.Module, precision: str) -> torch.nn.Module:
+    """加载后对模型做一次性转换；返回的模型可能是新对象（int8_dynamic）。"""
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision '{precision}', expected one of {', '.join(PRECISIONS)}")
+    if precision == "int8_weight_only":
+        # 直接从加载的（可能是 mmap 的 fp16 / bf16）权重量化 Linear，不产生整个模型的 fp32 副本
+        _replace_linears(model, WeightOnlyInt8Linear)
+    model = _cast_weights(model, precision)
+    if precision == "int8_dynamic":
+        with warnings.catch_warnings():
+            # torch.ao 的 eager 量化接口已标记为弃用（迁移到 torchao），但仍是不引入新依赖时的 CPU 动态量化实现
+            warnings.simplefilter("ignore")
+            from torch.ao.quantization import quantize_dynamic
+            model = quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        _disable_mha_fastpath(model)
+    return model
+
+
+# 读取 torch.backends.mha fastpath 开关的模块
+_FASTPATH_MODULES = (torch.nn.MultiheadAttention, torch.nn.TransformerEncoderLayer, torch.nn.TransformerEncoder)
+
+
+def _disable_mha_fastpath(model: torch.nn.Module):
+    """
+    nn.TransformerEncoderLayer / MultiheadAttention 的 fastpath 直接读取 Linear 的 .weight tensor，量化后的 Linear 不支持。
+    这个开关是进程级的，所以只在该模型这些模块的前向期间关闭，结束后（包括抛出异常时）恢复原值，
+    不影响同一进程中的其他模型，模型被淘汰后也不留下副作用。
+    """
+    previous = []
+
+    def disable(module, args):
+        previous.append(torch.backends.mha.get_fastpath_enabled())
+        torch.backends.mha.set_fastpath_enabled(False)
+
+    def restore(module, args, output):
+        torch.backends.mha.set_fastpath_enabled(previous.pop())
+
+    modules = [m for m in model.modules() if isinstance(m, _FASTPATH_MODULES)]
+    for module in modules:
+        module.register_forward_pre_hook(disable)
+        module.register_forward_hook(restore, always_call=True)
+    if modules:
+        logger.info(f"int8_dynamic: MHA fastpath disabled during the forward of {len(modules)} attention modules")
+
+
+def autocast(device: str, precision: str):
+    """推理时的上下文：fp16 / bf16 返回 torch.autocast，其余精度不需要。"""
+    if precision in ("fp16", "bf16"):
+        dtype = torch.float16 if precision == "fp16" else torch.bfloat16
+        return torch.autocast(torch.device(device).type, dtype=dtype)
+    return nullcontext()
+
+
+# ---------------------------------------------------------------- benchmark
+class _SlideClassifier(torch.nn.Module):
+    # tile 编码器（transformer）+ 均值池化 + 线性分类头，规模接近 slide encoder
+    def __init__(self, dim: int, depth: int, num_classes: int = 2):
+        super().__init__()
+        layer = torch.nn.TransformerEncoderLayer(dim, nhead=max(1, dim // 64), dim_feedforward=4 * dim,
+                                                 batch_first=True)
+        self.encoder = torch.nn.TransformerEncoder(layer, depth, enable_nested_tensor=False)
+        self.head = torch.nn.Linear(dim, num_classes)
+
+    def forward(self, tiles):
+        return self.head(self.encoder(tiles).mean(dim=1))
+
+
+def _predict(model, slides, precision, batch_size):
+    probs = []
+    with autocast("cpu", precision), torch.inference_mode():
+        for start in range(0, len(slides), batch_size):
+            probs.append(torch.softmax(model(slides[start:start + batch_size]).float(), dim=-1))
+    return torch.cat(probs).numpy()
+
+
+def _as_predictions(probs):
+    # 与模型 classify 的输出格式一致，直接交给 utils.metrics
+    return [{"pred_class": int(p.argmax()), "probabilities": p.tolist()} for p in probs]
+
+
+def benchmark(precisions=PRECISIONS, num_slides: int = 64, num_tiles: int = 256, dim: int = 384, depth: int = 4,
+              batch_size: int = 8, seed: int = 0):
+    """
+    在 CPU 上用随机初始化的模型与合成 slide 比较各精度：吞吐（slides/sec）以及 ACC / AUC 相对 fp32 的变化。
+    标签由 fp32 预测加 15% 噪声得到，使 fp32 指标处于真实评估中常见的区间。
+    """
+    from utils.metrics import acc, auc
+    torch.manual_seed(seed)
+    rng = np.random.default_rng(seed)
+    reference = _SlideClassifier(dim, depth).eval()
+    slides = torch.randn(num_slides, num_tiles, dim)
+
+    results = {}
+    for precision in precisions:
+        precision = resolve_precision(precision, "cpu")
+        model = apply_precision(copy.deepcopy(reference), precision).eval()
+        _predict(model, slides[:batch_size], precision, batch_size)  # warmup
+        start = time.perf_counter()
+        probs = _predict(model, slides, precision, batch_size)
+        results[precision] = {"slides_per_sec": num_slides / (time.perf_counter() - start), "probs": probs}
+
+    base = results.get("fp32") or next(iter(results.values()))
+    labels = base["probs"].argmax(axis=1)
+    flip = rng.random(num_slides) < 0.15
+    labels[flip] = 1 - labels[flip]
+    base_preds = _as_predictions(base["probs"])
+    base_acc, base_auc = acc(labels, base_preds), auc(labels, base_preds)
+    for precision, result in results.items():
+        probs, preds = result["probs"], _as_predictions(result["probs"])
+        delta_acc = acc(labels, preds) - base_acc
+        delta_auc = auc(labels, preds) - base_auc
+        agreement = float((probs.argmax(axis=1) == base["probs"].argmax(axis=1)).mean())
+        logger.info(f"{precision:>16}: {result['slides_per_sec']:7.2f} slides/sec "
+                    f"({result['slides_per_sec'] / base['slides_per_sec']:.2f}x), "
+                    f"ΔACC {delta_acc:+.4f}, ΔAUC {delta_auc:+.4f}, agreement with fp32 {agreement:.3f}, "
+                    f"max |Δprob| {np.abs(probs - base['probs']).max():.4f}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Throughput and metric deltas of the CPU inference precisions")
+    parser.add_argument("--precisions", nargs="+", default=[p for p in PRECISIONS if p != "fp16"])
+    parser.add_argument("--slides", type=int, default=64)
+    parser.add_argument("--tiles", type=int, default=256)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--depth", type=int, default=4)
+    parser.add_argument("--batch_size", type=int, default=8)
+    args = parser.parse_args()
+    benchmark(args.precisions, args.slides, args.tiles, args.dim, args.depth, args.batch_size)
@@ -0,0 +1,110 @@
+import os
+import json
+import numbers
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Sequence
+import numpy as np
+
+# 逐 slide 预测的列式存储（npz）：每列是一个有类型的 numpy 数组，读取时只解压需要的列。
+#   slide_name: str
+#   label: int / float / str；生存标签拆成 label_time (float64) + label_event (int8)
+#   预测 dict 的每个键一列：pred_class (int64)、probabilities (float32 [n, K])、risk_score (float64) ...
+#   生成的报告文本: text (str)
+# 无法表示成定长数值/字符串的列（长度不一的列表、嵌套结构）以 JSON 字符串存为 <name>_json。
+PREDICTIONS_FILE = "predictions.npz"
+SUMMARY_FILE = "predictions_summary.json"
+
+
+@contextmanager
+def atomic_write(path: str, mode: str = "w"):
+    """先写同目录下的临时文件，fsync 后 rename 覆盖目标；中途失败不会留下半个文件。"""
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    try:
+        with open(tmp_path, mode) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, numbers.Number) or (isinstance(value, np.generic) and np.issubdtype(type(value), np.number))
+
+
+def _typed_column(name: str, values: List[Any], float_dtype=np.float64) -> Dict[str, np.ndarray]:
+    values = [value.tolist() if hasattr(value, "tolist") else value for value in values]
+    if all(isinstance(value, str) for value in values):
+        return {name: np.asarray(values, dtype=str)}
+    if all(_is_number(value) and not isinstance(value, bool) for value in values):
+        array = np.asarray(values)
+        return {name: array if np.issubdtype(array.dtype, np.integer) else array.astype(float_dtype)}
+    if all(isinstance(value, bool) for value in values):
+        return {name: np.asarray(values, dtype=bool)}
+    if values and all(isinstance(value, (list, tuple)) and len(value) == len(values[0])
+                      and all(_is_number(v) for v in value) for value in values):
+        return {name: np.asarray(values, dtype=float_dtype)}
+    return {f"{name}_json": np.asarray([json.dumps(value) for value in values], dtype=str)}
+
+
+def prediction_columns(slide_names: Sequence[str], labels: Sequence[Any], preds: Sequence[Any]) -> Dict[str, np.ndarray]:
+    columns = {"slide_name": np.asarray(list(slide_names), dtype=str)}
+
+    # 生存标签 (time, event)
+    if labels and all(isinstance(label, (list, tuple)) and len(label) == 2 and all(_is_number(v) for v in label)
+                      for label in labels):
+        columns["label_time"] = np.asarray([label[0] for label in labels], dtype=np.float64)
+        columns["label_event"] = np.asarray([label[1] for label in labels], dtype=np.int8)
+    else:
+        columns.update(_typed_column("label", list(labels)))
+
+    if preds and all(isinstance(pred, dict) for pred in preds):
+        keys = list(dict.fromkeys(key for pred in preds for key in pred))
+        for key in keys:
+            values = [pred.get(key) for pred in preds]
+            # 概率矩阵用 float32 存储即可，体积减半
+            columns.update(_typed_column(key, values, np.float32 if key == "probabilities" else np.float64))
+    elif all(isinstance(pred, str) for pred in preds):
+        columns["text"] = np.asarray(list(preds), dtype=str)
+    else:
+        columns.update(_typed_column("pred", list(preds)))
+    return columns
+
+
+def summarize_columns(columns: Dict[str, np.ndarray]) -> Dict[str, Any]:
+    """给人看的简要摘要：每列的类型/形状，以及取值分布或数值范围。"""
+    summary = {"num_slides": int(len(columns["slide_name"])), "file": PREDICTIONS_FILE, "columns": {}}
+    for name, array in columns.items():
+        info = {"dtype": str(array.dtype), "shape": list(array.shape)}
+        if name in ("label", "pred_class", "label_event") and np.issubdtype(array.dtype, np.integer):
+            values, counts = np.unique(array, return_counts=True)
+            info["counts"] = {str(v): int(c) for v, c in zip(values, counts)}
+        elif array.ndim == 1 and np.issubdtype(array.dtype, np.number) and len(array):
+            info.update(min=float(array.min()), mean=float(array.mean()), max=float(array.max()))
+        elif name == "text" and len(array):
+            info["mean_words"] = float(np.mean([len(text.split()) for text in array]))
+        summary["columns"][name] = info
+    return summary
+
+
+def write_predictions(result_dir: str, columns: Dict[str, np.ndarray]):
+    """原子地写入 predictions.npz 与 predictions_summary.json。"""
+    with atomic_write(os.path.join(result_dir, PREDICTIONS_FILE), "wb") as f:
+        np.savez(f, **columns)
+    with atomic_write(os.path.join(result_dir, SUMMARY_FILE)) as f:
+        json.dump(summarize_columns(columns), f, indent=2)
+
+
+def read_predictions(result_dir: str, columns: Optional[Sequence[str]] = None) -> Optional[Dict[str, np.ndarray]]:
+    """
+    读取 predictions.npz；columns 指定只加载哪些列（npz 中的列按需解压，其余列不会被读取）。
+    文件不存在时返回 None；请求的列不存在时跳过。
+    """
+    path = os.path.join(result_dir, PREDICTIONS_FILE)
+    if not os.path.exists(path):
+        return None
+    with np.load(path, allow_pickle=False) as data:
+        names = data.files if columns is None else [name for name in columns if name in data.files]
+        return {name: data[name] for name in names}
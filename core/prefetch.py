@@ -0,0 +1,120 @@
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence
+from torch.utils.data import DataLoader, Subset
+from . import tracing
+from utils.logger import default_logger as logger
+
+# 消费者等待超过该时间（秒）的 batch 记为一次队列饥饿
+STARVATION_THRESHOLD = 1e-3
+
+
+class PrefetchLoader:
+    """
+    后台预取的特征加载器：当前 batch 在推理时，后台并行读取后续 depth 张 slide 的特征。
+    在途的 slide 数量有上限，内存占用是有界的。
+
+    Args:
+        dataset: BaseDataset
+        batch_size: 每个 batch 的 slide 数
+        collate_fn: 组 batch 的函数
+        num_workers: 后台读取的线程/进程数，0 表示在当前线程同步读取
+        depth: 预取深度（在途的 slide 数上限）
+        backend: "thread"（线程池，适合 mmap / 文件 I/O）或 "process"（DataLoader worker 进程）
+        indices: 只读取这些下标的 slide（按给定顺序），None 表示整个数据集
+    """
+
+    def __init__(self, dataset, batch_size: int, collate_fn: Callable, num_workers: int = 0, depth: int = 8,
+                 backend: str = "thread", indices: Optional[Sequence[int]] = None):
+        if backend not in ("thread", "process"):
+            raise ValueError(f"Unknown prefetch backend: {backend}")
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.collate_fn = collate_fn
+        self.num_workers = num_workers
+        self.depth = max(depth, batch_size)
+        self.backend = backend
+        self.indices = list(range(len(dataset))) if indices is None else list(indices)
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.num_batches = 0
+        self.starved_batches = 0
+        self.wait_time = 0.0
+        self.compute_time = 0.0
+
+    def __len__(self) -> int:
+        return (len(self.indices) + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        if self.num_workers > 0 and self.backend == "process":
+            # worker 进程中不做按需特征提取，缺失的特征先在本进程中提取
+            extract_missing = getattr(self.dataset, "extract_missing_features", None)
+            if extract_missing is not None:
+                extract_missing(self.indices)
+            source = iter(DataLoader(Subset(self.dataset, self.indices), batch_size=self.batch_size, shuffle=False,
+                                     collate_fn=self.collate_fn, num_workers=self.num_workers,
+                                     prefetch_factor=max(1, self.depth // (self.batch_size * self.num_workers))))
+        elif self.num_workers > 0:
+            source = self._iter_threaded()
+        else:
+            source = self._iter_sync()
+
+        while True:
+            start = time.perf_counter()
+            try:
+                batch = next(source)
+            except StopIteration:
+                return
+            end = time.perf_counter()
+            tracing.record("wait", start, end)
+            waited = end - start
+            self.wait_time += waited
+            self.num_batches += 1
+            if waited > STARVATION_THRESHOLD:
+                self.starved_batches += 1
+            start = time.perf_counter()
+            yield batch
+            self.compute_time += time.perf_counter() - start
+
+    def _batches(self) -> List[List[int]]:
+        return [self.indices[i: i + self.batch_size] for i in range(0, len(self.indices), self.batch_size)]
+
+    def _load(self, index: int) -> Dict[str, Any]:
+        with tracing.span("load", sampled=True):
+            return self.dataset[index]
+
+    def _collate(self, items: List[Dict[str, Any]]) -> Dict[str, Any]:
+        with tracing.span("collate"):
+            return self.collate_fn(items)
+
+    def _iter_sync(self) -> Iterator[Dict[str, Any]]:
+        for indices in self._batches():
+            yield self._collate([self._load(i) for i in indices])
+
+    def _iter_threaded(self) -> Iterator[Dict[str, Any]]:
+        indices = iter(i for batch in self._batches() for i in batch)
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self.num_workers, thread_name_prefix="prefetch") as pool:
+            def submit():
+                index = next(indices, None)
+                if index is not None:
+                    pending.append(pool.submit(self._load, index))
+
+            for _ in range(self.depth):
+                submit()
+            while pending:
+                items = []
+                while pending and len(items) < self.batch_size:
+                    items.append(pending.popleft().result())
+                    submit()
+                yield self._collate(items)
+
+    def log_stats(self, name: str):
+        total = self.wait_time + self.compute_time
+        wait_ratio = self.wait_time / total if total > 0 else 0.0
+        bound = "I/O-bound" if wait_ratio > 0.5 else "compute-bound"
+        logger.info(f"{name} loader ({self.backend}, workers={self.num_workers}, depth={self.depth}): "
+                    f"{self.starved_batches}/{self.num_batches} batches starved, waited {self.wait_time:.2f}s "
+                    f"vs compute {self.compute_time:.2f}s ({wait_ratio:.0%} waiting, {bound})")
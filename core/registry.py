@@ -0,0 +1,89 @@
+import importlib
+from importlib import metadata
+from typing import Any, Dict, List, Optional, Union
+
+# 模型 / 数据集 / 任务 / 指标的名字注册表。
+# 内置实现以 "module:attr" 字符串登记，配置第一次引用某个名字时才 import 对应模块（以及它的 torch /
+# transformers 等重依赖），因此 `python main.py --help` 或只重画图时不会加载任何模型代码。
+# 第三方插件在自己的包里声明 entry point 即可注册，例如 pyproject.toml 中：
+#   [project.entry-points."wsibench.models"]
+#   MyModel = "my_package.model:MyModel"
+
+
+def import_target(target: str) -> Any:
+    """导入 "module:attr" 指向的对象。"""
+    module_name, _, attr = target.partition(":")
+    return getattr(importlib.import_module(module_name), attr)
+
+
+class Registry:
+    """
+    Args:
+        kind: 注册对象的类别，用于错误信息
+        group: 插件的 entry point 组名
+        package: 登记内置实现的包；第一次查询时 import 它（包的 __init__ 中只做字符串登记，开销很小）
+    """
+
+    def __init__(self, kind: str, group: str, package: Optional[str] = None):
+        self.kind = kind
+        self.group = group
+        self.package = package
+        self._targets: Dict[str, Union[str, Any]] = {}
+        self._builtins_loaded = package is None
+        self._entry_points_loaded = False
+
+    def register(self, name: str, target: Union[str, Any, None] = None):
+        """登记 name -> target；target 可以是对象或 "module:attr" 字符串。不传 target 时作装饰器使用。"""
+        if target is None:
+            def decorator(obj):
+                self._targets[name] = obj
+                return obj
+            return decorator
+        self._targets[name] = target
+        return target
+
+    def _load_builtins(self):
+        if not self._builtins_loaded:
+            self._builtins_loaded = True
+            importlib.import_module(self.package)
+
+    def _load_entry_points(self):
+        if self._entry_points_loaded:
+            return
+        self._entry_points_loaded = True
+        for entry_point in metadata.entry_points(group=self.group):
+            # 同名时内置 / 显式注册的实现优先
+            self._targets.setdefault(entry_point.name, entry_point.value)
+
+    def _target(self, name: str):
+        self._load_builtins()
+        if name not in self._targets:
+            self._load_entry_points()
+        if name not in self._targets:
+            raise KeyError(f"Unknown {self.kind} '{name}', available: {', '.join(self.names())}")
+        return self._targets[name]
+
+    def get(self, name: str) -> Any:
+        target = self._target(name)
+        if isinstance(target, str):
+            target = import_target(target)
+            self._targets[name] = target
+        return target
+
+    def __contains__(self, name: str) -> bool:
+        try:
+            self._target(name)
+            return True
+        except KeyError:
+            return False
+
+    def names(self) -> List[str]:
+        self._load_builtins()
+        self._load_entry_points()
+        return sorted(self._targets)
+
+
+MODELS = Registry("model", "wsibench.models", package="models")
+DATASETS = Registry("dataset", "wsibench.datasets", package="datasets")
+TASKS = Registry("task", "wsibench.tasks", package="tasks")
+METRICS = Registry("metric", "wsibench.metrics", package="utils.metrics")
@@ -0,0 +1,197 @@
+import os
+import math
+import time
+import uuid
+import sqlite3
+import argparse
+from typing import Any, Dict, List, Optional, Sequence
+from utils.logger import default_logger as logger
+
+# 所有运行的指标汇总到一个 SQLite 索引，每个 (run, task, model, dataset, metric) 一行。
+# 排行榜、指标表、历史对比都是一条走索引的查询，不再遍历 results/ 目录逐个解析 metrics.json。
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    run_id      TEXT NOT NULL,
+    task        TEXT NOT NULL,
+    model       TEXT NOT NULL,
+    dataset     TEXT NOT NULL,
+    metric      TEXT NOT NULL,
+    fingerprint TEXT,
+    value       REAL,
+    ci_low      REAL,
+    ci_high     REAL,
+    created_at  REAL NOT NULL,
+    PRIMARY KEY (run_id, task, model, dataset, metric)
+);
+CREATE INDEX IF NOT EXISTS idx_results_cell ON results (task, metric, dataset, model, created_at);
+CREATE INDEX IF NOT EXISTS idx_results_fingerprint ON results (fingerprint);
+"""
+
+# 每个 (task, model, dataset, metric) 最近一次写入的结果
+_LATEST = """
+SELECT * FROM (
+    SELECT *, ROW_NUMBER() OVER (PARTITION BY task, model, dataset, metric ORDER BY created_at DESC) AS recency
+    FROM results WHERE task = ? AND metric = ? {filters}
+) WHERE recency = 1
+"""
+
+
+def new_run_id() -> str:
+    """一次 main.py 调用的 id：时间戳 + 随机后缀，按字典序即按时间排序。"""
+    return f"{time.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+
+
+def _number(value) -> Optional[float]:
+    if value is None:
+        return None
+    value = float(value)
+    return None if math.isnan(value) else value
+
+
+def _in_clause(column: str, values: Optional[Sequence[str]]):
+    if not values:
+        return "", []
+    return f" AND {column} IN ({', '.join('?' * len(values))})", list(values)
+
+
+class ResultsIndex:
+    """
+    嵌入式结果索引。BaseTask.save_results 每保存一次就 upsert 一批指标；
+    并行 worker 各自打开连接，WAL 模式下读写互不阻塞，写入冲突时等待 timeout 秒。
+
+    Args:
+        path: SQLite 文件路径
+        run_id: 本次运行的 id，None 时自动生成
+        timeout: 等待其他进程写锁的秒数
+    """
+
+    def __init__(self, path: str = "results/results.db", run_id: Optional[str] = None, timeout: float = 30.0):
+        self.path = path
+        self.run_id = run_id or new_run_id()
+        self.timeout = timeout
+        self._conn = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        # 延迟打开：对象可以随配置 pickle 到 worker 进程，连接在各进程中各自建立
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=self.timeout)
+            self._conn.row_factory = sqlite3.Row
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+        return self._conn
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["_conn"] = None
+        return state
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def upsert(self, task: str, model: str, dataset: str, metrics: Dict[str, Any], fingerprint: Optional[str] = None):
+        """写入一组指标；<metric>_ci 作为对应指标的置信区间列。同一 run 内重复保存时覆盖。"""
+        now = time.time()
+        rows = []
+        for name, value in metrics.items():
+            if name.endswith("_ci") and name[:-len("_ci")] in metrics:
+                continue
+            ci = metrics.get(f"{name}_ci") or (None, None)
+            rows.append((self.run_id, task, model, dataset, name, fingerprint,
+                         _number(value), _number(ci[0]), _number(ci[1]), now))
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO results (run_id, task, model, dataset, metric, fingerprint, value, ci_low, ci_high, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (run_id, task, model, dataset, metric) DO UPDATE SET "
+                "fingerprint = excluded.fingerprint, value = excluded.value, ci_low = excluded.ci_low, "
+                "ci_high = excluded.ci_high, created_at = excluded.created_at", rows)
+
+    def latest(self, task: str, metric: str, models: Optional[Sequence[str]] = None,
+               datasets: Optional[Sequence[str]] = None) -> List[sqlite3.Row]:
+        model_filter, model_args = _in_clause("model", models)
+        dataset_filter, dataset_args = _in_clause("dataset", datasets)
+        query = _LATEST.format(filters=model_filter + dataset_filter)
+        return self.conn.execute(query, [task, metric] + model_args + dataset_args).fetchall()
+
+    def leaderboard(self, task: str, metric: str, dataset: Optional[str] = None,
+                    higher_is_better: bool = True) -> List[Dict[str, Any]]:
+        """按最近一次结果排序的模型排名；dataset 为 None 时对各数据集取平均。"""
+        rows = self.latest(task, metric, datasets=[dataset] if dataset else None)
+        scores: Dict[str, List[float]] = {}
+        for row in rows:
+            if row["value"] is not None:
+                scores.setdefault(row["model"], []).append(row["value"])
+        board = [{"model": model, "value": sum(values) / len(values), "num_datasets": len(values)}
+                 for model, values in scores.items()]
+        board.sort(key=lambda entry: entry["value"], reverse=higher_is_better)
+        for rank, entry in enumerate(board, 1):
+            entry["rank"] = rank
+        return board
+
+    def metric_table(self, task: str, metric: str, models: Optional[Sequence[str]] = None,
+                     datasets: Optional[Sequence[str]] = None) -> Dict[str, Dict[str, Optional[float]]]:
+        """{dataset: {model: value}}，取每个组合最近一次的结果。"""
+        table: Dict[str, Dict[str, Optional[float]]] = {}
+        for row in self.latest(task, metric, models, datasets):
+            table.setdefault(row["dataset"], {})[row["model"]] = row["value"]
+        return table
+
+    def history(self, task: str, model: str, dataset: str, metric: str) -> List[Dict[str, Any]]:
+        """某个组合在各次运行中的结果，按时间排序。"""
+        rows = self.conn.execute(
+            "SELECT run_id, fingerprint, value, ci_low, ci_high, created_at FROM results "
+            "WHERE task = ? AND metric = ? AND dataset = ? AND model = ? ORDER BY created_at",
+            (task, metric, dataset, model)).fetchall()
+        return [dict(row) for row in rows]
+
+    def compare_runs(self, run_a: str, run_b: str, task: Optional[str] = None) -> List[Dict[str, Any]]:
+        """两次运行中共同的 (task, model, dataset, metric) 的数值及差值（b - a）。"""
+        query = ("SELECT a.task, a.model, a.dataset, a.metric, a.value AS value_a, b.value AS value_b, "
+                 "b.value - a.value AS delta, a.fingerprint = b.fingerprint AS same_fingerprint "
+                 "FROM results a JOIN results b USING (task, model, dataset, metric) "
+                 "WHERE a.run_id = ? AND b.run_id = ?")
+        args = [run_a, run_b]
+        if task is not None:
+            query += " AND a.task = ?"
+            args.append(task)
+        return [dict(row) for row in self.conn.execute(query + " ORDER BY a.task, a.metric, a.dataset, a.model", args)]
+
+    def runs(self) -> List[Dict[str, Any]]:
+        rows = self.conn.execute("SELECT run_id, MIN(created_at) AS started, COUNT(*) AS num_results "
+                                 "FROM results GROUP BY run_id ORDER BY started").fetchall()
+        return [dict(row) for row in rows]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the results index")
+    parser.add_argument("--db", default="results/results.db")
+    sub = parser.add_subparsers(dest="command", required=True)
+    board_parser = sub.add_parser("leaderboard")
+    board_parser.add_argument("task")
+    board_parser.add_argument("metric", help="metric key as stored in metrics.json, e.g. auc, c_index")
+    board_parser.add_argument("--dataset", default=None)
+    board_parser.add_argument("--lower_is_better", action="store_true")
+    history_parser = sub.add_parser("history")
+    for name in ("task", "model", "dataset", "metric"):
+        history_parser.add_argument(name)
+    compare_parser = sub.add_parser("compare")
+    compare_parser.add_argument("run_a")
+    compare_parser.add_argument("run_b")
+    sub.add_parser("runs")
+    args = parser.parse_args()
+
+    index = ResultsIndex(args.db)
+    if args.command == "leaderboard":
+        rows = index.leaderboard(args.task, args.metric, args.dataset, higher_is_better=not args.lower_is_better)
+    elif args.command == "history":
+        rows = index.history(args.task, args.model, args.dataset, args.metric)
+    elif args.command == "compare":
+        rows = index.compare_runs(args.run_a, args.run_b)
+    else:
+        rows = index.runs()
+    for row in rows:
+        logger.info(row)
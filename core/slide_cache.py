@@ -0,0 +1,228 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+import numpy as np
+import torch
+from .base_model import BaseModel
+from utils.logger import default_logger as logger
+
+# 单个 tensor 作为缓存值时使用的字段名
+_TENSOR_FIELD = "__tensor__"
+# numpy 没有 bfloat16：按位存成 int16，文件名带上这个后缀，读取时再 view 回 bf16
+_BF16_SUFFIX = ".bf16"
+
+
+def _value_nbytes(value) -> int:
+    if isinstance(value, dict):
+        return sum(_value_nbytes(v) for v in value.values())
+    return value.numel() * value.element_size()
+
+
+class SlideEmbeddingCache:
+    """
+    slide 级表征的持久化、内容寻址缓存。
+    key = sha256(模型身份(model_path + 权重校验和) + 特征文件(路径/大小/mtime，或特征内容哈希) + 推理设置)
+    磁盘格式: cache_dir/<key[:2]>/<key>/<field>.npy（bf16 为 <field>.bf16.npy），读取时用 mmap 映射，不做反序列化。
+    内存中有一个 LRU 作为前置缓存，磁盘按总大小淘汰最久未访问的条目。
+    多个 worker 共享同一个 cache_dir 时，淘汰前会重新扫描目录，max_disk_gb 是整个目录的上限而不是每个 worker 的。
+
+    Args:
+        cache_dir: 缓存根目录
+        max_memory_mb: 进程内 LRU 的容量上限（MB）
+        max_disk_gb: 磁盘缓存容量上限（GB），None 表示不限制
+    """
+
+    def __init__(self, cache_dir: str = "cache/slide_embeddings", max_memory_mb: float = 1024,
+                 max_disk_gb: Optional[float] = None):
+        self.cache_dir = cache_dir
+        self.max_memory_bytes = int(max_memory_mb * 1024 ** 2)
+        self.max_disk_bytes = None if max_disk_gb is None else int(max_disk_gb * 1024 ** 3)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        self._memory = OrderedDict()  # key -> (value, nbytes)
+        self._memory_bytes = 0
+        self._disk = self._scan_disk()  # key -> nbytes，按最近访问时间排序
+        self._disk_bytes = sum(self._disk.values())
+
+        self.hits = 0
+        self.misses = 0
+        self.bytes_served = 0
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def _scan_disk(self) -> "OrderedDict[str, int]":
+        entries = []
+        for shard in os.scandir(self.cache_dir):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if not entry.is_dir() or entry.name.startswith("."):
+                    continue
+                try:
+                    nbytes = sum(f.stat().st_size for f in os.scandir(entry.path))
+                    entries.append((entry.stat().st_mtime, entry.name, nbytes))
+                except FileNotFoundError:
+                    # 扫描过程中被其他 worker 淘汰了
+                    continue
+        entries.sort()
+        return OrderedDict((key, nbytes) for _, key, nbytes in entries)
+
+    def make_key(self, model: BaseModel, slide_info: Dict[str, Any], bag: Optional[torch.Tensor]) -> Optional[str]:
+        """Content address of one slide's representation; None if the slide cannot be cached."""
+        feature_path = slide_info.get("feature_path")
+        if feature_path is not None and os.path.exists(feature_path):
+            stat = os.stat(feature_path)
+            # 打包特征库中多张 slide 共享一个 shard 文件，所以 slide_name 也是 key 的一部分
+            feature_id = {"path": os.path.abspath(feature_path), "size": stat.st_size, "mtime": stat.st_mtime_ns,
+                          "slide": slide_info.get("slide_name")}
+        elif bag is not None:
+            feature_id = {"sha256": hashlib.sha256(bag.detach().cpu().numpy().tobytes()).hexdigest(),
+                          "shape": list(bag.shape)}
+        else:
+            return None
+        ingredients = {
+            "model": {"name": model.model_name, "path": model.model_path, "checksum": model.weights_checksum()},
+            "feature": feature_id,
+            "settings": model.inference_settings(),
+        }
+        return hashlib.sha256(json.dumps(ingredients, sort_keys=True, default=str).encode()).hexdigest()
+
+    def get(self, key: str):
+        if key in self._memory:
+            value, nbytes = self._memory[key]
+            self._memory.move_to_end(key)
+            self._record_hit(nbytes)
+            return value
+
+        if key in self._disk:
+            entry_dir = self._entry_dir(key)
+            try:
+                value = self._load(entry_dir)
+            except OSError:
+                self._drop_disk_entry(key)
+                self.misses += 1
+                return None
+            os.utime(entry_dir)
+            self._disk.move_to_end(key)
+            nbytes = _value_nbytes(value)
+            self._remember(key, value, nbytes)
+            self._record_hit(nbytes)
+            return value
+
+        self.misses += 1
+        return None
+
+    def put(self, key: str, value):
+        if key not in self._disk:
+            self._store(key, value)
+        self._remember(key, value, _value_nbytes(value))
+
+    def _record_hit(self, nbytes: int):
+        self.hits += 1
+        self.bytes_served += nbytes
+
+    def _remember(self, key: str, value, nbytes: int):
+        if key in self._memory:
+            self._memory_bytes -= self._memory.pop(key)[1]
+        self._memory[key] = (value, nbytes)
+        self._memory_bytes += nbytes
+        while self._memory_bytes > self.max_memory_bytes and len(self._memory) > 1:
+            _, (_, evicted_bytes) = self._memory.popitem(last=False)
+            self._memory_bytes -= evicted_bytes
+
+    @staticmethod
+    def _load(entry_dir: str):
+        fields = {}
+        for name in os.listdir(entry_dir):
+            if name.endswith(".npy"):
+                # copy-on-write 映射：数据页直接来自 page cache，无需反序列化
+                tensor = torch.from_numpy(np.load(os.path.join(entry_dir, name), mmap_mode="c"))
+                name = name[:-4]
+                if name.endswith(_BF16_SUFFIX):
+                    tensor, name = tensor.view(torch.bfloat16), name[:-len(_BF16_SUFFIX)]
+                fields[name] = tensor
+        if set(fields) == {_TENSOR_FIELD}:
+            return fields[_TENSOR_FIELD]
+        return fields
+
+    def _store(self, key: str, value):
+        fields = value if isinstance(value, dict) else {_TENSOR_FIELD: value}
+        entry_dir = self._entry_dir(key)
+        os.makedirs(os.path.dirname(entry_dir), exist_ok=True)
+        # 先写临时目录再 rename，保证并发读到的条目总是完整的
+        tmp_dir = tempfile.mkdtemp(prefix=".tmp-", dir=os.path.dirname(entry_dir))
+        nbytes = 0
+        for name, tensor in fields.items():
+            array = tensor.detach().cpu()
+            if array.dtype == torch.bfloat16:
+                array, name = array.view(torch.int16), name + _BF16_SUFFIX
+            path = os.path.join(tmp_dir, f"{name}.npy")
+            np.save(path, array.numpy())
+            nbytes += os.path.getsize(path)
+        try:
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            # 其他进程已经写入了同一个 key
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return
+        self._disk[key] = nbytes
+        self._disk_bytes += nbytes
+        self._evict_disk()
+
+    def _evict_disk(self):
+        if self.max_disk_bytes is None:
+            return
+        # 其他 worker 写入的条目不在本进程的统计里，淘汰前按目录实际内容重新计数
+        self._disk = self._scan_disk()
+        self._disk_bytes = sum(self._disk.values())
+        while self._disk_bytes > self.max_disk_bytes and len(self._disk) > 1:
+            key = next(iter(self._disk))
+            self._drop_disk_entry(key)
+
+    def _drop_disk_entry(self, key: str):
+        self._disk_bytes -= self._disk.pop(key, 0)
+        shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def log_stats(self):
+        logger.info(f"Slide embedding cache: hits={self.hits}, misses={self.misses}, hit_rate={self.hit_rate:.2%}, "
+                    f"served~{self.bytes_served / 1024 ** 2:.1f} MB, "
+                    f"disk~{self._disk_bytes / 1024 ** 2:.1f} MB in {len(self._disk)} entries")
+
+
+def _select(features, mask, indices: List[int]):
+    if isinstance(features, torch.Tensor):
+        index = torch.tensor(indices, dtype=torch.long)
+        return features[index], None if mask is None else mask[index]
+    return [features[i] for i in indices], None if mask is None else mask[indices]
+
+
+def encode_slides(model: BaseModel, batch: Dict[str, Any], cache: Optional[SlideEmbeddingCache] = None):
+    """
+    对一个 collate 后的 batch 调用 model.encode_batch，已缓存的 slide 不再重新编码。
+    只有 has_slide_encoder 的模型会走缓存；其他模型的 encode_batch 只是把 batch 透传给 head。
+    """
+    features, mask = batch.get("embedding"), batch.get("mask")
+    if cache is None or not model.has_slide_encoder:
+        return model.encode_batch(features, mask=mask)
+
+    bags = list(model.iter_bags(features, mask))
+    keys = [cache.make_key(model, slide_info, bag) for slide_info, bag in zip(batch.get("slide_info"), bags)]
+    latents = [cache.get(key) if key is not None else None for key in keys]
+    missing = [i for i, latent in enumerate(latents) if latent is None]
+    if missing:
+        sub_features, sub_mask = _select(features, mask, missing)
+        for i, latent in zip(missing, model.encode_batch(sub_features, mask=sub_mask)):
+            latents[i] = latent
+            if keys[i] is not None:
+                cache.put(keys[i], latent)
+    return latents
@@ -0,0 +1,219 @@
+import os
+import json
+import glob
+import time
+import shutil
+import threading
+import itertools
+import functools
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+import numpy as np
+from .predictions import atomic_write
+from utils.logger import default_logger as logger
+
+# 各阶段的计时（runtime.yaml 中的 tracing）：
+#   model_load       从模型池取模型（未命中时包括加载权重）
+#   load             每张 slide 的特征读取（按 sample_every 采样；process 预取后端下在 DataLoader worker 中，不计时）
+#   collate / wait   每个 batch 的 collate 与主循环等待预取的时间
+#   encode / head    每个 batch 的 slide encoder 与任务 head
+#   metrics_update / metrics_compute   指标的逐 batch 累加与最终计算（含 bootstrap）
+#   save             预测文件写入
+#   plot             绘图
+# 每个 (task, model, dataset) 的 p50/p95/p99 写入 metrics.json 的 "timings"；可选导出整个运行的
+# Chrome trace-event JSON（chrome://tracing 或 https://ui.perfetto.dev 打开）。
+# 关闭时 span() 直接返回一个共享的空上下文，开销只有一次全局变量判断。
+
+_tracer = None
+
+
+def percentiles(values) -> Dict[str, Any]:
+    """耗时序列（秒）的统计，单位毫秒。"""
+    if len(values) == 0:
+        return {"count": 0}
+    values = np.asarray(values, dtype=np.float64) * 1000
+    return {"count": int(values.size), "total_ms": float(values.sum()), "mean_ms": float(values.mean()),
+            "p50_ms": float(np.percentile(values, 50)), "p95_ms": float(np.percentile(values, 95)),
+            "p99_ms": float(np.percentile(values, 99)), "max_ms": float(values.max())}
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("tracer", "stage", "task", "start")
+
+    def __init__(self, tracer: "Tracer", stage: str, task: Optional[str]):
+        self.tracer = tracer
+        self.stage = stage
+        self.task = task
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.record(self.stage, self.start, time.perf_counter(), self.task)
+        return False
+
+
+class Tracer:
+    """
+    收集当前进程中的 span。耗时按 (task, model, dataset, stage) 分组；task 为 None 的阶段（读取、encode）
+    由同一 (model, dataset) 下的所有任务共享。
+    """
+
+    def __init__(self, sample_every: int = 1, chrome_trace: Optional[str] = None):
+        self.sample_every = max(1, int(sample_every))
+        self.chrome_trace = chrome_trace
+        self.model, self.dataset = None, None  # 当前的 grid cell，由 cell() 设置，预取线程中的 span 同样计入
+        self.durations = defaultdict(list)
+        self.totals = defaultdict(float)  # stage -> 秒，整个运行的汇总（cell 结束后逐 slide 的耗时即被丢弃）
+        self.events = []
+        self._counter = itertools.count()
+        self._pid = os.getpid()
+
+    def span(self, stage: str, task: Optional[str] = None, sampled: bool = False):
+        if sampled and next(self._counter) % self.sample_every:
+            return _NULL_SPAN
+        return _Span(self, stage, task)
+
+    def record(self, stage: str, start: float, end: float, task: Optional[str] = None):
+        key = (task, self.model, self.dataset, stage)
+        self.durations[key].append(end - start)
+        if self.chrome_trace is not None:
+            args = {k: v for k, v in (("task", task), ("model", self.model), ("dataset", self.dataset)) if v}
+            self.events.append({"name": stage, "cat": task or "shared", "ph": "X", "ts": start * 1e6,
+                                "dur": (end - start) * 1e6, "pid": self._pid, "tid": threading.get_ident(),
+                                "args": args})
+
+    def summary(self, task: str, model: str, dataset: str) -> Dict[str, Dict[str, Any]]:
+        """一个 (task, model, dataset) 的各阶段统计，包括该 (model, dataset) 下共享的阶段。"""
+        return {stage: percentiles(values) for (t, m, d, stage), values in list(self.durations.items())
+                if m == model and d == dataset and t in (None, task)}
+
+    def end_cell(self):
+        # 当前 cell 的逐次耗时计入运行汇总后丢弃，内存不随 grid 大小增长
+        for key in [key for key in self.durations if key[1:3] == (self.model, self.dataset)]:
+            self.totals[key[3]] += sum(self.durations.pop(key))
+
+    def flush(self):
+        """把本进程的 trace 事件追加到 <chrome_trace>.parts/<pid>.jsonl（并行 worker 各写各的），由 export 合并。"""
+        if self.chrome_trace is None or not self.events:
+            return
+        parts_dir = self.chrome_trace + ".parts"
+        os.makedirs(parts_dir, exist_ok=True)
+        events, self.events = self.events, []
+        with open(os.path.join(parts_dir, f"{self._pid}.jsonl"), "a") as f:
+            for event in events:
+                f.write(json.dumps(event) + "\n")
+
+
+def configure(enabled: bool = True, sample_every: int = 1, chrome_trace: Optional[str] = None) -> Optional[Tracer]:
+    """按 runtime.yaml 的 tracing 设置启用计时；每个进程只生效一次（worker 进程各自调用）。"""
+    global _tracer
+    if enabled and _tracer is None:
+        _tracer = Tracer(sample_every, chrome_trace)
+    return _tracer
+
+
+def enabled() -> bool:
+    return _tracer is not None
+
+
+def span(stage: str, task: Optional[str] = None, sampled: bool = False):
+    """
+    with tracing.span("encode"): ...
+    task: 只属于某个任务的阶段（head、指标、保存）；sampled: 逐 slide 的 span，按 sample_every 采样
+    """
+    if _tracer is None:
+        return _NULL_SPAN
+    return _tracer.span(stage, task, sampled)
+
+
+def record(stage: str, start: float, end: float, task: Optional[str] = None):
+    """已自行计时的阶段（time.perf_counter 的起止时间）。"""
+    if _tracer is not None:
+        _tracer.record(stage, start, end, task)
+
+
+def traced(stage: str):
+    """装饰器形式的 span。"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return fn(*args, **kwargs)
+            with _tracer.span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def cell(model: str, dataset: str):
+    """在 with 块内产生的 span 归属于 (model, dataset)；退出时该 cell 的逐次耗时并入运行汇总。"""
+    if _tracer is None:
+        yield
+        return
+    previous = _tracer.model, _tracer.dataset
+    _tracer.model, _tracer.dataset = model, dataset
+    try:
+        yield
+    finally:
+        _tracer.end_cell()
+        _tracer.flush()
+        _tracer.model, _tracer.dataset = previous
+
+
+def summary(task: str, model: str, dataset: str) -> Optional[Dict[str, Dict[str, Any]]]:
+    return None if _tracer is None else _tracer.summary(task, model, dataset)
+
+
+def reset_chrome_trace():
+    """运行开始时清理上次运行残留的分片。"""
+    if _tracer is not None and _tracer.chrome_trace is not None:
+        shutil.rmtree(_tracer.chrome_trace + ".parts", ignore_errors=True)
+
+
+def export_chrome_trace() -> Optional[str]:
+    """合并所有进程的 trace 分片，写出 Chrome trace-event JSON；返回写出的路径。"""
+    if _tracer is None or _tracer.chrome_trace is None:
+        return None
+    _tracer.flush()
+    parts_dir = _tracer.chrome_trace + ".parts"
+    events = []
+    for part in sorted(glob.glob(os.path.join(parts_dir, "*.jsonl"))):
+        pid = int(os.path.basename(part).split(".")[0])
+        name = "main" if pid == os.getpid() else f"worker {pid}"
+        events.append({"name": "process_name", "ph": "M", "pid": pid, "args": {"name": name}})
+        with open(part, "r") as f:
+            events.extend(json.loads(line) for line in f)
+    os.makedirs(os.path.dirname(_tracer.chrome_trace) or ".", exist_ok=True)
+    with atomic_write(_tracer.chrome_trace) as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+    shutil.rmtree(parts_dir, ignore_errors=True)
+    logger.info(f"Chrome trace with {len(events)} events written to {_tracer.chrome_trace}")
+    return _tracer.chrome_trace
+
+
+def log_totals():
+    """本进程中各阶段的累计耗时（并行执行时只包含主进程中的阶段，如绘图）。"""
+    if _tracer is None:
+        return
+    for key in list(_tracer.durations):
+        _tracer.totals[key[3]] += sum(_tracer.durations.pop(key))
+    if _tracer.totals:
+        totals = sorted(_tracer.totals.items(), key=lambda item: -item[1])
+        logger.info("Stage timings: " + ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in totals))
@@ -0,0 +1,226 @@
+import os
+import json
+import time
+import struct
+import argparse
+import tempfile
+import multiprocessing as mp
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+import torch
+from utils.logger import default_logger as logger
+
+# 低内存的权重加载：
+#   1. 在 meta device 上构建模型结构（不分配参数内存，也不做随机初始化）；
+#   2. 权重文件以只读 mmap 映射（safetensors 直接解析文件头，.bin/.pt 用 torch.load(mmap=True)），
+#      得到的 tensor 就是文件页的视图，不复制到私有内存；
+#   3. load_state_dict(assign=True) 让参数直接指向这些视图。
+# 同一台机器上多个 worker 进程加载同一份权重时共享 page cache 中的只读页，而不是各自持有一份私有副本。
+# 移动到 GPU 或转换 dtype 时才会真正复制。
+
+_SAFETENSORS_DTYPES = {
+    "F64": torch.float64, "F32": torch.float32, "F16": torch.float16, "BF16": torch.bfloat16,
+    "I64": torch.int64, "I32": torch.int32, "I16": torch.int16, "I8": torch.int8, "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+_WEIGHT_FILES = ("model.safetensors", "pytorch_model.bin")
+_INDEX_FILES = ("model.safetensors.index.json", "pytorch_model.bin.index.json")
+
+
+def find_weight_files(model_path: str) -> List[str]:
+    """model_path 为单个权重文件，或 HF 格式目录（单文件或带 index.json 的分片）。"""
+    if os.path.isfile(model_path):
+        return [model_path]
+    for index_name in _INDEX_FILES:
+        index_path = os.path.join(model_path, index_name)
+        if os.path.exists(index_path):
+            with open(index_path, "r") as f:
+                shards = sorted(set(json.load(f)["weight_map"].values()))
+            return [os.path.join(model_path, shard) for shard in shards]
+    for name in _WEIGHT_FILES:
+        path = os.path.join(model_path, name)
+        if os.path.exists(path):
+            return [path]
+    return []
+
+
+def mmap_safetensors(path: str) -> Dict[str, torch.Tensor]:
+    """零拷贝地映射 safetensors 文件：每个 tensor 都是同一块只读（copy-on-write）mmap 上的视图。"""
+    with open(path, "rb") as f:
+        header_size = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_size))
+    header.pop("__metadata__", None)
+    data_start = 8 + header_size
+    storage = torch.UntypedStorage.from_file(path, shared=False, nbytes=os.path.getsize(path))
+    buffer = torch.empty(0, dtype=torch.uint8).set_(storage)
+
+    tensors = {}
+    for name, info in header.items():
+        dtype = _SAFETENSORS_DTYPES[info["dtype"]]
+        begin, end = info["data_offsets"]
+        raw = buffer[data_start + begin:data_start + end]
+        itemsize = torch.empty(0, dtype=dtype).element_size()
+        if raw.storage_offset() % itemsize:
+            # 未按元素大小对齐的 tensor（少见）只能复制一份
+            raw = raw.clone()
+        tensors[name] = raw.view(dtype).view(info["shape"])
+    return tensors
+
+
+def mmap_state_dict(paths: List[str]) -> Dict[str, torch.Tensor]:
+    state_dict = {}
+    for path in paths:
+        if path.endswith(".safetensors"):
+            state_dict.update(mmap_safetensors(path))
+        else:
+            state_dict.update(torch.load(path, map_location="cpu", mmap=True, weights_only=True))
+    return state_dict
+
+
+def _meta_tensors(module: torch.nn.Module) -> List[str]:
+    return [name for name, tensor in list(module.named_parameters()) + list(module.named_buffers()) if tensor.is_meta]
+
+
+def assign_state_dict(module: torch.nn.Module, state_dict: Dict[str, torch.Tensor],
+                      prefix: Optional[str] = None) -> List[str]:
+    """
+    把 state_dict 中的 tensor 直接作为 module 的参数（assign=True，不复制）。
+    prefix: 权重中多出的前缀（如 HF 带 head 的 checkpoint 加载到 base model 时的 base_model_prefix）
+
+    Returns:
+        加载后仍在 meta device 上的参数 / buffer 名（为空表示完整加载）
+    """
+    if prefix and not any(key.startswith(prefix + ".") for key in module.state_dict()):
+        stripped = {key[len(prefix) + 1:]: value for key, value in state_dict.items() if key.startswith(prefix + ".")}
+        if stripped:
+            state_dict = stripped
+    module.load_state_dict(state_dict, strict=False, assign=True)
+    if hasattr(module, "tie_weights"):
+        module.tie_weights()
+    return _meta_tensors(module)
+
+
+@contextmanager
+def _parameters_on_meta():
+    # 只把参数放到 meta device；buffer（如 HF 模型在 __init__ 中算出的非持久 position_ids）照常构建，
+    # 它们不在权重文件里，放到 meta 上之后就无法恢复
+    register_parameter = torch.nn.Module.register_parameter
+
+    def register_on_meta(module, name, param):
+        register_parameter(module, name, param)
+        if param is not None:
+            module._parameters[name] = torch.nn.Parameter(param.to("meta"), requires_grad=param.requires_grad)
+
+    torch.nn.Module.register_parameter = register_on_meta
+    try:
+        yield
+    finally:
+        torch.nn.Module.register_parameter = register_parameter
+
+
+def build_on_meta(factory: Callable[[], torch.nn.Module], include_buffers: bool = True) -> torch.nn.Module:
+    """
+    在 meta device 上构建模型：只有结构，没有参数内存，也不执行随机初始化。
+    include_buffers=False 时 buffer 仍在 CPU 上构建，用于带非持久 buffer 的模型。
+    """
+    with (torch.device("meta") if include_buffers else _parameters_on_meta()):
+        return factory()
+
+
+def load_pretrained(model_path: str, device: str = "cpu", low_memory: bool = True) -> torch.nn.Module:
+    """
+    加载 HF 格式的模型目录。low_memory 时走 meta 构建 + mmap 权重 + assign；
+    模型中有权重文件不包含的 tensor（如 __init__ 中计算出的非持久 buffer）时退回 from_pretrained。
+    """
+    from transformers import AutoConfig, AutoModel
+
+    weight_files = find_weight_files(model_path) if low_memory else []
+    if weight_files:
+        start = time.perf_counter()
+        config = AutoConfig.from_pretrained(model_path, trust_remote_code=True)
+        model = build_on_meta(lambda: AutoModel.from_config(config, trust_remote_code=True), include_buffers=False)
+        missing = assign_state_dict(model, mmap_state_dict(weight_files), getattr(model, "base_model_prefix", None))
+        if not missing:
+            logger.info(f"Loaded {model_path} from {len(weight_files)} memory-mapped weight file(s) "
+                        f"in {time.perf_counter() - start:.2f}s")
+            return model.to(device).eval()
+        logger.info(f"{len(missing)} tensors of {model_path} are not in its weight files "
+                    f"(e.g. {missing[0]}), falling back to from_pretrained")
+
+    # transformers 4.x 中 low_cpu_mem_usage 避免先随机初始化一份完整权重；5.x 中已是默认行为
+    return AutoModel.from_pretrained(model_path, trust_remote_code=True, low_cpu_mem_usage=True).to(device).eval()
+
+
+# ---------------------------------------------------------------- benchmark
+def _memory_stats() -> Dict[str, float]:
+    """当前进程的 RSS / PSS / 私有内存（MB），来自 /proc/self/smaps_rollup。"""
+    stats = {}
+    with open("/proc/self/smaps_rollup", "r") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[1].isdigit():
+                stats[parts[0].rstrip(":")] = int(parts[1]) / 1024
+    return {"rss": stats.get("Rss", 0.0), "pss": stats.get("Pss", 0.0),
+            "private": stats.get("Private_Clean", 0.0) + stats.get("Private_Dirty", 0.0)}
+
+
+def _benchmark_model(dim: int, depth: int) -> torch.nn.Module:
+    # ViT 编码器规模的随机初始化模型（ViT-L: dim=1024, depth=24）
+    layer = torch.nn.TransformerEncoderLayer(dim, nhead=max(1, dim // 64), dim_feedforward=4 * dim, batch_first=True)
+    return torch.nn.TransformerEncoder(layer, depth, enable_nested_tensor=False)
+
+
+def _benchmark_worker(mode: str, path: str, dim: int, depth: int, barrier, queue):
+    torch.set_num_threads(1)
+    baseline = _memory_stats()
+    start = time.perf_counter()
+    if mode == "eager":
+        # 传统路径：先在 CPU 上随机初始化完整模型，再把读入内存的权重复制进去
+        from safetensors.torch import load_file
+        model = _benchmark_model(dim, depth)
+        model.load_state_dict(load_file(path))
+    else:
+        model = build_on_meta(lambda: _benchmark_model(dim, depth))
+        missing = assign_state_dict(model, mmap_state_dict([path]))
+        assert not missing, missing
+    model.eval()
+    load_seconds = time.perf_counter() - start
+    with torch.inference_mode():
+        model(torch.randn(1, 16, dim))  # 前向一次，触及所有权重页
+    stats = _memory_stats()
+    queue.put({"load_seconds": load_seconds, **{k: stats[k] - baseline[k] for k in stats}})
+    barrier.wait()  # 所有 worker 都加载完后再退出，保证测量时各进程同时驻留
+
+
+def benchmark(num_workers: int = 4, dim: int = 1024, depth: int = 24):
+    """在 num_workers 个进程中分别用 eager / mmap 方式加载同一份权重，报告加载时间与每个进程新增的内存。"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        from safetensors.torch import save_file
+        path = os.path.join(tmp_dir, "model.safetensors")
+        save_file({k: v.contiguous() for k, v in _benchmark_model(dim, depth).state_dict().items()}, path)
+        size_mb = os.path.getsize(path) / 1024 ** 2
+        logger.info(f"Benchmark model: dim={dim}, depth={depth}, {size_mb:.0f} MB of weights, {num_workers} workers")
+
+        ctx = mp.get_context("spawn")
+        for mode in ("eager", "mmap"):
+            barrier, queue = ctx.Barrier(num_workers), ctx.Queue()
+            workers = [ctx.Process(target=_benchmark_worker, args=(mode, path, dim, depth, barrier, queue))
+                       for _ in range(num_workers)]
+            for worker in workers:
+                worker.start()
+            results = [queue.get() for _ in workers]
+            for worker in workers:
+                worker.join()
+            mean = {key: sum(r[key] for r in results) / len(results) for key in results[0]}
+            logger.info(f"{mode:>5}: load {mean['load_seconds']:.2f}s/process, per process +{mean['rss']:.0f} MB RSS, "
+                        f"+{mean['pss']:.0f} MB PSS, +{mean['private']:.0f} MB private; "
+                        f"total private over {num_workers} workers ~{mean['private'] * num_workers:.0f} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare eager vs memory-mapped weight loading across worker processes")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--depth", type=int, default=24)
+    args = parser.parse_args()
+    benchmark(args.workers, args.dim, args.depth)
@@ -1,5 +1,24 @@
-from .camelyon16 import Camelyon16
-from .tcga import TCGA_BRCA
-from .custom_data import CustomDataset
+from core.registry import DATASETS, import_target
 
-__all__ = ["Camelyon16", "TCGA_BRCA", "CustomDataset"]
\ No newline at end of file
+_CLASSES = {
+    "Camelyon16": "datasets.camelyon16:Camelyon16",
+    "TCGA_BRCA": "datasets.tcga:TCGA_BRCA",
+    "CustomDataset": "datasets.custom_data:CustomDataset",
+    "SimpleDataset": "datasets.simple_dataset:SimpleDataset",
+    "SyntheticDataset": "datasets.synthetic:SyntheticDataset",
+}
+# 配置中的数据集名 -> 实现，第一次用到时才 import
+DATASETS.register("TCGA_BRCA", _CLASSES["TCGA_BRCA"])
+DATASETS.register("CAMELYON16", _CLASSES["Camelyon16"])
+DATASETS.register("CUSTOM_DATASET", _CLASSES["CustomDataset"])
+DATASETS.register("SimpleDataset", _CLASSES["SimpleDataset"])
+DATASETS.register("SYNTHETIC", _CLASSES["SyntheticDataset"])
+
+__all__ = list(_CLASSES)
+
+
+def __getattr__(name):
+    # 兼容 `from datasets import TCGA_BRCA`：访问时才导入
+    if name in _CLASSES:
+        return import_target(_CLASSES[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
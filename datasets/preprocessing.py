@@ -0,0 +1,210 @@
+import os
+import time
+import threading
+import multiprocessing as mp
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+import numpy as np
+import torch
+from utils.logger import default_logger as logger
+from .tiler import SEGMENTERS, Tiler
+
+# 缺失特征的按需提取：segmentation -> tiling -> patch encoding -> 写回 preprocessed/
+# 使用 models.yaml 中每个模型的 segmenter / mag / patch_size / overlap / patch_encoder 配置
+
+DEFAULT_SETTINGS = {
+    "segmenter": "otsu",
+    "mag": 20,
+    "patch_size": 224,
+    "overlap": 0,
+    "patch_encoder": "virchow",
+    "device": "cpu",
+    "min_tissue_ratio": 0.25,  # tile 内组织占比低于该值时丢弃
+    "thumbnail_size": 2048,  # 组织分割所用缩略图的最长边
+    "encode_batch_size": 64,
+    "tile_workers": 2,  # 每张 slide 读取 region 的进程数
+}
+
+
+# ---------------------------------------------------------------- patch encoders
+def _load_timm_encoder(hub_id: str, **kwargs):
+    import timm
+    from timm.data import resolve_data_config
+    from timm.data.transforms_factory import create_transform
+    model = timm.create_model(hub_id, pretrained=True, **kwargs).eval()
+    transform = create_transform(**resolve_data_config(model.pretrained_cfg, model=model))
+    return model, transform
+
+
+def _virchow():
+    from timm.layers import SwiGLUPacked
+    model, transform = _load_timm_encoder("hf-hub:paige-ai/Virchow", mlp_layer=SwiGLUPacked, act_layer=torch.nn.SiLU)
+
+    def embed(images):
+        tokens = model(images)
+        # class token 与 patch token 均值拼接，共 2560 维（PRISM 使用的 tile 表征）
+        return torch.cat([tokens[:, 0], tokens[:, 1:].mean(1)], dim=-1)
+    return model, transform, embed
+
+
+def _uni():
+    model, transform = _load_timm_encoder("hf-hub:MahmoodLab/uni", init_values=1e-5, dynamic_img_size=True)
+    return model, transform, model
+
+
+PATCH_ENCODERS: Dict[str, Callable[[], Tuple[Any, Callable, Callable]]] = {
+    "virchow": _virchow,
+    "uni_v1": _uni,
+}
+
+# 每个 worker 进程只加载一次 patch encoder
+_worker_encoders = {}
+
+
+def _get_encoder(name: str, device: str):
+    if (name, device) not in _worker_encoders:
+        if name not in PATCH_ENCODERS:
+            raise ValueError(f"Unknown patch encoder '{name}', available: {list(PATCH_ENCODERS)}")
+        model, transform, embed = PATCH_ENCODERS[name]()
+        model.to(device)
+        _worker_encoders[(name, device)] = (transform, embed)
+    return _worker_encoders[(name, device)]
+
+
+@torch.inference_mode()
+def encode_tiles(tiles: np.ndarray, patch_encoder: str, device: str) -> torch.Tensor:
+    from PIL import Image
+    transform, embed = _get_encoder(patch_encoder, device)
+    images = torch.stack([transform(Image.fromarray(tile)) for tile in tiles]).to(device)
+    return embed(images).float().cpu()
+
+
+# ---------------------------------------------------------------- pipeline
+# 每个 worker 进程复用一个 Tiler（及其 region 读取进程池）
+_worker_tilers = {}
+
+
+def _get_tiler(settings: Dict[str, Any]) -> Tiler:
+    key = tuple(sorted(settings.items()))
+    if key not in _worker_tilers:
+        _worker_tilers[key] = Tiler(mag=settings["mag"], patch_size=settings["patch_size"],
+                                    overlap=settings["overlap"], segmenter=settings["segmenter"],
+                                    min_tissue_ratio=settings["min_tissue_ratio"],
+                                    thumbnail_size=settings["thumbnail_size"], num_workers=settings["tile_workers"])
+    return _worker_tilers[key]
+
+
+def extract_slide_features(slide_path: str, settings: Dict[str, Any]) -> Dict[str, torch.Tensor]:
+    """segmentation -> tiling -> patch encoding，返回 {"embeddings": [n, d], "coords": [n, 2]}。"""
+    tiler = _get_tiler(settings)
+    all_coords, embeddings = [], []
+    # tile 由 tiler 的 worker 进程并行读取，经有界队列流式送入 encoder
+    for coords, tiles in tiler.iter_batches(slide_path, settings["encode_batch_size"]):
+        all_coords.append(coords)
+        embeddings.append(encode_tiles(tiles, settings["patch_encoder"], settings["device"]))
+    if not embeddings:
+        return {"embeddings": torch.empty(0, 0), "coords": torch.empty(0, 2, dtype=torch.long)}
+    return {"embeddings": torch.cat(embeddings), "coords": torch.from_numpy(np.concatenate(all_coords))}
+
+
+def _extract_to_file(slide_path: str, feature_path: str, settings: Dict[str, Any], lock_timeout: float) -> str:
+    """
+    worker 进程入口：跨进程用 lock 文件去重，同一张 slide 只提取一次，结果原子写入 feature_path。
+    持有者在提取期间定期更新 lock 文件的 mtime（心跳），超过 lock_timeout 没有心跳的锁才视为持有者已崩溃。
+    """
+    os.makedirs(os.path.dirname(feature_path), exist_ok=True)
+    lock_path = feature_path + ".lock"
+    while True:
+        if os.path.exists(feature_path):
+            return feature_path
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            os.close(fd)
+            break
+        except FileExistsError:
+            # 其他进程正在提取同一张 slide；锁在这期间可能已被释放（对方提取完成），重新检查
+            try:
+                if time.time() - os.path.getmtime(lock_path) > lock_timeout:
+                    os.remove(lock_path)
+                    continue
+            except FileNotFoundError:
+                continue
+            time.sleep(1.0)
+
+    stop = threading.Event()
+    heartbeat = threading.Thread(target=_touch_lock, args=(lock_path, max(lock_timeout / 4, 1.0), stop), daemon=True)
+    heartbeat.start()
+    try:
+        features = extract_slide_features(slide_path, settings)
+        tmp_path = f"{feature_path}.tmp-{os.getpid()}"
+        torch.save(features, tmp_path)
+        os.replace(tmp_path, feature_path)
+    finally:
+        stop.set()
+        heartbeat.join()
+        try:
+            os.remove(lock_path)
+        except FileNotFoundError:
+            pass
+    return feature_path
+
+
+def _touch_lock(lock_path: str, interval: float, stop: threading.Event):
+    while not stop.wait(interval):
+        try:
+            os.utime(lock_path)
+        except FileNotFoundError:
+            return
+
+
+class FeatureExtractor:
+    """
+    按需特征提取：slide 的预处理特征缺失时，在 CPU worker 进程池中提取并写回 preprocessed/。
+    同一张 slide 的并发请求（本进程内的多个线程，或多个进程）只会触发一次提取。
+
+    Args:
+        model_config: models.yaml 中对应模型的配置（segmenter / mag / patch_size / overlap / patch_encoder / device）
+        num_workers: 提取进程数
+        lock_timeout: 锁文件超过该秒数未释放则视为持有者已崩溃
+    """
+
+    def __init__(self, model_config: Optional[Dict[str, Any]] = None, num_workers: int = 2, lock_timeout: float = 3600):
+        model_config = model_config or {}
+        self.settings = {key: model_config.get(key, default) for key, default in DEFAULT_SETTINGS.items()}
+        if self.settings["segmenter"] not in SEGMENTERS:
+            logger.warning(f"Segmenter '{self.settings['segmenter']}' is not built in (available: {list(SEGMENTERS)}); "
+                           f"slides with missing features will fail to extract")
+        self.num_workers = num_workers
+        self.lock_timeout = lock_timeout
+        self._pool = None
+        self._pending: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn：worker 中可能初始化 CUDA，不能 fork
+            self._pool = ProcessPoolExecutor(max_workers=self.num_workers, mp_context=mp.get_context("spawn"))
+        return self._pool
+
+    def submit(self, slide_path: str, feature_path: str) -> Future:
+        with self._lock:
+            future = self._pending.get(feature_path)
+            if future is None:
+                logger.info(f"Features missing for {os.path.basename(slide_path)}, extracting on demand")
+                future = self._get_pool().submit(_extract_to_file, slide_path, feature_path, self.settings,
+                                                 self.lock_timeout)
+                self._pending[feature_path] = future
+                future.add_done_callback(lambda _, key=feature_path: self._forget(key))
+            return future
+
+    def _forget(self, feature_path: str):
+        with self._lock:
+            self._pending.pop(feature_path, None)
+
+    def extract(self, slide_path: str, feature_path: str) -> str:
+        return self.submit(slide_path, feature_path).result()
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
@@ -0,0 +1,55 @@
+import os
+from core.base_dataset import BaseDataset
+
+
+# 占位用的内存数据集（3 张 slide，固定的特征与三类标签），真实数据集接入前用于跑通整条流程
+class SimpleDataset(BaseDataset):
+    def __init__(self, data_root: str, **kwargs):
+        super().__init__(data_root, **kwargs)
+
+        self.slides = ["slide1.svs", "slide2.svs", "slide3.svs"]
+        self.dataset_name = "SimpleDataset"
+        self.method = "dummy_method"
+
+        self.label_classification = {
+            "slide1.svs": 0,
+            "slide2.svs": 1,
+            "slide3.svs": 0
+        }
+        self.label_report_generation = {
+            "slide1.svs": "Benign tissue identified.",
+            "slide2.svs": "Inflammatory changes present.",
+            "slide3.svs": "Benign tissue identified."
+        }
+        self.label_survival_prediction = {
+            "slide1.svs": (10, 1),
+            "slide2.svs": (20, 0),
+            "slide3.svs": (30, 1)
+        }
+
+    def __len__(self):
+        return len(self.slides)
+
+    def __getitem__(self, idx):
+        if idx < 0 or idx >= len(self.slides):
+            raise IndexError("Index out of range")
+        slide_name = self.slides[idx]
+        slide = os.path.join(self.slide_base_dir, slide_name)
+        feature = [float(idx+1), float(idx+2), float(idx+3)]
+        embedding = feature
+
+        classification_label = self.label_classification[slide_name]
+        report_generation_label = self.label_report_generation[slide_name]
+        survival_prediction_label = self.label_survival_prediction[slide_name]
+
+        slide_info = {
+            "slide_name": slide_name,
+            "slide_path": slide,
+            "classification_label": classification_label,
+            "report_generation_label": report_generation_label,
+            "survival_prediction_label": survival_prediction_label
+        }
+        return {
+            "embedding": embedding,
+            "slide_info": slide_info
+        }
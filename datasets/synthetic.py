@@ -0,0 +1,173 @@
+import os
+import csv
+import json
+import time
+import argparse
+from typing import Any, Dict, Optional
+import numpy as np
+from core.base_dataset import BaseDataset, LabelStore
+from core.feature_store import FeatureStore, FeatureStoreWriter
+from utils.logger import default_logger as logger
+
+# 合成的规模测试数据集（python -m datasets.synthetic <data_root> --slides 100000 生成），目录结构与真实数据集相同：
+#   <data_root>/preprocessed/Synthetic/<method>/store/     打包特征库（core/feature_store.py），含 tile 坐标
+#   <data_root>/preprocessed/Synthetic/<method>/synthetic.json   生成参数与统计
+#   <data_root>/label/Synthetic/{classification,survival_prediction,report_generation}.csv
+# 不生成原始 slide 文件，slide 列表取自特征库。
+DATASET_NAME = "Synthetic"
+REPORT_TEMPLATES = [
+    "Benign tissue identified. No evidence of malignancy.",
+    "Invasive ductal carcinoma, grade 2. Lymphovascular invasion present.",
+    "Invasive lobular carcinoma with extensive in situ component.",
+    "Metastatic carcinoma identified in lymph node tissue.",
+]
+
+
+def tile_count_distribution(num_slides: int, median: int, sigma: float, min_tiles: int, max_tiles: int,
+                            rng: np.random.Generator) -> np.ndarray:
+    # 每张 slide 的 tile 数近似对数正态：大多数 slide 几千个 tile，少数整张切片达到 10 万以上
+    counts = np.exp(rng.normal(np.log(median), sigma, size=num_slides))
+    return np.clip(counts.round(), min_tiles, max_tiles).astype(np.int64)
+
+
+def _slide_features(n_tiles: int, dim: int, label: int, centers: np.ndarray, dtype: np.dtype,
+                    rng: np.random.Generator):
+    # 噪声 + 部分“病灶” tile 上叠加类别方向，使分类 / 生存标签与特征相关；坐标为组织区域内的光栅网格
+    features = rng.standard_normal((n_tiles, dim), dtype=np.float32)
+    lesion = rng.random(n_tiles) < rng.uniform(0.05, 0.4)
+    features[lesion] += centers[label]
+    side = int(np.ceil(np.sqrt(n_tiles)))
+    index = np.arange(n_tiles)
+    coords = np.stack([index % side, index // side], axis=1).astype(np.int32) * 224
+    return features.astype(dtype), coords
+
+
+def generate_synthetic_dataset(data_root: str, num_slides: int = 200, dim: int = 768, tiles_median: int = 2000,
+                               tiles_sigma: float = 0.8, min_tiles: int = 64, max_tiles: int = 150000,
+                               num_classes: int = 2, method: str = "SyntheticModel", dtype: str = "float16",
+                               shard_size_gb: float = 4.0, seed: int = 0, overwrite: bool = False) -> Dict[str, Any]:
+    """
+    生成 num_slides 张 slide 的特征与标签。已存在参数相同的数据集时直接返回其统计（overwrite 强制重新生成）。
+
+    Returns:
+        生成参数与统计（slide 数、tile 数分位数、特征字节数、耗时），同时写入 synthetic.json
+    """
+    params = {"num_slides": num_slides, "dim": dim, "tiles_median": tiles_median, "tiles_sigma": tiles_sigma,
+              "min_tiles": min_tiles, "max_tiles": max_tiles, "num_classes": num_classes, "dtype": dtype,
+              "seed": seed}
+    feature_dir = os.path.join(data_root, "preprocessed", DATASET_NAME, method)
+    meta_path = os.path.join(feature_dir, "synthetic.json")
+    if not overwrite and os.path.exists(meta_path):
+        with open(meta_path, "r") as f:
+            meta = json.load(f)
+        if meta.get("params") == params:
+            logger.info(f"Synthetic dataset with the same parameters already exists at {data_root}")
+            return meta
+
+    start = time.perf_counter()
+    rng = np.random.default_rng(seed)
+    tile_counts = tile_count_distribution(num_slides, tiles_median, tiles_sigma, min_tiles, max_tiles, rng)
+    feature_bytes = int(tile_counts.sum()) * dim * np.dtype(dtype).itemsize
+    logger.info(f"Generating {num_slides} synthetic slides, {int(tile_counts.sum())} tiles "
+                f"({feature_bytes / 1024 ** 3:.2f} GB of features) at {data_root}")
+    labels = rng.integers(0, num_classes, size=num_slides)
+    centers = rng.standard_normal((num_classes, dim)).astype(np.float32) * 0.5
+    # 生存时间：类别越高风险越大（指数分布），约 60% 观察到事件
+    survival_time = rng.exponential(60.0 / (1.0 + labels), size=num_slides).round(1) + 0.1
+    events = (rng.random(num_slides) < 0.6).astype(np.int64)
+    width = len(str(num_slides))
+    slide_names = [f"synthetic_{i:0{width}d}.svs" for i in range(num_slides)]
+
+    with FeatureStoreWriter(os.path.join(feature_dir, "store"), shard_size_gb=shard_size_gb) as writer:
+        for i, (name, n_tiles, label) in enumerate(zip(slide_names, tile_counts, labels)):
+            features, coords = _slide_features(int(n_tiles), dim, int(label), centers, np.dtype(dtype), rng)
+            writer.add(name, features, coords)
+            if (i + 1) % max(1, num_slides // 10) == 0:
+                logger.info(f"Generated {i + 1}/{num_slides} synthetic slides")
+
+    label_dir = os.path.join(data_root, "label", DATASET_NAME)
+    os.makedirs(label_dir, exist_ok=True)
+    tables = {
+        "classification": (["slide_name", "label"], zip(slide_names, labels)),
+        "survival_prediction": (["slide_name", "survival_time", "event"], zip(slide_names, survival_time, events)),
+        "report_generation": (["slide_name", "report"],
+                              ((name, REPORT_TEMPLATES[label % len(REPORT_TEMPLATES)])
+                               for name, label in zip(slide_names, labels))),
+    }
+    for label_type, (header, rows) in tables.items():
+        with open(os.path.join(label_dir, f"{label_type}.csv"), "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            writer.writerows(rows)
+
+    meta = {
+        "params": params,
+        "num_tiles": int(tile_counts.sum()),
+        "tiles_per_slide": {q: int(np.percentile(tile_counts, int(q[1:]))) for q in ("p5", "p50", "p95", "p100")},
+        "feature_bytes": feature_bytes,
+        "generation_seconds": time.perf_counter() - start,
+    }
+    with open(meta_path, "w") as f:
+        json.dump(meta, f, indent=4)
+    logger.info(f"Synthetic dataset: {num_slides} slides, {meta['num_tiles']} tiles "
+                f"({meta['feature_bytes'] / 1024 ** 3:.2f} GB) in {meta['generation_seconds']:.1f}s at {data_root}")
+    return meta
+
+
+class SyntheticDataset(BaseDataset):
+    """
+    读取 generate_synthetic_dataset 生成的数据集；记录每张 slide 特征读取的耗时（load_times），供规模测试统计。
+    """
+
+    def __init__(self, data_root: str, method: str = "SyntheticModel", **kwargs: Any):
+        super().__init__(data_root, **kwargs)
+        self.dataset_name = DATASET_NAME
+        self.method = method
+        store: Optional[FeatureStore] = self.feature_store
+        if store is None:
+            raise FileNotFoundError(f"No synthetic feature store under {self.feature_dir}; "
+                                    f"run `python -m datasets.synthetic {data_root}` first")
+        self.slides = list(store.slides)
+        self.labels = LabelStore(os.path.join(self.label_base_dir, self.dataset_name))
+        self.load_times = []
+
+    def __len__(self):
+        return len(self.slides)
+
+    def __getitem__(self, idx):
+        if idx < 0 or idx >= len(self.slides):
+            raise IndexError("Index out of range")
+        start = time.perf_counter()
+        slide_name = self.slides[idx]
+        embedding, feature = self.load_embedding(slide_name)
+        slide_info = {
+            "slide_name": slide_name,
+            "slide_path": os.path.join(self.slide_base_dir, self.dataset_name, slide_name),
+            "feature_path": feature,
+            **self.slide_labels(slide_name)
+        }
+        self.load_times.append(time.perf_counter() - start)
+        return {
+            "embedding": embedding,
+            "slide_info": slide_info
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic dataset in the BaseDataset directory layout")
+    parser.add_argument("data_root")
+    parser.add_argument("--slides", type=int, default=200)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--tiles_median", type=int, default=2000)
+    parser.add_argument("--tiles_sigma", type=float, default=0.8)
+    parser.add_argument("--min_tiles", type=int, default=64)
+    parser.add_argument("--max_tiles", type=int, default=150000)
+    parser.add_argument("--num_classes", type=int, default=2)
+    parser.add_argument("--method", default="SyntheticModel")
+    parser.add_argument("--dtype", default="float16")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--overwrite", action="store_true")
+    args = parser.parse_args()
+    generate_synthetic_dataset(args.data_root, args.slides, args.dim, args.tiles_median, args.tiles_sigma,
+                               args.min_tiles, args.max_tiles, args.num_classes, args.method, args.dtype,
+                               seed=args.seed, overwrite=args.overwrite)
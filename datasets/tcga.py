@@ -1,13 +1,47 @@
-from core.base_dataset import BaseDataset
+import os
+from typing import Any, List, Optional
+from core.base_dataset import BaseDataset, LabelStore
+
 
 class TCGA_BRCA(BaseDataset):
-    def __init__(self, data_root: str, **kwargs):
-        super().__init__(data_root=data_root, **kwargs)
-    
-    def load_data(self):
-        # 实现加载TCGA-BRCA数据集的逻辑
-        pass
-    
-    def __getitem__(self, index: int):
-        # 实现获取单个样本的逻辑
-        pass
\ No newline at end of file
+
+    def __init__(
+        self,
+        data_root: str,
+        method: str,
+        supported_tasks: Optional[List[str]] = None,
+        **kwargs: Any,
+    ):
+        super().__init__(data_root, **kwargs)
+        self.dataset_name = "TCGA_BRCA"
+        self.method = method
+        self.slide_dir = os.path.join(self.slide_base_dir, self.dataset_name)
+        self.slides = os.listdir(self.slide_dir)
+        if supported_tasks is not None:
+            self._supported_tasks = supported_tasks
+        # 数据集的所有标签类型（label/<dataset>/*.csv，以 slide_name 列为索引），按需加载
+        self.labels = LabelStore(os.path.join(self.label_base_dir, self.dataset_name))
+
+    def __len__(self):
+        return len(self.slides)
+
+    def __getitem__(self, idx):
+        if idx < 0 or idx >= len(self.slides):
+            raise IndexError("Index out of range")
+        slide_name = self.slides[idx]  # 包含文件后缀名-->文件格式
+        slide = os.path.join(self.slide_dir, slide_name)
+        embedding, feature = self.load_embedding(slide_name)
+        slide_info = {
+            "slide_name": slide_name,
+            "slide_path": slide,
+            "feature_path": feature,
+            **self.slide_labels(slide_name)
+        }
+        return {
+            "embedding": embedding,
+            "slide_info": slide_info
+        }
+
+
+if __name__ == "__main__":
+    TCGA_BRCA(data_root="/data/TCGA/BRCA/", method="PRISM")
\ No newline at end of file
@@ -0,0 +1,306 @@
+import os
+import time
+import argparse
+import tempfile
+import multiprocessing as mp
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterator, List, Tuple
+import numpy as np
+from utils.logger import default_logger as logger
+
+# 多进程 WSI 切 tile 引擎：
+# 缩略图上分割组织 -> 目标倍率下铺网格 -> 按空间块（block）分发给 worker 进程读取 region 并切出 tile
+# -> 通过有界的在途队列按序流式交给 patch encoder。任何时候都只有若干个 block 的目标倍率像素在内存中。
+
+
+# ---------------------------------------------------------------- slide reading
+def open_slide(slide_path: str):
+    import openslide
+    return openslide.OpenSlide(slide_path)
+
+
+def base_magnification(slide) -> float:
+    props = slide.properties
+    if props.get("openslide.objective-power"):
+        return float(props["openslide.objective-power"])
+    if props.get("openslide.mpp-x"):
+        # 约定 0.25 µm/px 对应 40x
+        return 10.0 / float(props["openslide.mpp-x"])
+    logger.warning("No magnification metadata found, assuming 40x")
+    return 40.0
+
+
+# ---------------------------------------------------------------- segmentation
+def otsu_tissue_mask(thumbnail: np.ndarray) -> np.ndarray:
+    """在 HSV 饱和度通道上做 Otsu 阈值分割，返回组织区域的 bool mask。"""
+    rgb = thumbnail[..., :3].astype(np.float32)
+    cmax, cmin = rgb.max(axis=-1), rgb.min(axis=-1)
+    saturation = np.where(cmax > 0, (cmax - cmin) / np.maximum(cmax, 1e-6), 0)
+    levels = (saturation * 255).astype(np.uint8)
+
+    hist = np.bincount(levels.ravel(), minlength=256).astype(np.float64)
+    p = hist / hist.sum()
+    omega = np.cumsum(p)
+    mu = np.cumsum(p * np.arange(256))
+    sigma_b = (mu[-1] * omega - mu) ** 2 / np.maximum(omega * (1 - omega), 1e-12)
+    threshold = int(np.argmax(sigma_b))
+    return levels > threshold
+
+
+SEGMENTERS: Dict[str, Callable[[np.ndarray], np.ndarray]] = {
+    "otsu": otsu_tissue_mask,
+}
+
+
+def segment_tissue(slide, segmenter: str, thumbnail_size: int) -> Tuple[np.ndarray, float]:
+    """Returns (tissue mask on the thumbnail, thumbnail pixels per level-0 pixel)."""
+    if segmenter not in SEGMENTERS:
+        # 不回退到其他分割方法：换用分割会改变 tile 集合，提取出的特征与该模型的预处理不一致
+        raise ValueError(f"Segmenter '{segmenter}' is not available for on-demand feature extraction "
+                         f"(available: {list(SEGMENTERS)}); pre-extract the features with '{segmenter}' "
+                         f"or change the model's segmenter in configs/models.yaml")
+    thumbnail = np.asarray(slide.get_thumbnail((thumbnail_size, thumbnail_size)).convert("RGB"))
+    scale = thumbnail.shape[1] / slide.dimensions[0]
+    return SEGMENTERS[segmenter](thumbnail), scale
+
+
+# ---------------------------------------------------------------- grid
+@dataclass
+class TileGrid:
+    coords: np.ndarray  # [n, 2] level-0 左上角坐标（行主序）
+    cells: np.ndarray  # [n, 2] 网格中的 (col, row)
+    level: int  # 读取所用的金字塔层级
+    level_downsample: float  # 该层级相对 level-0 的缩放
+    read_size: int  # 一个 tile 在该层级上的像素尺寸
+    patch_size: int  # 输出 tile 尺寸（目标倍率）
+
+
+def tile_grid(slide, mask: np.ndarray, scale: float, mag: float, patch_size: int, overlap: int,
+              min_tissue_ratio: float) -> TileGrid:
+    """在目标倍率下按 patch_size / overlap 铺网格，保留组织占比足够的 tile。"""
+    downsample = base_magnification(slide) / mag
+    level = slide.get_best_level_for_downsample(downsample)
+    level_downsample = slide.level_downsamples[level]
+    read_size = int(round(patch_size * downsample / level_downsample))
+    tile0 = int(round(patch_size * downsample))
+    step0 = int(round((patch_size - overlap) * downsample))
+    width, height = slide.dimensions
+
+    xs = np.arange(0, max(width - tile0, 0) + 1, step0)
+    ys = np.arange(0, max(height - tile0, 0) + 1, step0)
+    # 积分图上一次性算出每个候选 tile 的组织占比
+    integral = np.pad(mask.astype(np.float64).cumsum(0).cumsum(1), ((1, 0), (1, 0)))
+    x0 = np.clip((xs * scale).astype(int), 0, mask.shape[1])
+    x1 = np.clip(((xs + tile0) * scale).astype(int), 0, mask.shape[1])
+    y0 = np.clip((ys * scale).astype(int), 0, mask.shape[0])
+    y1 = np.clip(((ys + tile0) * scale).astype(int), 0, mask.shape[0])
+    area = np.maximum((y1 - y0)[:, None] * (x1 - x0)[None, :], 1)
+    tissue = (integral[y1][:, x1] - integral[y0][:, x1] - integral[y1][:, x0] + integral[y0][:, x0]) / area
+    rows, cols = np.nonzero(tissue >= min_tissue_ratio)
+    coords = np.stack([xs[cols], ys[rows]], axis=1).astype(np.int64)
+    cells = np.stack([cols, rows], axis=1).astype(np.int64)
+    return TileGrid(coords, cells, level, level_downsample, read_size, patch_size)
+
+
+# ---------------------------------------------------------------- worker side
+# 每个 worker 进程缓存少量已打开的 slide 句柄
+_worker_slides: "OrderedDict[str, object]" = OrderedDict()
+_MAX_OPEN_SLIDES = 2
+
+
+def _worker_slide(slide_path: str):
+    if slide_path not in _worker_slides:
+        _worker_slides[slide_path] = open_slide(slide_path)
+        while len(_worker_slides) > _MAX_OPEN_SLIDES:
+            _worker_slides.popitem(last=False)[1].close()
+    _worker_slides.move_to_end(slide_path)
+    return _worker_slides[slide_path]
+
+
+def read_block(slide_path: str, coords: np.ndarray, level: int, level_downsample: float, read_size: int,
+               patch_size: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    读取覆盖一组相邻 tile 的 region（一次 read_region），在内存中切出各个 tile。
+    Returns:
+        (coords [k, 2], tiles uint8 [k, patch_size, patch_size, 3])
+    """
+    from PIL import Image
+    slide = _worker_slide(slide_path)
+    origin = coords.min(axis=0)
+    offsets = np.round((coords - origin) / level_downsample).astype(np.int64)
+    region_w, region_h = offsets.max(axis=0) + read_size
+    region = np.asarray(slide.read_region((int(origin[0]), int(origin[1])), level,
+                                          (int(region_w), int(region_h))).convert("RGB"))
+    tiles = np.empty((len(coords), patch_size, patch_size, 3), dtype=np.uint8)
+    for i, (ox, oy) in enumerate(offsets):
+        tile = region[oy: oy + read_size, ox: ox + read_size]
+        if read_size != patch_size:
+            tile = np.asarray(Image.fromarray(tile).resize((patch_size, patch_size), Image.BILINEAR))
+        tiles[i] = tile
+    return coords, tiles
+
+
+# ---------------------------------------------------------------- engine
+class Tiler:
+    """
+    多进程 tile 引擎。
+
+    Args:
+        mag: 目标倍率
+        patch_size: 目标倍率下的 tile 尺寸
+        overlap: 相邻 tile 的重叠像素（目标倍率下）
+        segmenter: 组织分割方法
+        min_tissue_ratio: tile 内组织占比低于该值时丢弃
+        thumbnail_size: 组织分割所用缩略图的最长边
+        num_workers: 读取 region 的 worker 进程数，0 表示在当前进程读取
+        block_size: 每个读取任务覆盖 block_size x block_size 个网格单元
+        max_pending: 在途（已提交未消费）的 block 数上限，限制内存
+    """
+
+    def __init__(self, mag: float = 20, patch_size: int = 224, overlap: int = 0, segmenter: str = "otsu",
+                 min_tissue_ratio: float = 0.25, thumbnail_size: int = 2048, num_workers: int = 4,
+                 block_size: int = 8, max_pending: int = 16):
+        self.mag = mag
+        self.patch_size = patch_size
+        self.overlap = overlap
+        self.segmenter = segmenter
+        self.min_tissue_ratio = min_tissue_ratio
+        self.thumbnail_size = thumbnail_size
+        self.num_workers = num_workers
+        self.block_size = block_size
+        self.max_pending = max(max_pending, 1)
+        self._pool = None
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.num_workers, mp_context=mp.get_context("spawn"))
+        return self._pool
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def grid(self, slide_path: str) -> TileGrid:
+        slide = open_slide(slide_path)
+        try:
+            mask, scale = segment_tissue(slide, self.segmenter, self.thumbnail_size)
+            return tile_grid(slide, mask, scale, self.mag, self.patch_size, self.overlap, self.min_tissue_ratio)
+        finally:
+            slide.close()
+
+    def _blocks(self, grid: TileGrid) -> List[np.ndarray]:
+        # 按空间块分组（块内行主序），相邻 tile 共用一次 region 读取
+        block_ids = grid.cells // self.block_size
+        order = np.lexsort((grid.cells[:, 0], grid.cells[:, 1], block_ids[:, 0], block_ids[:, 1]))
+        block_ids = block_ids[order]
+        boundaries = np.nonzero(np.any(np.diff(block_ids, axis=0) != 0, axis=1))[0] + 1
+        return [grid.coords[index] for index in np.split(order, boundaries) if len(index)]
+
+    def iter_blocks(self, slide_path: str, grid: TileGrid = None) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """流式产出 (coords [k, 2], tiles uint8 [k, p, p, 3])，按块顺序。"""
+        grid = grid if grid is not None else self.grid(slide_path)
+        args = (grid.level, grid.level_downsample, grid.read_size, grid.patch_size)
+        blocks = self._blocks(grid)
+        if self.num_workers == 0:
+            for coords in blocks:
+                yield read_block(slide_path, coords, *args)
+            return
+
+        pool = self._get_pool()
+        pending = deque()
+        blocks = iter(blocks)
+        for coords in blocks:
+            pending.append(pool.submit(read_block, slide_path, coords, *args))
+            if len(pending) >= self.max_pending:
+                break
+        while pending:
+            result = pending.popleft().result()
+            coords = next(blocks, None)
+            if coords is not None:
+                pending.append(pool.submit(read_block, slide_path, coords, *args))
+            yield result
+
+    def iter_batches(self, slide_path: str, batch_size: int) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """把块重新组成固定大小的 batch，直接喂给 patch encoder。"""
+        coords_buffer, tiles_buffer, buffered = [], [], 0
+        for coords, tiles in self.iter_blocks(slide_path):
+            coords_buffer.append(coords)
+            tiles_buffer.append(tiles)
+            buffered += len(coords)
+            while buffered >= batch_size:
+                all_coords, all_tiles = np.concatenate(coords_buffer), np.concatenate(tiles_buffer)
+                yield all_coords[:batch_size], all_tiles[:batch_size]
+                coords_buffer, tiles_buffer = [all_coords[batch_size:]], [all_tiles[batch_size:]]
+                buffered -= batch_size
+        if buffered:
+            yield np.concatenate(coords_buffer), np.concatenate(tiles_buffer)
+
+
+# ---------------------------------------------------------------- synthetic slides
+def _synthetic_pixels(x: np.ndarray, y: np.ndarray, width: int, height: int, seed: int) -> np.ndarray:
+    # 程序化生成的“组织”：若干椭圆斑块 + 纹理，背景为接近白色
+    rng = np.random.default_rng(seed)
+    centers = rng.uniform(0.2, 0.8, (3, 2)) * (width, height)
+    radii = rng.uniform(0.1, 0.25, (3, 2)) * (width, height)
+    tissue = np.zeros(x.shape, dtype=bool)
+    for (cx, cy), (rx, ry) in zip(centers, radii):
+        tissue |= ((x - cx) / rx) ** 2 + ((y - cy) / ry) ** 2 < 1
+    texture = ((np.sin(x / 37.0) + np.cos(y / 23.0)) * 20).astype(np.int16)
+    pixels = np.empty(x.shape + (3,), dtype=np.uint8)
+    pixels[...] = 240
+    pixels[tissue] = np.stack([180 + texture[tissue], 80 + texture[tissue], 160 + texture[tissue]], axis=-1).clip(0, 255)
+    return pixels
+
+
+def write_synthetic_slide(path: str, width: int = 16384, height: int = 12288, levels: int = 4, mpp: float = 0.25,
+                          tile: int = 256, seed: int = 0) -> str:
+    """
+    生成一个 OpenSlide 可读的金字塔 TIFF（generic-tiff），逐 tile 流式写入，不在内存中构建整幅图像。
+    用于在本地测试切 tile 引擎。
+    """
+    import tifffile
+
+    def tiles(level: int):
+        downsample = 2 ** level
+        h, w = height // downsample, width // downsample
+        for ty in range(0, h, tile):
+            for tx in range(0, w, tile):
+                yy, xx = np.mgrid[ty: ty + tile, tx: tx + tile]
+                yield _synthetic_pixels(xx * downsample, yy * downsample, width, height, seed)
+
+    resolution = (1e4 / mpp, 1e4 / mpp)
+    with tifffile.TiffWriter(path, bigtiff=True) as tif:
+        for level in range(levels):
+            downsample = 2 ** level
+            shape = (height // downsample, width // downsample, 3)
+            tif.write(tiles(level), shape=shape, dtype=np.uint8, tile=(tile, tile), photometric="rgb",
+                      compression="zlib", resolution=(resolution[0] / downsample, resolution[1] / downsample),
+                      resolutionunit="CENTIMETER", subfiletype=0 if level == 0 else 1)
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tile a slide (or a generated synthetic slide) and report throughput")
+    parser.add_argument("--slide", default=None, help="slide path; a synthetic pyramidal TIFF is generated if omitted")
+    parser.add_argument("--mag", type=float, default=20)
+    parser.add_argument("--patch_size", type=int, default=224)
+    parser.add_argument("--overlap", type=int, default=0)
+    parser.add_argument("--num_workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    slide_path = args.slide or write_synthetic_slide(os.path.join(tempfile.mkdtemp(), "synthetic.tiff"))
+    with Tiler(mag=args.mag, patch_size=args.patch_size, overlap=args.overlap, num_workers=args.num_workers) as tiler:
+        start = time.perf_counter()
+        num_tiles = sum(len(coords) for coords, _ in tiler.iter_blocks(slide_path))
+        elapsed = time.perf_counter() - start
+    logger.info(f"{slide_path}: {num_tiles} tiles in {elapsed:.2f}s ({num_tiles / elapsed:.1f} tiles/sec, "
+                f"workers={args.num_workers})")
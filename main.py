@@ -1,178 +1,268 @@
+import os
 import yaml
 import json
-from models import CONCH, UNI, PRISM, TITAN
-from datasets import Camelyon16, TCGA_BRCA, CustomDataset
-from tasks import ClassificationTask, ReportGenerationTask, SurvivalPredictionTask
-from utils.visualizer import plot_bar
-from utils.metrics import acc, precision, recall, f1, auc, bleu, c_index, auc_survival
+import argparse
 from utils.logger import default_logger as logger
+from core.registry import MODELS, DATASETS, TASKS, METRICS
+from core.executor import GridExecutor
+from core.journal import run_fingerprint
+from core.base_model import weights_checksum, resolve_precision
+from core.results_db import ResultsIndex, new_run_id
+from core import tracing
 
 
-from core.base_dataset import BaseDataset
-import os
-class SimpleDataset(BaseDataset):
-    def __init__(self, data_root: str, **kwargs):
-        super().__init__(data_root, **kwargs)
-
-        self.slides = ["slide1.svs", "slide2.svs", "slide3.svs"]
-        self.dataset_name = "SimpleDataset"
-        self.method = "dummy_method"
-
-        self.label_classification = {
-            "slide1.svs": 0,
-            "slide2.svs": 1,
-            "slide3.svs": 0
-        }
-        self.label_report_generation = {
-            "slide1.svs": "Benign tissue identified.",
-            "slide2.svs": "Inflammatory changes present.",
-            "slide3.svs": "Benign tissue identified."
-        }
-        self.label_survival_prediction = {
-            "slide1.svs": (10, 1),
-            "slide2.svs": (20, 0),
-            "slide3.svs": (30, 1)
-        }
-
-    def __len__(self):
-        return len(self.slides)
-
-    def __getitem__(self, idx):
-        if idx < 0 or idx >= len(self.slides):
-            raise IndexError("Index out of range")
-        slide_name = self.slides[idx]
-        slide = os.path.join(self.slide_base_dir, slide_name)
-        feature = [float(idx+1), float(idx+2), float(idx+3)]
-        embedding = feature
-
-        classification_label = self.label_classification[slide_name]
-        report_generation_label = self.label_report_generation[slide_name]
-        survival_prediction_label = self.label_survival_prediction[slide_name]
-
-        slide_info = {
-            "slide_name": slide_name,
-            "slide_path": slide,
-            "classification_label": classification_label,
-            "report_generation_label": report_generation_label,
-            "survival_prediction_label": survival_prediction_label
-        }
-        return {
-            "embedding": embedding,
-            "slide_info": slide_info
-        }
-    
+# 模型 / 数据集 / 任务 / 指标按名字注册（见各包的 __init__ 与 utils/metrics.py），
+# 配置第一次引用某个名字时才 import 对应实现；第三方插件通过 entry point 注册（见 core/registry.py）
+
+
+@tracing.traced("model_load")
+def load_model(model_pool, model_name, model_configs):
+    model_config = model_configs.get(model_name)
+    model_class = MODELS.get(model_name)
+    return model_pool.get(model_class,
+                          model_name=model_name,
+                          model_path=model_config.get("model_path"),
+                          device=model_config.get("device"),
+                          precision=model_config.get("precision"),
+                          long_bag=model_config.get("long_bag"),
+                          generation=model_config.get("generation"))
+
+
+def load_dataset(dataset_name, dataset_configs, model_name, model_configs, runtime_configs):
+    dataset_config = dataset_configs.get(dataset_name) or {}
+    # [todo]
+    # from datasets.preprocessing import FeatureExtractor
+    # dataset_class = DATASETS.get(dataset_name)
+    # dataset = dataset_class(method=model_name, **dataset_config)
+    # # extract missing slide features on demand with the model's preprocessing settings
+    # dataset.enable_feature_extraction(
+    #     FeatureExtractor(model_configs.get(model_name), **runtime_configs.get('preprocess', {})))
+    # return dataset
+
+    # [todo]
+    return DATASETS.get("SimpleDataset")(data_root="dummy_path", prefetch=dataset_config.get("prefetch"))
+
+
+def build_task(task_name, task_config, slide_cache=None, bootstrap=None, results_index=None, auc_bins=None):
+    task_class = TASKS.get(task_name)
+    metric_fns = [METRICS.get(m) for m in task_config.get('metrics')]
+    # 任务特有的配置项（如生存任务的 time_column / event_column）
+    options = {key: task_config[key] for key in task_class.config_options if key in task_config}
+    # config.json 中任务自己的 auc_bins 优先于 runtime.yaml 的设置
+    return task_class(task_name=task_name, metrics=metric_fns, output_root=task_config.get('result_dir'),
+                      batch_size=task_config.get('batch_size', 1), slide_cache=slide_cache, bootstrap=bootstrap,
+                      results_index=results_index, auc_bins=task_config.get('auc_bins', auc_bins), **options)
+
+
+def figure_jobs(task_name, task_config, results_index=None):
+    from utils.visualizer import task_figure_jobs
+    # metrics.json / 结果索引中的键是指标函数名，不一定等于配置里名字的小写
+    metric_keys = {metric: METRICS.get(metric).__name__ for metric in task_config.get('metrics')}
+    return task_figure_jobs(task_name, models=task_config.get('models'),
+                            datasets=[d.get('name') for d in task_config.get('datasets')], metric_keys=metric_keys,
+                            result_dir=task_config.get('result_dir'), fig_dir=task_config.get('fig_dir'),
+                            results_index=results_index)
+
+
+# 进程内的运行时状态（模型池、slide 缓存）；并行执行时每个 worker 进程各持有一份，跨 job 复用
+_runtime = {}
+
+
+def get_runtime(runtime_configs):
+    if not _runtime:
+        from core.model_pool import ModelPool
+        from core.slide_cache import SlideEmbeddingCache
+        # keep loaded models resident across tasks and datasets
+        _runtime['model_pool'] = ModelPool(**runtime_configs.get('model_pool', {}))
+        # reuse slide representations across runs
+        cache_configs = dict(runtime_configs.get('slide_cache', {}))
+        _runtime['slide_cache'] = SlideEmbeddingCache(**cache_configs) if cache_configs.pop('enabled', False) else None
+        # 指标汇总到 SQLite 结果索引
+        index_configs = dict(runtime_configs.get('results_index') or {})
+        _runtime['results_index'] = ResultsIndex(**index_configs) if index_configs.pop('enabled', False) else None
+        # 各阶段计时（worker 进程中各自启用，trace 事件写到各自的分片）
+        tracing.configure(**runtime_configs.get('tracing', {}))
+    return _runtime['model_pool'], _runtime['slide_cache'], _runtime['results_index']
+
+
+def build_jobs(config, multi_task=False):
+    """
+    把 task × model × dataset 网格拆成相互独立的 job。
+    multi_task 时同一 (model, dataset) 的所有任务合并成一个 job，每张 slide 只编码一次。
+    """
+    jobs = {}
+    for task_name, task_config in config.items():
+        for model_name in task_config.get('models'):
+            for dataset_info in task_config.get('datasets'):
+                dataset_name = dataset_info.get('name')
+                key = (model_name, dataset_name) if multi_task else (task_name, model_name, dataset_name)
+                job = jobs.setdefault(key, {"name": "/".join(key), "model": model_name, "dataset": dataset_name,
+                                            "tasks": []})
+                job["tasks"].append((task_name, task_config, dataset_info.get("configs", {})))
+    return list(jobs.values())
+
+
+def job_fingerprint(task_name, task_config, test_configs, model_name, model_configs, dataset_name, dataset_configs,
+                    labels=None):
+    """
+    模型身份（配置 + 权重文件校验和）、任务/数据集配置与标签文件校验和（labels，见 LabelStore.checksum）的指纹；
+    不加载模型即可计算。
+    """
+    model_config = model_configs.get(model_name) or {}
+    # 预取设置只影响读取速度，不影响预测
+    dataset_config = {k: v for k, v in (dataset_configs.get(dataset_name) or {}).items() if k != 'prefetch'}
+    options = {key: task_config.get(key) for key in TASKS.get(task_name).config_options}
+    return run_fingerprint(task=task_name, metrics=task_config.get('metrics'), test_configs=test_configs,
+                           task_options=options,
+                           model=model_name, model_config=model_config,
+                           weights=weights_checksum(model_config.get('model_path')),
+                           precision=resolve_precision(model_config.get('precision'), model_config.get('device')),
+                           dataset=dataset_name, dataset_config=dataset_config, labels=labels)
+
+
+def run_job(job, model_configs, dataset_configs, runtime_configs):
+    """执行一个 job 并把结果写到 results/<task>/<model>/<dataset>/，返回 {task_name: metrics}。"""
+    from core.multi_task import evaluate_multi_task
+    model_pool, slide_cache, results_index = get_runtime(runtime_configs)
+    evaluation = runtime_configs.get('evaluation', {})
+    resume = evaluation.get('resume', False)
+    model_name, dataset_name = job["model"], job["dataset"]
+    logger.info(f"--- Model {model_name} - dataset {dataset_name}: tasks {[t[0] for t in job['tasks']]} ---")
+
+    dataset = load_dataset(dataset_name, dataset_configs, model_name, model_configs, runtime_configs)
+    task_runs, journals = [], []
+    for task_name, task_config, test_configs in job["tasks"]:
+        task = build_task(task_name, task_config, slide_cache, evaluation.get('bootstrap'), results_index,
+                          evaluation.get('auc_bins'))
+        journal = None
+        if resume:
+            fingerprint = job_fingerprint(task_name, task_config, test_configs, model_name, model_configs,
+                                          dataset_name, dataset_configs, dataset.label_checksum([task.label_type]))
+            journal = task.open_journal(model_name, dataset_name, fingerprint)
+            if task.is_complete(model_name, dataset_name, journal, dataset.slides):
+                logger.info(f"task {task_name} - model {model_name} - dataset {dataset_name} is up to date, skipped.")
+                journal.close()
+                continue
+            logger.info(f"task {task_name} - model {model_name} - dataset {dataset_name}: "
+                        f"{len(journal)}/{len(dataset)} slides already in journal")
+        task_runs.append((task, test_configs))
+        journals.append(journal)
+    if not task_runs:
+        return {}
+
+    summary = {}
+    with tracing.cell(model_name, dataset_name):
+        results = []
+        try:
+            model = load_model(model_pool, model_name, model_configs)
+            if len(task_runs) == 1:
+                task, test_configs = task_runs[0]
+                results = [task.evaluate(model, dataset, journal=journals[0], **test_configs)]
+            else:
+                results = evaluate_multi_task(model, dataset, task_runs, slide_cache, journals)
+
+            # 预测保存时才从日志读出，日志在保存之后关闭
+            for (task, _), journal, result in zip(task_runs, journals, results):
+                if result is None:
+                    continue
+                metric_results, predictions = result
+                task.save_results(model_name=model_name, dataset_name=dataset_name, metrics=metric_results,
+                                  predictions=predictions, fingerprint=None if journal is None else journal.fingerprint)
+                logger.info(f"task {task.task_name} - model {model_name} - dataset {dataset_name} finished.")
+                logger.info(f"result: {metric_results}")
+                summary[task.task_name] = metric_results
+        finally:
+            for journal in journals:
+                if journal is not None:
+                    journal.close()
+            # 临时日志（不续跑时）
+            for result in results:
+                if result is not None:
+                    result[1].journal.close()
+    return summary
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark WSI foundation models on a task x model x dataset grid")
+    parser.add_argument("--config", default="configs/config.json", help="task grid (tasks, models, datasets, metrics)")
+    parser.add_argument("--models", default="configs/models.yaml", help="per-model settings")
+    parser.add_argument("--datasets", default="configs/datasets.yaml", help="per-dataset settings")
+    parser.add_argument("--runtime", default="configs/runtime.yaml", help="runtime settings (executor, caches, ...)")
+    parser.add_argument("--plot-only", action="store_true",
+                        help="only re-render figures from stored results, no evaluation")
+    parser.add_argument("--list", action="store_true",
+                        help="list registered models, datasets, tasks and metrics (including plugins)")
+    return parser.parse_args(argv)
+
+
+def check_config(config, model_configs):
+    """在启动任何 job 之前检查配置引用的名字都已注册（只查注册表，不 import 实现），以及模型的 precision 设置。"""
+    for task_name, task_config in config.items():
+        unknown = ([f"task '{task_name}'"] if task_name not in TASKS else []) \
+            + [f"model '{m}'" for m in task_config.get('models') if m not in MODELS] \
+            + [f"metric '{m}'" for m in task_config.get('metrics') if m not in METRICS]
+        if unknown:
+            raise ValueError(f"Unknown {', '.join(unknown)} in config; run with --list to see what is registered")
+        for model_name in task_config.get('models'):
+            model_config = model_configs.get(model_name) or {}
+            resolve_precision(model_config.get('precision'), model_config.get('device'))
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.list:
+        for kind, registry in (("models", MODELS), ("datasets", DATASETS), ("tasks", TASKS), ("metrics", METRICS)):
+            print(f"{kind}: {', '.join(registry.names())}")
+        return
 
-def main():
     # load configurations
-    with open('configs/config.json', 'r') as f:
+    with open(args.config, 'r') as f:
         config = json.load(f)
-    
-    with open('configs/models.yaml', 'r') as f:
+
+    with open(args.models, 'r') as f:
         model_configs = yaml.safe_load(f)
+    check_config(config, model_configs)
     
-    with open('configs/datasets.yaml', 'r') as f:
+    with open(args.datasets, 'r') as f:
         dataset_configs = yaml.safe_load(f)
 
-    # task mapping dictionary
-    task_mapping = {
-        'Classification': ClassificationTask,
-        'ReportGeneration': ReportGenerationTask,
-        'SurvivalPrediction': SurvivalPredictionTask
-    }
-
-    # dataset mapping dictionary
-    dataset_mapping = {
-        'TCGA_BRCA': TCGA_BRCA,
-        'CAMELYON16': Camelyon16,
-        'CUSTOM_DATASET': CustomDataset
-    }
-
-    # model mapping dictionary
-    model_mapping = {
-        'UNI': UNI,
-        'PRISM': PRISM,
-        'TITAN': TITAN,
-        'CONCH': CONCH
-    }
-
-    # metrics mapping dictionary
-    metrics_mapping = {
-        'ACC': acc,
-        'Precision': precision,
-        'Recall': recall,
-        'F1': f1,
-        'AUC': auc,
-        'BLEU': bleu,
-        'c_index': c_index,
-        'AUC_Survival': auc_survival
-    }
-
-    # first layer loop: iterate over tasks
-    for task_name, task_config in config.items():
-        logger.info(f"=== Start processing tasks: {task_name} ===")
-        
-        # get current task's model list
-        task_models = task_config.get('models')
-        # get current task's dataset list
-        task_datasets = task_config.get('datasets')
-        # get current task's metric list
-        task_metrics = task_config.get('metrics')
-        # get current task's result directory
-        result_dir = task_config.get('result_dir')
-        # get current task's figure directory
-        fig_dir = task_config.get('fig_dir')
-
-        # second layer loop: iterate over current task's models
-        for model_name in task_models:
-            logger.info(f"--- Use the model: {model_name} ---")
-            model_config = model_configs.get(model_name)
-
-            # third layer loop: iterate over current task's datasets
-            for dataset_info in task_datasets:
-                dataset_name = dataset_info.get('name')
-                test_configs = dataset_info.get("configs", {})
-                logger.info(f"\nProcessing dataset: {dataset_name}")
-                
-                try:
-                    # initialize model
-                    model_class = model_mapping[model_name]
-                    model = model_class(model_path = model_config.get("model_path"), 
-                                        model_name = model_name, 
-                                        device = model_config.get("device"))
-                    
-                    # [todo]
-                    # # initialize dataset
-                    # dataset_class = dataset_mapping[dataset_name]
-                    # dataset = dataset_class(dataset_configs[dataset_name].get("root_dir"))
-                    
-                    # [todo]
-                    dataset = SimpleDataset(data_root="dummy_path")
-
-                    # initialize task
-                    task_class = task_mapping[task_name]
-                    metric_fns = [metrics_mapping[m] for m in task_metrics]
-                    task = task_class(task_name=task_name, metrics=metric_fns, output_root=result_dir)
-
-                    # execute evaluation
-                    metric_results, all_preds = task.evaluate(model, dataset, **test_configs)
-                    
-                    # save results
-                    task.save_results(model_name=model_name, dataset_name=dataset_name, metrics=metric_results, predictions=all_preds)
-
-                    # output results
-                    logger.info(f"task {task_name} - model {model_name} - dataset {dataset_name} finished.")
-                    logger.info(f"result: {metric_results}")
-
-                except Exception as e:
-                    logger.error(f"Erro: task {task_name} - model {model_name} - dataset {dataset_name} Execution failed: {str(e)}")
-                    continue
+    runtime_configs = {}
+    if os.path.exists(args.runtime):
+        with open(args.runtime, 'r') as f:
+            runtime_configs = yaml.safe_load(f) or {}
+
+    results_index = None
+    if (runtime_configs.get('results_index') or {}).get('enabled', False):
+        # 本次运行的所有 job（包括 worker 进程中的）使用同一个 run_id
+        runtime_configs['results_index'] = {**runtime_configs['results_index'], 'run_id': new_run_id()}
+        index_configs = {k: v for k, v in runtime_configs['results_index'].items() if k != 'enabled'}
+        results_index = ResultsIndex(**index_configs)
+        logger.info(f"Run id: {results_index.run_id}, results index: {results_index.path}")
+
+    tracing.configure(**runtime_configs.get('tracing', {}))
+    tracing.reset_chrome_trace()
+
+    if not args.plot_only:
+        multi_task = runtime_configs.get('evaluation', {}).get('multi_task', False)
+        jobs = build_jobs(config, multi_task)
+        executor = GridExecutor(**runtime_configs.get('executor', {}))
+        executor.run(jobs, run_job, model_configs, dataset_configs, runtime_configs)
+        if executor.failed:
+            logger.warning(f"{executor.failed}/{len(jobs)} jobs failed")
 
-        for metric in task_metrics:
-            plot_bar(models=task_models, datasets=[d.get('name') for d in task_datasets], 
-                    task_name=task_name, metric=metric, 
-                    result_dir=result_dir, fig_dir=fig_dir)
-        
+    # 所有任务的图一起交给绘图进程池，数据未变化的图跳过
+    from utils.visualizer import render_figures
+    jobs = [job for task_name, task_config in config.items() for job in figure_jobs(task_name, task_config, results_index)]
+    with tracing.span("plot"):
+        render_figures(jobs, **runtime_configs.get('figures', {}))
+    tracing.log_totals()
+    tracing.export_chrome_trace()
 
+    # 顺序执行时模型池与缓存就在主进程中
+    if _runtime:
+        _runtime['model_pool'].log_stats()
+        if _runtime['slide_cache'] is not None:
+            _runtime['slide_cache'].log_stats()
     logger.info("\n=== All tasks have been completed ===")
 
 
@@ -1,6 +1,21 @@
-from .conch import CONCH
-from .uni import UNI
-from .prism import PRISM
-from .titan import TITAN
+from core.registry import MODELS, import_target
 
-__all__ = ["CONCH", "UNI", "PRISM", "TITAN", ...]
\ No newline at end of file
+# 按名字登记，配置用到某个模型时才 import 对应模块（torch / transformers 随之加载）
+_CLASSES = {
+    "CONCH": "models.conch:CONCH",
+    "UNI": "models.uni:UNI",
+    "PRISM": "models.prism:PRISM",
+    "TITAN": "models.titan:TITAN",
+    "SyntheticModel": "models.synthetic:SyntheticModel",
+}
+for _name, _target in _CLASSES.items():
+    MODELS.register(_name, _target)
+
+__all__ = list(_CLASSES)
+
+
+def __getattr__(name):
+    # 兼容 `from models import UNI`：访问时才导入
+    if name in _CLASSES:
+        return import_target(_CLASSES[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
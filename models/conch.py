@@ -3,11 +3,16 @@ from transformers import AutoModel
 from core.base_model import BaseModel
 
 class CONCH(BaseModel):
-    def __init__(self, model_path, model_name="CONCH", device="cuda"):
+    def __init__(self, model_path, model_name="CONCH", device="cuda", low_memory=True, precision=None,
+                 long_bag=None, generation=None):
         super().__init__(
             model_path=model_path,
             device=device,
-            model_name=model_name
+            model_name=model_name,
+            low_memory=low_memory,
+            precision=precision,
+            long_bag=long_bag,
+            generation=generation
         )
 
     def classify(self, feature, num_classes):
@@ -21,7 +26,7 @@ class CONCH(BaseModel):
         # embedding_data = torch.load(feature)
         # tile_embeddings = embedding_data['embeddings'].unsqueeze(0).to(self.device)
 
-        # with torch.autocast(self.device, torch.float16), torch.inference_mode():
+        # with self.autocast(), torch.inference_mode():
         #     logits = self.model.classify(tile_embeddings)
         #     probs = torch.softmax(logits, dim=-1)
         #     pred_class = torch.argmax(probs, dim=-1).item()
@@ -43,7 +48,7 @@ class CONCH(BaseModel):
         # embedding_data = torch.load(feature)
         # tile_embeddings = embedding_data['embeddings'].unsqueeze(0).to(self.device)
 
-        # with torch.autocast(self.device, torch.float16), torch.inference_mode():
+        # with self.autocast(), torch.inference_mode():
         #     if hasattr(self.model, "survival_predict"):
         #         result = self.model.survival_predict(tile_embeddings, time_horizon)
         #     else:
@@ -53,5 +58,35 @@ class CONCH(BaseModel):
 
         # return {"risk_score": result}
 
+    def classify_batch(self, features, num_classes, mask=None):
+        return [self.classify(feature, num_classes) for feature in self.iter_bags(features, mask)]
+
+        # tile_embeddings = features.to(self.device)
+        # attention_mask = mask.to(self.device)
+
+        # with self.autocast(), torch.inference_mode():
+        #     logits = self.model.classify(tile_embeddings, attention_mask=attention_mask)
+        #     probs = torch.softmax(logits, dim=-1)
+        #     pred_classes = torch.argmax(probs, dim=-1)
+        # return [{"pred_class": c.item(), "probabilities": p.tolist()} for c, p in zip(pred_classes, probs)]
+
+    def survival_predict_batch(self, features, time_horizon=None, mask=None):
+        return [self.survival_predict(feature, time_horizon) for feature in self.iter_bags(features, mask)]
+
+        # tile_embeddings = features.to(self.device)
+        # attention_mask = mask.to(self.device)
+
+        # with self.autocast(), torch.inference_mode():
+        #     if hasattr(self.model, "survival_predict"):
+        #         risks = self.model.survival_predict(tile_embeddings, time_horizon, attention_mask=attention_mask)
+        #     else:
+        #         logits = self.model.classify(tile_embeddings, attention_mask=attention_mask)
+        #         probs = torch.softmax(logits, dim=-1)
+        #         risks = 1 - probs.max(dim=-1).values
+        # return [{"risk_score": r.item()} for r in risks]
+
     def report_generate(self, feature):
+        raise NotImplementedError("CONCH does not support report generation.")
+
+    def report_generate_batch(self, features, mask=None):
         raise NotImplementedError("CONCH does not support report generation.")
\ No newline at end of file
@@ -3,11 +3,18 @@ from transformers import AutoModel
 from core.base_model import BaseModel
 
 class PRISM(BaseModel):
-    def __init__(self, model_path, model_name="PRISM", device="cuda"):
+    has_slide_encoder = True
+
+    def __init__(self, model_path, model_name="PRISM", device="cuda", low_memory=True, precision=None,
+                 long_bag=None, generation=None):
         super().__init__(
             model_path=model_path,
             device=device,
-            model_name=model_name
+            model_name=model_name,
+            low_memory=low_memory,
+            precision=precision,
+            long_bag=long_bag,
+            generation=generation
         )
 
     def classify(self, feature, num_classes):
@@ -21,7 +28,7 @@ class PRISM(BaseModel):
         # embedding_data = torch.load(feature)
         # tile_embeddings = embedding_data['embeddings'].unsqueeze(0).to(self.device)
 
-        # with torch.autocast(self.device, torch.float16), torch.inference_mode():
+        # with self.autocast(), torch.inference_mode():
         #     logits = self.model.classify(tile_embeddings)
         #     probs = torch.softmax(logits, dim=-1)
         #     pred_class = torch.argmax(probs, dim=-1).item()
@@ -43,7 +50,7 @@ class PRISM(BaseModel):
         # embedding_data = torch.load(feature)
         # tile_embeddings = embedding_data['embeddings'].unsqueeze(0).to(self.device)
 
-        # with torch.autocast(self.device, torch.float16), torch.inference_mode():
+        # with self.autocast(), torch.inference_mode():
         #     if hasattr(self.model, "survival_predict"):
         #         result = self.model.survival_predict(tile_embeddings, time_horizon)
         #     else:
@@ -53,6 +60,88 @@ class PRISM(BaseModel):
 
         # return {"risk_score": result}
 
+    def classify_batch(self, features, num_classes, mask=None):
+        return [self.classify(feature, num_classes) for feature in self.iter_bags(features, mask)]
+
+        # tile_embeddings = features.to(self.device)
+        # attention_mask = mask.to(self.device)
+
+        # with self.autocast(), torch.inference_mode():
+        #     logits = self.model.classify(tile_embeddings, attention_mask=attention_mask)
+        #     probs = torch.softmax(logits, dim=-1)
+        #     pred_classes = torch.argmax(probs, dim=-1)
+        # return [{"pred_class": c.item(), "probabilities": p.tolist()} for c, p in zip(pred_classes, probs)]
+
+    def survival_predict_batch(self, features, time_horizon=None, mask=None):
+        return [self.survival_predict(feature, time_horizon) for feature in self.iter_bags(features, mask)]
+
+        # tile_embeddings = features.to(self.device)
+        # attention_mask = mask.to(self.device)
+
+        # with self.autocast(), torch.inference_mode():
+        #     if hasattr(self.model, "survival_predict"):
+        #         risks = self.model.survival_predict(tile_embeddings, time_horizon, attention_mask=attention_mask)
+        #     else:
+        #         logits = self.model.classify(tile_embeddings, attention_mask=attention_mask)
+        #         probs = torch.softmax(logits, dim=-1)
+        #         risks = 1 - probs.max(dim=-1).values
+        # return [{"risk_score": r.item()} for r in risks]
+
+    def encode_batch(self, features, mask=None):
+        return list(self.iter_bags(features, mask))
+
+        # if self.use_chunked_encoding():
+        #     # long_bag chunked: tile 编码逐块进行，注意力池化用 streaming softmax 合并，峰值内存只取决于 chunk_size；
+        #     # 只产生 image_embedding（分类 / 生存 head），报告生成需要的 image_latents 仍需整包编码
+        #     return [{"image_embedding": self.pool_long_bag(bag.to(self.device))}
+        #             for bag in self.iter_bags(features, mask)]
+
+        # tile_embeddings = features.to(self.device)
+        # attention_mask = mask.to(self.device)
+
+        # with self.autocast(), torch.inference_mode():
+        #     reprs = self.model.slide_representations(tile_embeddings, attention_mask=attention_mask)
+        # # one latent dict per slide, so it can be cached and shared by the heads
+        # return [{key: value[i] for key, value in reprs.items()} for i in range(tile_embeddings.shape[0])]
+
+    # def encode_chunk(self, chunk):
+    #     with self.autocast(), torch.inference_mode():
+    #         values, logits = self.model.encode_tiles(chunk[None].to(self.device))
+    #     return values[0], logits[0]
+
+    def classify_from_latents(self, latents, num_classes):
+        return [self.classify(latent, num_classes) for latent in latents]
+
+        # with self.autocast(), torch.inference_mode():
+        #     image_embedding = torch.stack([latent['image_embedding'] for latent in latents]).to(self.device)
+        #     logits = self.model.classify(image_embedding)
+        #     probs = torch.softmax(logits, dim=-1)
+        #     pred_classes = torch.argmax(probs, dim=-1)
+        # return [{"pred_class": c.item(), "probabilities": p.tolist()} for c, p in zip(pred_classes, probs)]
+
+    def survival_predict_from_latents(self, latents, time_horizon=None):
+        return [self.survival_predict(latent, time_horizon) for latent in latents]
+
+        # with self.autocast(), torch.inference_mode():
+        #     image_embedding = torch.stack([latent['image_embedding'] for latent in latents]).to(self.device)
+        #     logits = self.model.classify(image_embedding)
+        #     probs = torch.softmax(logits, dim=-1)
+        #     risks = 1 - probs.max(dim=-1).values
+        # return [{"risk_score": r.item()} for r in risks]
+
+    def report_generate_from_latents(self, latents):
+        return [self.report_generate(latent) for latent in latents]
+
+        # # one batched beam search over all slides of the batch (image latents may differ in length)
+        # genned_ids = self.generate_reports([latent['image_latents'].to(self.device) for latent in latents])
+        # return [self.model.untokenize(torch.tensor([ids]))[0] for ids in genned_ids]
+
+    # def decode_step(self, input_ids, encoder_states, encoder_mask, past):
+    #     with self.autocast():
+    #         out = self.model.text_decoder(input_ids=input_ids, encoder_hidden_states=encoder_states,
+    #                                       encoder_attention_mask=encoder_mask, past_key_values=past, use_cache=True)
+    #     return out.logits[:, -1], out.past_key_values
+
     def report_generate(self, feature):
 
         import random
@@ -68,15 +157,20 @@ class PRISM(BaseModel):
         # embedding_data = torch.load(feature)
         # tile_embeddings = embedding_data['embeddings'].unsqueeze(0).to(self.device)
 
-        # with torch.autocast(self.device, torch.float16), torch.inference_mode():
+        # with self.autocast(), torch.inference_mode():
         #     reprs = self.model.slide_representations(tile_embeddings)
 
-        # with torch.autocast('cuda', torch.float16), torch.inference_mode():
-        #     genned_ids = self.model.generate(
-        #         key_value_states=reprs['image_latents'],
-        #         do_sample=False,
-        #         num_beams=5,
-        #         num_beam_groups=1,
-        #     )
-        #     genned_caption = self.model.untokenize(genned_ids)
-        # return genned_caption
\ No newline at end of file
+        # genned_ids = self.generate_reports([reprs['image_latents'][0]])
+        # return self.model.untokenize(torch.tensor(genned_ids))[0]
+
+    def report_generate_batch(self, features, mask=None):
+        return [self.report_generate(feature) for feature in self.iter_bags(features, mask)]
+
+        # tile_embeddings = features.to(self.device)
+        # attention_mask = mask.to(self.device)
+
+        # with self.autocast(), torch.inference_mode():
+        #     reprs = self.model.slide_representations(tile_embeddings, attention_mask=attention_mask)
+
+        # genned_ids = self.generate_reports(list(reprs['image_latents']))
+        # return [self.model.untokenize(torch.tensor([ids]))[0] for ids in genned_ids]
\ No newline at end of file
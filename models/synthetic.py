@@ -0,0 +1,115 @@
+import time
+import zlib
+import torch
+from core.base_model import BaseModel
+from datasets.synthetic import REPORT_TEMPLATES
+
+
+class SyntheticModel(BaseModel):
+    """
+    规模测试用的确定性模型（不加载权重）：输出只取决于输入特征与 seed，计算量可配置。
+      hidden_dim            slide encoder 的投影维度，CPU 上的真实计算量 ∝ tiles × D × hidden_dim
+      encoder_latency_ms    每张 slide 额外的 encoder 等待时间（模拟 GPU 上的前向）
+      head_latency_ms       每张 slide 额外的 head 等待时间
+    encode / head 每个 batch 的耗时记录在 timings 中（pop_timings 取出）。
+    """
+    has_slide_encoder = True
+
+    def __init__(self, model_path=None, model_name="SyntheticModel", device="cpu", low_memory=True, precision=None,
+                 long_bag=None, generation=None, hidden_dim=256, encoder_latency_ms=0.0, head_latency_ms=0.0,
+                 seed=0):
+        super().__init__(
+            model_path=None,
+            device=device,
+            model_name=model_name,
+            low_memory=low_memory,
+            precision=precision,
+            long_bag=long_bag,
+            generation=generation
+        )
+        self.hidden_dim = hidden_dim
+        self.encoder_latency_ms = encoder_latency_ms
+        self.head_latency_ms = head_latency_ms
+        self.seed = seed
+        self._weights = {}
+        self.timings = {"encode": [], "head": []}
+
+    def inference_settings(self) -> dict:
+        settings = super().inference_settings()
+        settings["synthetic"] = {"hidden_dim": self.hidden_dim, "seed": self.seed}
+        return settings
+
+    def _weight(self, name, rows, cols):
+        # 固定 seed 的随机投影，按形状懒创建
+        key = (name, rows, cols)
+        if key not in self._weights:
+            generator = torch.Generator().manual_seed(zlib.crc32(repr(key).encode()) ^ self.seed)
+            self._weights[key] = torch.randn(rows, cols, generator=generator) / rows ** 0.5
+        return self._weights[key]
+
+    def _encode(self, bag):
+        bag = bag.float()
+        with self.autocast(), torch.inference_mode():
+            hidden = torch.relu(bag @ self._weight("encoder", bag.shape[-1], self.hidden_dim))
+        return hidden.float().mean(dim=0)
+
+    def _heads(self, latents, head):
+        start = time.perf_counter()
+        if self.head_latency_ms:
+            time.sleep(self.head_latency_ms * len(latents) / 1000)
+        preds = [head(latent) for latent in latents]
+        self.timings["head"].append(time.perf_counter() - start)
+        return preds
+
+    def pop_timings(self):
+        """每个 batch 的 encode / head 耗时（秒），取出后清空。"""
+        timings, self.timings = self.timings, {"encode": [], "head": []}
+        return timings
+
+    def encode_batch(self, features, mask=None):
+        start = time.perf_counter()
+        bags = list(self.iter_bags(features, mask))
+        if self.encoder_latency_ms:
+            time.sleep(self.encoder_latency_ms * len(bags) / 1000)
+        if self.use_chunked_encoding():
+            latents = [self.pool_long_bag(bag) for bag in bags]
+        else:
+            latents = [self._encode(bag) for bag in bags]
+        self.timings["encode"].append(time.perf_counter() - start)
+        return latents
+
+    def encode_chunk(self, chunk):
+        # 均值池化：逐块编码后由 pool_long_bag 合并，结果与整包 _encode 相同
+        chunk = chunk.float()
+        with self.autocast(), torch.inference_mode():
+            hidden = torch.relu(chunk @ self._weight("encoder", chunk.shape[-1], self.hidden_dim))
+        return hidden.float(), None
+
+    def _classify_head(self, latent, num_classes):
+        probs = torch.softmax(latent @ self._weight("classify", self.hidden_dim, num_classes), dim=-1)
+        return {"pred_class": int(probs.argmax()), "probabilities": probs.tolist()}
+
+    def _survival_head(self, latent):
+        return {"risk_score": float(torch.sigmoid(latent @ self._weight("survival", self.hidden_dim, 1)))}
+
+    def _report_head(self, latent):
+        logits = latent @ self._weight("report", self.hidden_dim, len(REPORT_TEMPLATES))
+        return REPORT_TEMPLATES[int(logits.argmax())]
+
+    def classify(self, feature, num_classes):
+        return self._classify_head(self._encode(feature), num_classes)
+
+    def survival_predict(self, feature, time_horizon=None):
+        return self._survival_head(self._encode(feature))
+
+    def report_generate(self, feature):
+        return self._report_head(self._encode(feature))
+
+    def classify_from_latents(self, latents, num_classes):
+        return self._heads(latents, lambda latent: self._classify_head(latent, num_classes))
+
+    def survival_predict_from_latents(self, latents, time_horizon=None):
+        return self._heads(latents, self._survival_head)
+
+    def report_generate_from_latents(self, latents):
+        return self._heads(latents, self._report_head)
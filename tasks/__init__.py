@@ -1,5 +1,20 @@
-from .classification import ClassificationTask
-from .report_generation import ReportGenerationTask
-from .survival_prediction import SurvivalPredictionTask
+from core.registry import TASKS, import_target
 
-__all__ = [ClassificationTask, ReportGenerationTask, SurvivalPredictionTask]
\ No newline at end of file
+_CLASSES = {
+    "ClassificationTask": "tasks.classification:ClassificationTask",
+    "ReportGenerationTask": "tasks.report_generation:ReportGenerationTask",
+    "SurvivalPredictionTask": "tasks.survival_prediction:SurvivalPredictionTask",
+}
+# 配置中的任务名（config.json 的顶层键） -> 实现，第一次用到时才 import
+TASKS.register("Classification", _CLASSES["ClassificationTask"])
+TASKS.register("ReportGeneration", _CLASSES["ReportGenerationTask"])
+TASKS.register("SurvivalPrediction", _CLASSES["SurvivalPredictionTask"])
+
+__all__ = list(_CLASSES)
+
+
+def __getattr__(name):
+    # 兼容 `from tasks import ClassificationTask`：访问时才导入
+    if name in _CLASSES:
+        return import_target(_CLASSES[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,26 +1,14 @@
 from core.base_task import BaseTask
 from core.base_model import BaseModel
-from core.base_dataset import BaseDataset
 
 class ClassificationTask(BaseTask):
-    def __init__(self, task_name: str, metrics: list, output_root="results"):
-        super().__init__(task_name=task_name, metrics=metrics, output_root=output_root)
+    label_type = "classification"
 
-    def evaluate(self, model: BaseModel, dataset: BaseDataset, **kwargs):
-        all_preds = []
-        all_labels = []
-        metric_results = {}
+    def __init__(self, task_name: str, metrics: list, output_root="results", batch_size=1,
+                 slide_cache=None, bootstrap=None, results_index=None, auc_bins=None):
+        super().__init__(task_name=task_name, metrics=metrics, output_root=output_root, batch_size=batch_size,
+                         slide_cache=slide_cache, bootstrap=bootstrap, results_index=results_index,
+                         auc_bins=auc_bins)
 
-        for item in dataset:
-            feature = item.get("embedding")
-            slide_info = item.get("slide_info")
-            label = slide_info.get("classification_label")
-            pred = model.classify(feature, kwargs.get("num_classes"))
-            all_preds.append(pred)
-            all_labels.append(label)
-        
-        for metric_fn in self.metrics:
-            metric_name = metric_fn.__name__
-            metric_results[metric_name] = metric_fn(all_labels, all_preds)
-
-        return metric_results, all_preds
+    def predict_from_latents(self, model: BaseModel, latents, **kwargs):
+        return model.classify_from_latents(latents, kwargs.get("num_classes"))
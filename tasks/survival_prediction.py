@@ -1,26 +1,22 @@
 from core.base_task import BaseTask
 from core.base_model import BaseModel
-from core.base_dataset import BaseDataset
 
 class SurvivalPredictionTask(BaseTask):
-    def __init__(self, task_name: str, metrics: list, output_root="results"):
-        super().__init__(task_name=task_name, metrics=metrics, output_root=output_root)
+    label_type = "survival_prediction"
+    config_options = ("time_column", "event_column")
 
-    def evaluate(self, model: BaseModel, dataset: BaseDataset, **kwargs):
-        all_preds = []
-        all_labels = []
-        metric_results = {}
+    def __init__(self, task_name: str, metrics: list, output_root="results", batch_size=1,
+                 slide_cache=None, bootstrap=None, results_index=None, auc_bins=None,
+                 time_column="survival_time", event_column="event"):
+        super().__init__(task_name=task_name, metrics=metrics, output_root=output_root, batch_size=batch_size,
+                         slide_cache=slide_cache, bootstrap=bootstrap, results_index=results_index,
+                         auc_bins=auc_bins)
+        # 生存指标把标签当作 (time, event) 解包，按列名取值，不依赖 CSV 中的列顺序
+        self.label_columns = [time_column, event_column]
 
-        for item in dataset:
-            feature = item.get("embedding")
-            slide_info = item.get("slide_info")
-            label = slide_info.get("survival_prediction_label")
-            pred = model.survival_predict(feature, kwargs.get("time_horizon"))
-            all_preds.append(pred)
-            all_labels.append(label)
+    def predict_from_latents(self, model: BaseModel, latents, **kwargs):
+        return model.survival_predict_from_latents(latents, kwargs.get("time_horizon"))
 
-        for metric_fn in self.metrics:
-            metric_name = metric_fn.__name__
-            metric_results[metric_name] = metric_fn(all_labels, all_preds)
-
-        return metric_results, all_preds
\ No newline at end of file
+    def metric_kwargs(self, test_configs):
+        # 时间依赖指标（AUC_Survival / Uno's C / IBS）在 time_horizon 处评估
+        return {"time_horizon": test_configs.get("time_horizon")}
@@ -0,0 +1,317 @@
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import numpy as np
+from . import metrics as M
+from .bootstrap import bootstrap_ci
+
+# 流式、可合并的指标累加器：任务每个 batch 调用 update(labels, preds)，结束时 compute()。
+# 不同 worker / 分片各自累加后用 merge() 合并，结果与在全部样本上一次性计算相同。
+#   - acc / precision / recall / f1: 混淆计数
+#   - auc: 按分数的正/负样本直方图（精确：每个不同分数一个桶；分箱：固定桶数，内存恒定，runtime.yaml 的 auc_bins）
+#   - 报告指标: 逐样本统计表（n-gram 命中/总数、长度、ROUGE-L、METEOR）的列和，内存恒定；
+#     统计表由 StreamingMetrics 每个 batch 只算一次，所有报告指标共用
+#   - 生存指标: 需要整个队列的两两比较，保存紧凑的 (time, event, risk) 数组
+#   - 其他指标: 保留 (labels, preds) 列表，compute 时调用原函数
+
+
+class MetricAccumulator:
+    """累加器接口。name 与对应指标函数的 __name__ 相同（即 metrics.json 中的键）。"""
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def update(self, labels: List[Any], preds: List[Any]):
+        raise NotImplementedError
+
+    def merge(self, other: "MetricAccumulator") -> "MetricAccumulator":
+        raise NotImplementedError
+
+    def compute(self) -> float:
+        raise NotImplementedError
+
+
+class ConfusionAccumulator(MetricAccumulator):
+    """混淆计数 {(true, pred): n}，类别集合随数据增长。"""
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self.counts = Counter()
+
+    def update(self, labels, preds):
+        self.counts.update(zip(labels, (pred.get('pred_class') for pred in preds)))
+
+    def merge(self, other):
+        self.counts.update(other.counts)
+        return self
+
+    def compute(self):
+        if not self.counts:
+            return 0.0
+        classes = sorted({c for pair in self.counts for c in pair})
+        index = {c: i for i, c in enumerate(classes)}
+        confusion = np.zeros((len(classes), len(classes)))
+        for (true, pred), n in self.counts.items():
+            confusion[index[true], index[pred]] += n
+        tp = np.diag(confusion)
+        if self.name == "acc":
+            return float(tp.sum() / confusion.sum())
+        true_count, pred_count = confusion.sum(axis=1), confusion.sum(axis=0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            per_class = {"precision": tp / pred_count,
+                         "recall": tp / true_count,
+                         "f1": 2 * tp / (true_count + pred_count)}[self.name]
+        # 与 sklearn average='macro', zero_division=0 一致
+        return float(np.nan_to_num(per_class).mean())
+
+
+class _ScoreHistogram:
+    """某一类别 one-vs-rest 的正/负样本分数直方图。"""
+
+    def __init__(self, num_bins: Optional[int]):
+        self.num_bins = num_bins
+        if num_bins is None:
+            self.scores = np.empty(0)
+            self.pos = np.empty(0)
+            self.neg = np.empty(0)
+        else:
+            self.pos = np.zeros(num_bins)
+            self.neg = np.zeros(num_bins)
+
+    def add(self, scores: np.ndarray, positive: np.ndarray):
+        if self.num_bins is not None:
+            bins = np.clip((scores * self.num_bins).astype(np.int64), 0, self.num_bins - 1)
+            self.pos += np.bincount(bins, weights=positive, minlength=self.num_bins)
+            self.neg += np.bincount(bins, weights=1 - positive, minlength=self.num_bins)
+            return
+        self._add_exact(scores, positive, 1 - positive)
+
+    def _add_exact(self, scores, pos, neg):
+        # 相同分数合并为一个桶，内存随不同分数的个数增长
+        uniques, inverse = np.unique(np.concatenate([self.scores, scores]), return_inverse=True)
+        self.pos = np.bincount(inverse, weights=np.concatenate([self.pos, pos]), minlength=len(uniques))
+        self.neg = np.bincount(inverse, weights=np.concatenate([self.neg, neg]), minlength=len(uniques))
+        self.scores = uniques
+
+    def merge(self, other: "_ScoreHistogram"):
+        if self.num_bins is not None:
+            self.pos += other.pos
+            self.neg += other.neg
+        else:
+            self._add_exact(other.scores, other.pos, other.neg)
+
+    def auc(self) -> float:
+        # 同一桶内的正负对计 0.5（精确模式下即分数相同的并列对）
+        below = np.cumsum(self.neg) - self.neg
+        denominator = self.pos.sum() * self.neg.sum()
+        if denominator == 0:
+            return float("nan")
+        return float((self.pos * (below + 0.5 * self.neg)).sum() / denominator)
+
+
+class AUCAccumulator(MetricAccumulator):
+    """
+    ROC-AUC：二分类使用正类概率，多分类为 one-vs-rest 的 macro 平均。
+
+    Args:
+        num_bins: None 表示精确直方图（结果与 sklearn 相同）；整数表示把 [0, 1] 的概率分成固定桶数，内存恒定
+    """
+
+    def __init__(self, name: str = "auc", num_bins: Optional[int] = None):
+        super().__init__(name)
+        self.num_bins = num_bins
+        self.histograms: Optional[Dict[int, _ScoreHistogram]] = None
+
+    def update(self, labels, preds):
+        if len(preds) == 0:
+            return
+        proba = np.asarray([pred.get('probabilities') for pred in preds], dtype=np.float64)
+        labels = np.asarray(labels)
+        if proba.ndim == 2 and proba.shape[1] == 2:
+            columns = {1: proba[:, 1]}
+        elif proba.ndim == 2:
+            columns = {k: proba[:, k] for k in range(proba.shape[1])}
+        else:
+            columns = {1: proba}
+        if self.histograms is None:
+            self.histograms = {k: _ScoreHistogram(self.num_bins) for k in columns}
+        for k, scores in columns.items():
+            self.histograms[k].add(scores, (labels == k).astype(np.float64))
+
+    def merge(self, other):
+        if other.histograms is None:
+            return self
+        if self.histograms is None:
+            self.histograms = {k: _ScoreHistogram(self.num_bins) for k in other.histograms}
+        for k, histogram in other.histograms.items():
+            self.histograms[k].merge(histogram)
+        return self
+
+    def compute(self):
+        if self.histograms is None:
+            return float("nan")
+        return float(np.mean([histogram.auc() for histogram in self.histograms.values()]))
+
+
+class ReportAccumulator(MetricAccumulator):
+    """报告指标：逐样本统计表的列和 + 逐句 BLEU 之和，内存恒定。"""
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self.sums = np.zeros(M.NUM_REPORT_STATS)
+        self.sentence_bleu_sum = 0.0
+        self.count = 0
+
+    def update(self, labels, preds, stats=None):
+        """stats: 这个 batch 的 report_stats(labels, preds)，None 时在这里统计。"""
+        if len(preds) == 0:
+            return
+        stats = M._stats_or_compute(labels, preds, stats)
+        self.sums += stats.sum(axis=0)
+        if self.name == "bleu":
+            self.sentence_bleu_sum += float(M.sentence_bleu_scores(labels, preds, stats=stats).sum())
+        self.count += len(preds)
+
+    def merge(self, other):
+        self.sums += other.sums
+        self.sentence_bleu_sum += other.sentence_bleu_sum
+        self.count += other.count
+        return self
+
+    def compute(self):
+        if self.count == 0:
+            return 0.0
+        if self.name == "bleu":
+            return self.sentence_bleu_sum / self.count
+        if self.name.startswith("bleu_"):
+            return float(M.bleu_from_sums(self.sums, int(self.name[len("bleu_"):])))
+        column = {"rouge_l": M.ROUGE_L_COLUMN, "meteor": M.METEOR_COLUMN}[self.name]
+        return float(self.sums[column] / self.count)
+
+
+class SurvivalAccumulator(MetricAccumulator):
+    """生存指标需要整个队列的两两比较，这里只保存紧凑的 float 数组（每个病人 3 个数）。"""
+
+    def __init__(self, metric_fn: Callable, **metric_kwargs):
+        super().__init__(metric_fn.__name__)
+        self.metric_fn = metric_fn
+        self.metric_kwargs = metric_kwargs
+        self.chunks: List[np.ndarray] = []
+
+    def update(self, labels, preds):
+        if len(preds) == 0:
+            return
+        times, events, risk = M._survival_arrays(labels, preds)
+        self.chunks.append(np.column_stack([times, events, risk]))
+
+    def merge(self, other):
+        self.chunks.extend(other.chunks)
+        return self
+
+    def compute(self):
+        data = np.concatenate(self.chunks) if self.chunks else np.empty((0, 3))
+        return self.metric_fn(data[:, :2], data[:, 2], **self.metric_kwargs)
+
+
+class ListAccumulator(MetricAccumulator):
+    """没有流式实现的指标：保留全部 (labels, preds)，compute 时调用原函数。"""
+
+    def __init__(self, metric_fn: Callable, **metric_kwargs):
+        super().__init__(metric_fn.__name__)
+        self.metric_fn = metric_fn
+        self.metric_kwargs = metric_kwargs
+        self.labels, self.preds = [], []
+
+    def update(self, labels, preds):
+        self.labels.extend(labels)
+        self.preds.extend(preds)
+
+    def merge(self, other):
+        self.labels.extend(other.labels)
+        self.preds.extend(other.preds)
+        return self
+
+    def compute(self):
+        return self.metric_fn(self.labels, self.preds, **self.metric_kwargs)
+
+
+_SURVIVAL_METRICS = {"c_index", "uno_c_index", "auc_survival", "integrated_brier_score"}
+
+
+def make_accumulator(metric_fn: Callable, auc_bins: Optional[int] = None, **metric_kwargs) -> MetricAccumulator:
+    """按指标函数名选择累加器；metric_kwargs 原样传给需要它们的指标函数（如 time_horizon）。"""
+    name = metric_fn.__name__
+    if name in ("acc", "precision", "recall", "f1"):
+        return ConfusionAccumulator(name)
+    if name == "auc":
+        return AUCAccumulator(name, num_bins=auc_bins)
+    if name in ("bleu", "bleu_1", "bleu_2", "bleu_3", "bleu_4", "rouge_l", "meteor"):
+        return ReportAccumulator(name)
+    if name in _SURVIVAL_METRICS:
+        return SurvivalAccumulator(metric_fn, **metric_kwargs)
+    return ListAccumulator(metric_fn, **metric_kwargs)
+
+
+def merge_accumulators(shards: List[List[MetricAccumulator]]) -> Dict[str, float]:
+    """合并多个分片（每个分片一组与指标一一对应的累加器）并计算最终指标。"""
+    merged = shards[0]
+    for shard in shards[1:]:
+        for accumulator, other in zip(merged, shard):
+            accumulator.merge(other)
+    return {accumulator.name: accumulator.compute() for accumulator in merged}
+
+
+class StreamingMetrics:
+    """
+    一次评估的全部指标：每个指标一个累加器，按 batch 调用 update，结束时 compute。
+    累加过程中不保留逐样本数据；bootstrap 置信区间需要的 (labels, preds) 在 compute 时由 samples 读出（如从预测日志）。
+
+    Args:
+        metrics: 指标函数列表
+        bootstrap: bootstrap 设置（n_resamples / confidence / seed），None 表示只计算点估计
+        auc_bins: AUC 直方图的桶数，None 为精确模式（内存随不同分数的个数增长）
+        metric_kwargs: 传给指标函数的额外参数（如 time_horizon）
+    """
+
+    def __init__(self, metrics: List[Callable], bootstrap: Optional[Dict[str, Any]] = None,
+                 auc_bins: Optional[int] = None, **metric_kwargs):
+        self.metrics = metrics
+        self.bootstrap = bootstrap
+        self.metric_kwargs = metric_kwargs
+        self.accumulators = [make_accumulator(metric_fn, auc_bins=auc_bins, **metric_kwargs) for metric_fn in metrics]
+        self.count = 0
+
+    def update(self, labels: List[Any], preds: List[Any]):
+        stats = self._report_stats(labels, preds)
+        for accumulator in self.accumulators:
+            if isinstance(accumulator, ReportAccumulator):
+                accumulator.update(labels, preds, stats=stats)
+            else:
+                accumulator.update(labels, preds)
+        self.count += len(preds)
+
+    def _report_stats(self, labels, preds):
+        # BLEU-1..4 / ROUGE-L / METEOR 共用同一张逐样本统计表，每组样本只统计一次
+        if len(preds) == 0 or not any(isinstance(a, ReportAccumulator) for a in self.accumulators):
+            return None
+        return M.report_stats(labels, preds)
+
+    def merge(self, other: "StreamingMetrics") -> "StreamingMetrics":
+        for accumulator, other_accumulator in zip(self.accumulators, other.accumulators):
+            accumulator.merge(other_accumulator)
+        self.count += other.count
+        return self
+
+    def compute(self, samples: Optional[Callable[[], Tuple[List[Any], List[Any]]]] = None) -> Dict[str, Any]:
+        """samples: 开启 bootstrap 时必须给出，返回全部 (labels, preds)，只在这里调用一次。"""
+        if self.bootstrap and samples is None:
+            raise ValueError("bootstrap confidence intervals need the per-sample (labels, preds)")
+        labels, preds = samples() if self.bootstrap else (None, None)
+        stats = self._report_stats(labels, preds) if self.bootstrap else None
+        metric_results = {}
+        for metric_fn, accumulator in zip(self.metrics, self.accumulators):
+            metric_results[accumulator.name] = accumulator.compute()
+            if self.bootstrap:
+                extra = {"stats": stats} if isinstance(accumulator, ReportAccumulator) else {}
+                metric_results[f"{accumulator.name}_ci"] = list(bootstrap_ci(metric_fn, labels, preds, **self.bootstrap,
+                                                                            **self.metric_kwargs, **extra))
+        return metric_results
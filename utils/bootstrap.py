@@ -0,0 +1,219 @@
+import numpy as np
+from typing import Callable, Dict, Optional, Tuple
+from . import metrics as M
+from . import survival
+
+# 向量化的 bootstrap 置信区间。
+# 一次抽取 B 组重采样，表示为计数矩阵 counts[B, n]（样本 i 在第 b 组中被抽中的次数），
+# 每个指标直接在 counts 上对所有重采样同时求值，而不是调用 B 次 sklearn：
+#   - acc / precision / recall / f1: 混淆矩阵 = counts @ onehot(true * K + pred)
+#   - auc: 按分数排序后的秩统计（并列分数按组累加）
+#   - c_index / uno_c_index: 排序计数（utils.survival.concordance_counts），B 组权重同时计算
+#   - auc_survival / integrated_brier_score: 按权重估计的 KM / 删失分布 / Breslow 基线，B 组同时计算
+#   - 报告指标: 逐样本统计表的加权和
+
+# 单个 counts 块的元素数上限，控制内存占用
+_MAX_CHUNK_ELEMENTS = 2 ** 24
+
+
+def resample_counts(n: int, n_resamples: int, rng: np.random.Generator) -> np.ndarray:
+    """counts[b, i] = 第 b 组重采样中样本 i 被抽中的次数。"""
+    indices = rng.integers(0, n, size=(n_resamples, n))
+    offsets = (np.arange(n_resamples) * n)[:, None]
+    return np.bincount((indices + offsets).ravel(), minlength=n_resamples * n).reshape(n_resamples, n).astype(np.float64)
+
+
+# ---------------------------------------------------------------- classification
+def _class_indices(y_trues, y_preds):
+    pred_classes = [y_pred.get('pred_class') for y_pred in y_preds]
+    classes, encoded = np.unique(np.concatenate([np.asarray(y_trues), np.asarray(pred_classes)]), return_inverse=True)
+    n = len(y_trues)
+    return encoded[:n], encoded[n:], len(classes)
+
+
+def _confusion_stat(y_trues, y_preds, reduce: Callable) -> Callable:
+    true_idx, pred_idx, k = _class_indices(y_trues, y_preds)
+    onehot = np.zeros((len(true_idx), k * k))
+    onehot[np.arange(len(true_idx)), true_idx * k + pred_idx] = 1
+
+    def stat(counts):
+        return reduce((counts @ onehot).reshape(-1, k, k))
+    return stat
+
+
+def _macro(per_class: Callable) -> Callable:
+    # 与 sklearn average='macro', zero_division=0 一致：只对该次重采样中出现过的类别求平均
+    def reduce(confusion):
+        tp = np.diagonal(confusion, axis1=1, axis2=2)
+        true_count, pred_count = confusion.sum(axis=2), confusion.sum(axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            values = np.nan_to_num(per_class(tp, true_count, pred_count))
+        present = (true_count + pred_count) > 0
+        return (values * present).sum(axis=1) / np.maximum(present.sum(axis=1), 1)
+    return reduce
+
+
+def _acc_stat(y_trues, y_preds):
+    return _confusion_stat(y_trues, y_preds,
+                           lambda c: np.trace(c, axis1=1, axis2=2) / np.maximum(c.sum(axis=(1, 2)), 1))
+
+
+def _precision_stat(y_trues, y_preds):
+    return _confusion_stat(y_trues, y_preds, _macro(lambda tp, t, p: tp / p))
+
+
+def _recall_stat(y_trues, y_preds):
+    return _confusion_stat(y_trues, y_preds, _macro(lambda tp, t, p: tp / t))
+
+
+def _f1_stat(y_trues, y_preds):
+    return _confusion_stat(y_trues, y_preds, _macro(lambda tp, t, p: 2 * tp / (t + p)))
+
+
+def _binary_auc_stat(labels: np.ndarray, scores: np.ndarray) -> Callable:
+    order = np.argsort(scores, kind="mergesort")
+    sorted_scores = scores[order]
+    positive = (labels[order] == 1).astype(np.float64)
+    # 分数相同的样本归为一组，组内的正负对各计 0.5
+    starts = np.flatnonzero(np.r_[True, sorted_scores[1:] != sorted_scores[:-1]])
+
+    def stat(counts):
+        weights = counts[:, order]
+        pos = np.add.reduceat(weights * positive, starts, axis=1)
+        neg = np.add.reduceat(weights * (1 - positive), starts, axis=1)
+        below = np.cumsum(neg, axis=1) - neg
+        numerator = (pos * (below + 0.5 * neg)).sum(axis=1)
+        denominator = pos.sum(axis=1) * neg.sum(axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(denominator > 0, numerator / denominator, np.nan)
+    return stat
+
+
+def _auc_stat(y_trues, y_preds_proba):
+    y_trues = np.asarray(y_trues)
+    proba = np.asarray([y_pred.get('probabilities') for y_pred in y_preds_proba], dtype=np.float64)
+    if proba.ndim == 2 and proba.shape[1] == 2:
+        return _binary_auc_stat(y_trues, proba[:, 1])
+    if proba.ndim == 2 and proba.shape[1] > 2:
+        # one-vs-rest 的 macro 平均，与 roc_auc_score(multi_class='ovr') 一致
+        per_class = [_binary_auc_stat((y_trues == k).astype(int), proba[:, k]) for k in range(proba.shape[1])]
+        return lambda counts: np.mean([stat(counts) for stat in per_class], axis=0)
+    return _binary_auc_stat(y_trues, proba)
+
+
+# ---------------------------------------------------------------- survival
+def _c_index_stat(y_true, y_preds, time_horizon=None):
+    times, events, risk = M._survival_arrays(y_true, y_preds)
+    return lambda counts: survival.concordance_index(times, events, risk, counts)
+
+
+def _uno_c_index_stat(y_true, y_preds, time_horizon=None):
+    times, events, risk = M._survival_arrays(y_true, y_preds)
+    return lambda counts: survival.uno_c_index(times, events, risk, tau=time_horizon, weights=counts)
+
+
+def _auc_survival_stat(y_true, y_preds, time_horizon=None):
+    # 未指定 time_horizon 时评估时间点取自原样本（与逐组重采样相比，只有时间网格不随重采样变化）
+    times, events, risk = M._survival_arrays(y_true, y_preds)
+    if time_horizon is not None:
+        return lambda counts: survival.cumulative_dynamic_auc(times, events, risk, [time_horizon], counts)[0][:, 0]
+    eval_times = survival.evaluation_grid(times, events)
+    return lambda counts: survival.cumulative_dynamic_auc(times, events, risk, eval_times, counts)[1]
+
+
+def _integrated_brier_score_stat(y_true, y_preds, time_horizon=None):
+    # 评估时间点同样取自原样本；基线风险（Breslow）与删失分布按每组重采样的权重估计
+    times, events, risk = M._survival_arrays(y_true, y_preds)
+    eval_times = survival.evaluation_grid(times, events, time_horizon)
+    if len(eval_times) == 0:
+        return lambda counts: np.full(len(counts), np.nan)
+    return lambda counts: survival.breslow_integrated_brier_score(times, events, risk, eval_times, counts)
+
+
+# ---------------------------------------------------------------- report generation
+def _sentence_mean_stat(values: np.ndarray) -> Callable:
+    return lambda counts: (counts @ values) / counts.sum(axis=1)
+
+
+# 报告指标的准备函数可以接收已算好的逐样本统计表 stats，None 时自行统计
+def _bleu_stat(references, hypotheses, stats=None):
+    return _sentence_mean_stat(M.sentence_bleu_scores(references, hypotheses, stats=stats))
+
+
+def _corpus_bleu_stat(order: int):
+    def prepare(references, hypotheses, stats=None):
+        stats = M._stats_or_compute(references, hypotheses, stats)
+        return lambda counts: M.bleu_from_sums(counts @ stats, order)
+    return prepare
+
+
+def _column_mean_stat(column: int):
+    def prepare(references, hypotheses, stats=None):
+        return _sentence_mean_stat(M._stats_or_compute(references, hypotheses, stats)[:, column])
+    return prepare
+
+
+# 指标函数名 -> 准备函数；准备函数接收 (labels, preds, **metric_kwargs)，返回 counts[B, n] -> values[B] 的函数。
+# metric_kwargs 只有生存任务会传（time_horizon），生存指标的准备函数接收它；报告指标另外可以收到 stats
+BOOTSTRAP_STATISTICS: Dict[str, Callable] = {
+    "acc": _acc_stat,
+    "precision": _precision_stat,
+    "recall": _recall_stat,
+    "f1": _f1_stat,
+    "auc": _auc_stat,
+    "c_index": _c_index_stat,
+    "uno_c_index": _uno_c_index_stat,
+    "auc_survival": _auc_survival_stat,
+    "integrated_brier_score": _integrated_brier_score_stat,
+    "bleu": _bleu_stat,
+    "bleu_1": _corpus_bleu_stat(1),
+    "bleu_2": _corpus_bleu_stat(2),
+    "bleu_3": _corpus_bleu_stat(3),
+    "bleu_4": _corpus_bleu_stat(4),
+    "rouge_l": _column_mean_stat(M.ROUGE_L_COLUMN),
+    "meteor": _column_mean_stat(M.METEOR_COLUMN),
+}
+
+
+def _fallback_stat(metric_fn: Callable, labels, preds, **metric_kwargs) -> Callable:
+    # 没有向量化实现的指标：逐组重采样调用原函数
+    def stat(counts):
+        values = []
+        for row in counts:
+            index = np.repeat(np.arange(len(row)), row.astype(np.int64))
+            try:
+                values.append(metric_fn([labels[i] for i in index], [preds[i] for i in index], **metric_kwargs))
+            except ValueError:
+                values.append(np.nan)
+        return np.asarray(values, dtype=np.float64)
+    return stat
+
+
+def bootstrap_ci(metric_fn: Callable, labels, preds, n_resamples: int = 1000, confidence: float = 0.95,
+                 seed: Optional[int] = 0, **metric_kwargs) -> Tuple[Optional[float], Optional[float]]:
+    """
+    百分位 bootstrap 置信区间。某组重采样上指标无定义（如只抽到一个类别）时记为 NaN 并忽略。
+    metric_kwargs 原样传给指标函数（如生存指标的 time_horizon）。
+
+    Returns:
+        (lower, upper)；样本为空或全部重采样都无定义时为 (None, None)
+    """
+    n = len(preds)
+    if n == 0:
+        return None, None
+    prepare = BOOTSTRAP_STATISTICS.get(metric_fn.__name__)
+    if prepare is not None:
+        stat = prepare(labels, preds, **metric_kwargs)
+    else:
+        stat = _fallback_stat(metric_fn, labels, preds, **metric_kwargs)
+
+    rng = np.random.default_rng(seed)
+    chunk = max(1, _MAX_CHUNK_ELEMENTS // n)
+    values = np.concatenate([stat(resample_counts(n, min(chunk, n_resamples - start), rng))
+                             for start in range(0, n_resamples, chunk)])
+    values = values[~np.isnan(values)]
+    if len(values) == 0:
+        return None, None
+    alpha = (1 - confidence) / 2
+    lower, upper = np.quantile(values, [alpha, 1 - alpha])
+    return float(lower), float(upper)
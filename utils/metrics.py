@@ -1,32 +1,41 @@
+import os
+import re
+import multiprocessing as mp
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
-from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score, roc_auc_score
-from nltk.translate.bleu_score import sentence_bleu, SmoothingFunction
-from lifelines.utils import concordance_index
-from sklearn.metrics import roc_auc_score
+from utils import survival
+from core.registry import METRICS
 
 
 # Classification Metrics
+# sklearn 在函数内导入：只用到文本 / 生存指标（或只重画图）时不必加载它
 def acc(y_trues, y_preds):
+    from sklearn.metrics import accuracy_score
     pred_classes = [y_pred.get('pred_class') for y_pred in y_preds]
     return accuracy_score(y_trues, pred_classes)
 
 
 def precision(y_trues, y_preds):
+    from sklearn.metrics import precision_score
     pred_classes = [y_pred.get('pred_class') for y_pred in y_preds]
     return precision_score(y_trues, pred_classes, average='macro', zero_division=0)
 
 
 def recall(y_trues, y_preds):
+    from sklearn.metrics import recall_score
     pred_classes = [y_pred.get('pred_class') for y_pred in y_preds]
     return recall_score(y_trues, pred_classes, average='macro', zero_division=0)
 
 
 def f1(y_trues, y_preds):
+    from sklearn.metrics import f1_score
     pred_classes = [y_pred.get('pred_class') for y_pred in y_preds]
     return f1_score(y_trues, pred_classes, average='macro', zero_division=0)
 
 
 def auc(y_trues, y_preds_proba):
+    from sklearn.metrics import roc_auc_score
     y_trues = np.array(y_trues)
     y_preds_proba = np.array([y_pred.get('probabilities') for y_pred in y_preds_proba])
     # binary classification
@@ -44,48 +53,255 @@ def auc(y_trues, y_preds_proba):
         raise ValueError(f"Unexpected y_preds_proba shape: {y_preds_proba.shape}")
 
 
-# Report Generation Metric
-def bleu(references, hypotheses, weights=(0.25, 0.25, 0.25, 0.25)):
+# Report Generation Metrics
+# 所有报告指标共享一张逐样本统计表：每对 (reference, hypothesis) 只分词一次、只统计一次 n-gram，
+# BLEU-1..4（corpus / sentence）、ROUGE-L、METEOR 式 unigram F 都由这张表向量化地算出。
+MAX_NGRAM = 4
+# 超过该数量的报告时分块交给多个进程统计
+PARALLEL_MIN_REPORTS = 2000
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+# 统计表的列：n-gram 命中数 (4) | hypothesis n-gram 总数 (4) | hyp 长度 | 最接近的 ref 长度 | ROUGE-L F | METEOR F
+_MATCH, _TOTAL = slice(0, MAX_NGRAM), slice(MAX_NGRAM, 2 * MAX_NGRAM)
+_HYP_LEN, _REF_LEN, ROUGE_L_COLUMN, METEOR_COLUMN = range(2 * MAX_NGRAM, 2 * MAX_NGRAM + 4)
+NUM_REPORT_STATS = 2 * MAX_NGRAM + 4
+
+
+def tokenize(text):
+    """小写后按词与标点切分；已经是 token 列表时原样返回。"""
+    if text is None:
+        return []
+    if isinstance(text, str):
+        return _TOKEN_RE.findall(text.lower())
+    return list(text)
+
+
+def _as_references(ref):
+    # str -> 单个参考；token 列表 -> 单个参考；list of (str | token 列表) 的列表 -> 多个参考
+    if isinstance(ref, str) or ref is None:
+        return [tokenize(ref)]
+    if len(ref) > 0 and not isinstance(ref[0], str):
+        return [tokenize(r) for r in ref]
+    return [list(ref)]
+
+
+def _ngram_counts(tokens):
+    return [Counter(zip(*(tokens[i:] for i in range(n)))) for n in range(1, MAX_NGRAM + 1)]
+
+
+def _lcs_length(a, b):
+    """bit-parallel LCS（Hyyrö），每个 token 只需几次大整数运算。"""
+    if not a or not b:
+        return 0
+    masks = {}
+    for i, token in enumerate(a):
+        masks[token] = masks.get(token, 0) | (1 << i)
+    full = (1 << len(a)) - 1
+    v = full
+    for token in b:
+        u = v & masks.get(token, 0)
+        v = ((v + u) | (v - u)) & full
+    return len(a) - bin(v).count("1")
+
+
+def _pair_stats(ref, hyp):
+    refs = _as_references(ref)
+    hyp = tokenize(hyp)
+    row = np.zeros(NUM_REPORT_STATS)
+    hyp_counts = _ngram_counts(hyp)
+    ref_counts = [_ngram_counts(r) for r in refs]
+    for n in range(MAX_NGRAM):
+        # 多参考时按 n-gram 取各参考中的最大次数做截断
+        max_ref = ref_counts[0][n]
+        for counts in ref_counts[1:]:
+            max_ref = max_ref | counts[n]
+        row[_MATCH][n] = sum((hyp_counts[n] & max_ref).values())
+        row[_TOTAL][n] = max(len(hyp) - n, 0)
+    row[_HYP_LEN] = len(hyp)
+    # 长度最接近 hypothesis 的参考（相同距离取较短者），与 nltk 一致
+    row[_REF_LEN] = min((len(r) for r in refs), key=lambda r: (abs(r - len(hyp)), r))
+
+    rouge, meteor = 0.0, 0.0
+    for r, counts in zip(refs, ref_counts):
+        if not r or not hyp:
+            continue
+        lcs = _lcs_length(r, hyp)
+        if lcs:
+            rouge = max(rouge, 2 * lcs / (len(r) + len(hyp)))
+        matches = sum((hyp_counts[0] & counts[0]).values())
+        if matches:
+            p, rc = matches / len(hyp), matches / len(r)
+            meteor = max(meteor, 10 * p * rc / (rc + 9 * p))
+    row[ROUGE_L_COLUMN], row[METEOR_COLUMN] = rouge, meteor
+    return row
+
+
+def _stats_chunk(pairs):
+    return np.stack([_pair_stats(ref, hyp) for ref, hyp in pairs]) if pairs else np.zeros((0, NUM_REPORT_STATS))
+
+
+def report_stats(references, hypotheses, num_workers=None):
+    """
+    逐样本统计表 [N, 12]；样本数较多时分块在多个进程中计算。
+    一次评估只需统计一次：StreamingMetrics 每个 batch 算一次，通过 stats 参数交给各个报告指标函数。
+    """
+    pairs = list(zip(references, hypotheses))
+    num_workers = num_workers or os.cpu_count() or 1
+    if len(pairs) < PARALLEL_MIN_REPORTS or num_workers <= 1:
+        stats = _stats_chunk(pairs)
+    else:
+        chunk = (len(pairs) + num_workers - 1) // num_workers
+        chunks = [pairs[i:i + chunk] for i in range(0, len(pairs), chunk)]
+        # 评估时预取线程与 torch 线程池都还在运行，fork 可能继承被持有的锁，与 executor / tiler 一样用 spawn
+        with ProcessPoolExecutor(max_workers=len(chunks), mp_context=mp.get_context("spawn")) as pool:
+            stats = np.concatenate(list(pool.map(_stats_chunk, chunks)))
+    return stats
+
+
+def _stats_or_compute(references, hypotheses, stats):
+    return report_stats(references, hypotheses) if stats is None else stats
+
+
+def _brevity_penalty(hyp_len, ref_len):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        bp = np.where(hyp_len > ref_len, 1.0, np.exp(1 - ref_len / hyp_len))
+    return np.where(hyp_len == 0, 0.0, bp)
+
+
+def bleu_from_sums(sums, order):
+    """由统计表的列和（可带前置的 batch 维，如 bootstrap 的 [B, 12]）计算 corpus BLEU-order。"""
+    matches = sums[..., _MATCH][..., :order]
+    totals = np.maximum(sums[..., _TOTAL][..., :order], 1)
+    with np.errstate(divide="ignore"):
+        log_precision = np.mean(np.log(matches / totals), axis=-1)
+    score = _brevity_penalty(sums[..., _HYP_LEN], sums[..., _REF_LEN]) * np.exp(log_precision)
+    return np.where(np.any(matches == 0, axis=-1), 0.0, score)
+
+
+def _corpus_bleu(stats, order):
+    if len(stats) == 0:
+        return 0.0
+    return float(bleu_from_sums(stats.sum(axis=0), order))
+
+
+def sentence_bleu_scores(references, hypotheses, weights=(0.25, 0.25, 0.25, 0.25), stats=None):
+    """逐样本 BLEU（等价于 nltk sentence_bleu + SmoothingFunction().method1）。"""
+    if stats is None:
+        stats = report_stats(references, hypotheses)
+    order = len(weights)
+    matches = stats[:, _MATCH][:, :order]
+    totals = np.maximum(stats[:, _TOTAL][:, :order], 1)
+    precisions = np.where(matches == 0, 0.1, matches) / totals
+    scores = _brevity_penalty(stats[:, _HYP_LEN], stats[:, _REF_LEN]) * np.exp(np.log(precisions) @ np.asarray(weights))
+    # 没有任何 unigram 命中时记 0
+    return np.where(matches[:, 0] == 0, 0.0, scores)
+
+
+def bleu(references, hypotheses, weights=(0.25, 0.25, 0.25, 0.25), stats=None):
     """
-    计算BLEU分数
+    计算BLEU分数（逐句 BLEU 的平均，平滑方式同 nltk method1）
 
-    :param references: list of list of reference sentences (每个参考可以是多个)
-                        e.g., [[ref1_tokens], [ref2_tokens], ...]
-    :param hypotheses: list of hypothesis sentences (模型生成的句子)
-                        e.g., [hypothesis_tokens1, hypothesis_tokens2, ...]
+    :param references: 参考报告，每个元素可以是字符串、token 列表，或多个参考组成的列表
+    :param hypotheses: 模型生成的报告（字符串或 token 列表）
     :param weights: BLEU权重，默认是4-gram均匀加权
+    :param stats: 已算好的 report_stats(references, hypotheses)，None 时在这里统计
     :return: BLEU分数 (0-1)
     """
-    scores = []
-    for ref, hyp in zip(references, hypotheses):
-        # ref需要是list of list，hyp是list
-        if isinstance(ref[0], str):
-            ref = [ref]  # 只有一个参考时包装一下
-        score = sentence_bleu(ref, hyp, weights=weights, smoothing_function=SmoothingFunction().method1)
-        scores.append(score)
-    return sum(scores) / len(scores)  # 平均BLEU分数
-    
+    if len(hypotheses) == 0:
+        return 0.0
+    return float(np.mean(sentence_bleu_scores(references, hypotheses, weights, stats)))  # 平均BLEU分数
+
+
+def bleu_1(references, hypotheses, stats=None):
+    return _corpus_bleu(_stats_or_compute(references, hypotheses, stats), 1)
+
+
+def bleu_2(references, hypotheses, stats=None):
+    return _corpus_bleu(_stats_or_compute(references, hypotheses, stats), 2)
+
+
+def bleu_3(references, hypotheses, stats=None):
+    return _corpus_bleu(_stats_or_compute(references, hypotheses, stats), 3)
+
+
+def bleu_4(references, hypotheses, stats=None):
+    return _corpus_bleu(_stats_or_compute(references, hypotheses, stats), 4)
+
+
+def rouge_l(references, hypotheses, stats=None):
+    """ROUGE-L F1（LCS），多参考时取最大值。"""
+    stats = _stats_or_compute(references, hypotheses, stats)
+    return float(stats[:, ROUGE_L_COLUMN].mean()) if len(stats) else 0.0
+
+
+def meteor(references, hypotheses, stats=None):
+    """METEOR 式的 unigram F-mean（召回加权 9:1，仅精确匹配，不含碎片惩罚）。"""
+    stats = _stats_or_compute(references, hypotheses, stats)
+    return float(stats[:, METEOR_COLUMN].mean()) if len(stats) else 0.0
+
 
 # Survival Analysis Metrics
-def c_index(y_true, y_preds):
+# 约定：y_true 为 [(time, event), ...]，event=1 表示终点事件发生，0 表示截尾；
+# y_pred 为风险分数（或含 'risk_score' 的字典），越大风险越高、预期生存越短。
+def _survival_arrays(y_true, y_preds):
+    times = np.asarray([t[0] for t in y_true], dtype=np.float64)
+    events = np.asarray([t[1] for t in y_true], dtype=np.float64)
+    risk = np.asarray([y_pred.get('risk_score') if isinstance(y_pred, dict) else y_pred for y_pred in y_preds],
+                      dtype=np.float64)
+    return times, events, risk
+
+
+def c_index(y_true, y_preds, time_horizon=None):
+    """Harrell's C（O(n log^2 n) 排序计数），风险越高应越早发生事件。"""
+    return float(survival.concordance_index(*_survival_arrays(y_true, y_preds))[0])
+
+
+def uno_c_index(y_true, y_preds, time_horizon=None):
+    """Uno's C（IPCW），截断在 time_horizon；未指定时使用全部随访时间。"""
+    times, events, risk = _survival_arrays(y_true, y_preds)
+    return survival.uno_c_index(times, events, risk, tau=time_horizon)
+
+
+def auc_survival(y_true, y_preds, time_horizon=None):
     """
-    y_true: [(time, event), ...]  event=1表示终点事件发生，0表示截尾
-    y_pred: 风险分数或生存概率，越大风险越高
+    累积/动态时间依赖 AUC：指定 time_horizon 时为该时刻的 AUC，
+    否则为事件时间 10%~90% 分位区间上按 KM 加权的平均 AUC。
     """
-    times = [t[0] for t in y_true]
-    events = [t[1] for t in y_true]
-    risk_preds = [y_pred.get('risk_score') if isinstance(y_pred, dict) else y_pred for y_pred in y_preds]
-    return concordance_index(times, risk_preds, events)
+    times, events, risk = _survival_arrays(y_true, y_preds)
+    if time_horizon is not None:
+        return float(survival.cumulative_dynamic_auc(times, events, risk, [time_horizon])[0][0])
+    return survival.cumulative_dynamic_auc(times, events, risk, survival.evaluation_grid(times, events))[1]
 
 
-def auc_survival(y_true, y_preds):
+def integrated_brier_score(y_true, y_preds, time_horizon=None):
     """
-    y_true: [(time, event), ...] 只用event作为标签
-    y_pred: 风险分数或生存概率
+    IPCW 积分 Brier score（越低越好），积分区间到 time_horizon 为止。
+    模型只输出风险分数，S(t | x) 由 Breslow 基线风险换算得到。
     """
-    events = [t[1] for t in y_true]
-    survival_preds = [y_pred.get('risk_score') if isinstance(y_pred, dict) else y_pred for y_pred in y_preds]
-    return roc_auc_score(events, survival_preds)
+    times, events, risk = _survival_arrays(y_true, y_preds)
+    eval_times = survival.evaluation_grid(times, events, time_horizon)
+    if len(eval_times) == 0:
+        return float("nan")
+    return survival.integrated_brier_score(times, events, survival.breslow_survival(times, events, risk, eval_times),
+                                           eval_times)
+
+
+# 配置中的指标名 -> 指标函数（metrics.json 中的键为函数名）
+METRICS.register('ACC', acc)
+METRICS.register('Precision', precision)
+METRICS.register('Recall', recall)
+METRICS.register('F1', f1)
+METRICS.register('AUC', auc)
+METRICS.register('BLEU', bleu)
+METRICS.register('BLEU_1', bleu_1)
+METRICS.register('BLEU_2', bleu_2)
+METRICS.register('BLEU_3', bleu_3)
+METRICS.register('BLEU_4', bleu_4)
+METRICS.register('ROUGE_L', rouge_l)
+METRICS.register('METEOR', meteor)
+METRICS.register('c_index', c_index)
+METRICS.register('Uno_C_Index', uno_c_index)
+METRICS.register('Integrated_Brier_Score', integrated_brier_score)
+METRICS.register('AUC_Survival', auc_survival)
 
 
 if __name__ == "__main__":
@@ -122,6 +338,8 @@ if __name__ == "__main__":
     ]
     
     print(f"{bleu.__name__}: {bleu(references, hypotheses)}")
+    for metric_fn in [bleu_1, bleu_2, bleu_3, bleu_4, rouge_l, meteor]:
+        print(f"{metric_fn.__name__}: {metric_fn(references, hypotheses)}")
 
     # 假设有5个样本
     # y_true 组织为 [(time, event), ...]
@@ -138,5 +356,7 @@ if __name__ == "__main__":
     # 计算C-index
     print(f"{c_index.__name__}: {c_index(y_true, y_pred)}")
 
-    # 计算AUC（只用event作为标签）
-    print(f"{auc_survival.__name__}: {auc_survival(y_true, y_pred)}")
\ No newline at end of file
+    # 时间依赖 AUC、Uno's C 与积分 Brier score
+    print(f"{auc_survival.__name__}: {auc_survival(y_true, y_pred, time_horizon=35)}")
+    print(f"{uno_c_index.__name__}: {uno_c_index(y_true, y_pred, time_horizon=35)}")
+    print(f"{integrated_brier_score.__name__}: {integrated_brier_score(y_true, y_pred, time_horizon=35)}")
\ No newline at end of file
@@ -1,54 +1,314 @@
-from sklearn.metrics import RocCurveDisplay
-from sklearn.metrics import ConfusionMatrixDisplay
+import matplotlib
+matplotlib.use("Agg")  # 非交互后端：不需要显示器，worker 进程中也能安全绘图
 from matplotlib import pyplot as plt
 import os
 import json
+import hashlib
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
 import numpy as np
+from .logger import default_logger as logger
 
-def plot_roc_curve(self, labels, probs):
-    # 实现ROC曲线绘制
-    fig, ax = plt.subplots()
-    RocCurveDisplay.from_predictions(labels, probs, ax=ax)
+# 绘图流水线：先在主进程里收集每张图的数据（结果索引 / metrics.json / predictions.npz 中需要的列），
+# 对数据求哈希，与上次渲染时记录的哈希相同且图片仍在的图直接跳过，其余的交给进程池渲染。
+# 修改绘图样式后增大 _RENDER_VERSION，使所有图重新渲染。
+_RENDER_VERSION = 1
+# 每个 fig_dir（job["root"]）下记录 {相对路径: 数据哈希}
+_MANIFEST_FILE = ".render_manifest.json"
+# 少于该数量的待渲染图直接在当前进程中绘制
+_PARALLEL_MIN_FIGURES = 4
+
+
+def plot_roc_curve(labels, probs, ax=None, name=None):
+    """二分类直接使用正类概率；多分类画 micro-average（one-vs-rest 展开后合并）的 ROC。"""
+    # sklearn 只在真正画 ROC / 混淆矩阵时导入，柱状图不需要它
+    from sklearn.metrics import RocCurveDisplay
+    from sklearn.preprocessing import label_binarize
+    fig = None
+    if ax is None:
+        fig, ax = plt.subplots()
+    labels, probs = np.asarray(labels), np.asarray(probs)
+    if probs.ndim == 2 and probs.shape[1] == 2:
+        probs = probs[:, 1]
+    elif probs.ndim == 2:
+        labels = label_binarize(labels, classes=np.arange(probs.shape[1])).ravel()
+        probs = probs.ravel()
+    RocCurveDisplay.from_predictions(labels, probs, ax=ax, name=name)
     ax.set_title('ROC Curve')
-    return fig
-    
-def plot_confusion_matrix(self, labels, preds):
+    return fig if fig is not None else ax.figure
+
+
+def plot_confusion_matrix(labels, preds):
+    from sklearn.metrics import ConfusionMatrixDisplay
     fig, ax = plt.subplots()
     ConfusionMatrixDisplay.from_predictions(labels, preds, ax=ax)
     ax.set_title('Confusion Matrix')
     return fig
 
-def plot_bar(models: list, datasets: list, task_name: str, metric: str, result_dir: str, fig_dir: str):
-    fig_dir = os.path.join(fig_dir, task_name)
-    os.makedirs(fig_dir, exist_ok=True)
-    metric_dir = os.path.join(fig_dir, metric)
-    os.makedirs(metric_dir, exist_ok=True)
 
+# ---------------------------------------------------------------- renderers（在 worker 进程中执行）
+def _render_bar(data: Dict[str, Any]):
+    models = data["models"]
+    x = np.arange(len(models))
+    width = 0.6
+
+    fig, ax = plt.subplots()
+    ax.bar(x, data["values"], width, color='skyblue')
+    ax.set_xlabel(data["dataset"])
+    ax.set_ylabel(data["metric"])
+    ax.set_xticks(x)
+    ax.set_xticklabels(models)
+    fig.tight_layout()
+    return fig
+
+
+def _render_comparison(data: Dict[str, Any]):
+    # 每个数据集一组柱，组内每个模型一根，有置信区间时画误差线
+    models, datasets = data["models"], data["datasets"]
+    values = np.asarray(data["values"], dtype=np.float64)  # [datasets, models]
+    lower = np.asarray(data["lower"], dtype=np.float64)
+    upper = np.asarray(data["upper"], dtype=np.float64)
+    x = np.arange(len(datasets))
+    width = 0.8 / max(len(models), 1)
+
+    fig, ax = plt.subplots(figsize=(max(6, 1.5 * len(datasets) * max(len(models), 1) / 2), 4))
+    for m, model in enumerate(models):
+        errors = None
+        if not np.all(np.isnan(lower[:, m])):
+            errors = np.nan_to_num(np.stack([values[:, m] - lower[:, m], upper[:, m] - values[:, m]]).clip(min=0))
+        ax.bar(x + (m - (len(models) - 1) / 2) * width, np.nan_to_num(values[:, m]), width,
+               yerr=errors, capsize=3, label=model)
+    ax.set_xticks(x)
+    ax.set_xticklabels(datasets)
+    ax.set_ylabel(data["metric"])
+    ax.set_title(f"{data['task']} - {data['metric']}")
+    ax.legend(fontsize="small")
+    fig.tight_layout()
+    return fig
+
+
+def _render_roc(data: Dict[str, Any]):
+    # 同一数据集上各模型的 ROC 曲线叠在一张图里
+    fig, ax = plt.subplots()
+    for model, labels, probs in zip(data["models"], data["labels"], data["probabilities"]):
+        plot_roc_curve(labels, probs, ax=ax, name=model)
+    ax.plot([0, 1], [0, 1], linestyle="--", color="grey", linewidth=0.8)
+    ax.set_title(f"ROC - {data['dataset']}")
+    return fig
+
+
+def _render_confusion(data: Dict[str, Any]):
+    fig = plot_confusion_matrix(data["labels"], data["pred_class"])
+    fig.axes[0].set_title(f"{data['model']} - {data['dataset']}")
+    return fig
+
+
+_RENDERERS = {
+    "bar": _render_bar,
+    "comparison": _render_comparison,
+    "roc": _render_roc,
+    "confusion": _render_confusion,
+}
+
+
+def _render(job: Dict[str, Any]) -> Optional[str]:
+    """渲染一张图，返回错误信息（成功时为 None）。先写临时文件再 rename，不会留下半张图。"""
+    try:
+        fig = _RENDERERS[job["kind"]](job["data"])
+        os.makedirs(os.path.dirname(job["path"]), exist_ok=True)
+        tmp_path = f"{job['path']}.tmp-{os.getpid()}.png"
+        fig.savefig(tmp_path)
+        plt.close(fig)
+        os.replace(tmp_path, job["path"])
+        return None
+    except Exception as e:
+        plt.close("all")
+        return str(e)
+
+
+# ---------------------------------------------------------------- 数据收集
+def _metric_cells(task_name: str, metric_key: str, models: list, datasets: list, result_dir: str,
+                  results_index=None) -> Dict[Tuple[str, str], Tuple[Optional[float], Optional[float], Optional[float]]]:
+    """{(dataset, model): (value, ci_low, ci_high)}；结果索引中没有的组合读 metrics.json。"""
+    cells = {}
+    if results_index is not None:
+        for row in results_index.latest(task_name, metric_key, models, datasets):
+            cells[(row["dataset"], row["model"])] = (row["value"], row["ci_low"], row["ci_high"])
     for dataset in datasets:
-        metric_values = []
         for model in models:
-            task_dir = os.path.join(result_dir, task_name)
-            model_dir = os.path.join(task_dir, model)
-            dataset_dir = os.path.join(model_dir, dataset)
-            metrics_path = os.path.join(dataset_dir, 'metrics.json')
+            if (dataset, model) in cells:
+                continue
+            metrics_path = os.path.join(result_dir, task_name, model, dataset, 'metrics.json')
             if os.path.exists(metrics_path):
                 with open(metrics_path, 'r') as f:
                     metrics = json.load(f)
-                    metric_value = metrics.get(metric.lower(), 0)
-                    metric_values.append(metric_value)
-            else:
-                metric_values.append(0)
+                ci = metrics.get(f"{metric_key}_ci") or (None, None)
+                cells[(dataset, model)] = (metrics.get(metric_key), ci[0], ci[1])
+    return cells
 
-        x = np.arange(len(models))
-        width = 0.6
 
-        fig, ax = plt.subplots()
-        ax.bar(x, metric_values, width, color='skyblue')
-        ax.set_xlabel(dataset)
-        ax.set_ylabel(metric)
-        ax.set_xticks(x)
-        ax.set_xticklabels(models)
-        fig.tight_layout()
-        fig_path = os.path.join(metric_dir, f"{dataset}.png")
-        fig.savefig(fig_path)
-        plt.close(fig)
\ No newline at end of file
+def _nan(value) -> float:
+    return np.nan if value is None else float(value)
+
+
+def bar_figure_jobs(models: list, datasets: list, task_name: str, metric: str, result_dir: str, fig_dir: str,
+                    metric_key: str = None, results_index=None, cells=None) -> List[Dict[str, Any]]:
+    metric_key = metric_key or metric.lower()
+    if cells is None:
+        cells = _metric_cells(task_name, metric_key, models, datasets, result_dir, results_index)
+    jobs = []
+    for dataset in datasets:
+        values = [cells.get((dataset, model), (None,))[0] for model in models]
+        jobs.append({"kind": "bar", "root": fig_dir, "path": os.path.join(fig_dir, task_name, metric, f"{dataset}.png"),
+                     "data": {"models": list(models), "dataset": dataset, "metric": metric,
+                              "values": [0 if value is None else value for value in values]}})
+    return jobs
+
+
+def task_figure_jobs(task_name: str, models: list, datasets: list, metric_keys: Dict[str, str], result_dir: str,
+                     fig_dir: str, results_index=None) -> List[Dict[str, Any]]:
+    """
+    一个任务的全部图：
+      - <metric>/<dataset>.png: 各模型在该数据集上的指标柱状图
+      - <metric>/comparison.png: 所有数据集 × 模型的分组柱状图（带置信区间）
+      - ROC/<dataset>.png: 各模型 ROC 曲线对比（预测中有 probabilities 列时）
+      - Confusion/<model>/<dataset>.png: 混淆矩阵（预测中有 pred_class 列时）
+
+    Args:
+        metric_keys: {配置中的指标名: metrics.json / 结果索引中的键}
+    """
+    # 延迟导入：utils 在模块级不依赖 core
+    from core.predictions import read_predictions
+
+    jobs = []
+    for metric, metric_key in metric_keys.items():
+        cells = _metric_cells(task_name, metric_key, models, datasets, result_dir, results_index)
+        jobs.extend(bar_figure_jobs(models, datasets, task_name, metric, result_dir, fig_dir, metric_key, cells=cells))
+        grid = [[cells.get((dataset, model), (None, None, None)) for model in models] for dataset in datasets]
+        jobs.append({"kind": "comparison", "root": fig_dir, "path": os.path.join(fig_dir, task_name, metric, "comparison.png"),
+                     "data": {"task": task_name, "metric": metric, "models": list(models), "datasets": list(datasets),
+                              "values": [[_nan(cell[0]) for cell in row] for row in grid],
+                              "lower": [[_nan(cell[1]) for cell in row] for row in grid],
+                              "upper": [[_nan(cell[2]) for cell in row] for row in grid]}})
+
+    for dataset in datasets:
+        roc = {"models": [], "labels": [], "probabilities": [], "dataset": dataset}
+        for model in models:
+            # 只读取绘图需要的列
+            columns = read_predictions(os.path.join(result_dir, task_name, model, dataset),
+                                       ["label", "pred_class", "probabilities"])
+            if not columns or "label" not in columns or len(columns["label"]) == 0:
+                continue
+            if "probabilities" in columns and len(np.unique(columns["label"])) > 1:
+                roc["models"].append(model)
+                roc["labels"].append(columns["label"])
+                roc["probabilities"].append(columns["probabilities"])
+            if "pred_class" in columns:
+                jobs.append({"kind": "confusion", "root": fig_dir,
+                             "path": os.path.join(fig_dir, task_name, "Confusion", model, f"{dataset}.png"),
+                             "data": {"model": model, "dataset": dataset, "labels": columns["label"],
+                                      "pred_class": columns["pred_class"]}})
+        if roc["models"]:
+            jobs.append({"kind": "roc", "root": fig_dir, "path": os.path.join(fig_dir, task_name, "ROC", f"{dataset}.png"), "data": roc})
+    return jobs
+
+
+# ---------------------------------------------------------------- 增量渲染
+def _update_hash(h, value):
+    if isinstance(value, np.ndarray):
+        h.update(f"ndarray{value.dtype.str}{value.shape}".encode())
+        h.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, dict):
+        for key in sorted(value):
+            h.update(f"<{key}>".encode())
+            _update_hash(h, value[key])
+    elif isinstance(value, (list, tuple)):
+        h.update(f"[{len(value)}".encode())
+        for item in value:
+            _update_hash(h, item)
+    else:
+        h.update(json.dumps(value, default=str).encode())
+
+
+def figure_hash(job: Dict[str, Any]) -> str:
+    h = hashlib.sha256(f"{_RENDER_VERSION}:{job['kind']}".encode())
+    _update_hash(h, job["data"])
+    return h.hexdigest()
+
+
+def _load_manifest(path: str) -> Dict[str, str]:
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except ValueError:
+        return {}
+
+
+def _save_manifest(path: str, manifest: Dict[str, str]):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def render_figures(jobs: List[Dict[str, Any]], num_workers: Optional[int] = None, incremental: bool = True) -> Dict[str, int]:
+    """
+    渲染一批图。incremental 时跳过数据哈希与上次渲染相同、且图片文件仍存在的图。
+
+    Returns:
+        {"rendered": n, "skipped": n, "failed": n}
+    """
+    manifests: Dict[str, Dict[str, str]] = {}
+    pending, hashes = [], []
+    skipped = 0
+    for job in jobs:
+        manifest_path = os.path.join(job["root"], _MANIFEST_FILE)
+        if manifest_path not in manifests:
+            manifests[manifest_path] = _load_manifest(manifest_path)
+        key = os.path.relpath(job["path"], os.path.dirname(manifest_path))
+        digest = figure_hash(job)
+        if incremental and manifests[manifest_path].get(key) == digest and os.path.exists(job["path"]):
+            skipped += 1
+            continue
+        pending.append(job)
+        hashes.append((manifest_path, key, digest))
+
+    num_workers = num_workers or os.cpu_count() or 1
+    if len(pending) < _PARALLEL_MIN_FIGURES or num_workers <= 1:
+        errors = [_render(job) for job in pending]
+    else:
+        # 绘图只用到 matplotlib/sklearn，fork 省去子进程重新 import 的开销
+        ctx = mp.get_context("fork" if "fork" in mp.get_all_start_methods() else "spawn")
+        with ProcessPoolExecutor(max_workers=min(num_workers, len(pending)), mp_context=ctx) as pool:
+            errors = list(pool.map(_render, pending, chunksize=max(1, len(pending) // (4 * num_workers))))
+
+    failed = 0
+    for job, (manifest_path, key, digest), error in zip(pending, hashes, errors):
+        if error is None:
+            manifests[manifest_path][key] = digest
+        else:
+            failed += 1
+            manifests[manifest_path].pop(key, None)
+            logger.error(f"Erro: failed to render {job['path']}: {error}")
+    for manifest_path, manifest in manifests.items():
+        _save_manifest(manifest_path, manifest)
+
+    stats = {"rendered": len(pending) - failed, "skipped": skipped, "failed": failed}
+    logger.info(f"Figures: {stats['rendered']} rendered, {stats['skipped']} unchanged, {stats['failed']} failed")
+    return stats
+
+
+def plot_bar(models: list, datasets: list, task_name: str, metric: str, result_dir: str, fig_dir: str,
+             metric_key: str = None, results_index=None):
+    """
+    Args:
+        metric: 配置中的指标名（用作图的目录与坐标轴标签）
+        metric_key: metrics.json / 结果索引中的键（指标函数名），None 时退回 metric.lower()
+        results_index: 可选的 core.results_db.ResultsIndex；提供时一次查询取出所有 (model, dataset) 的最新结果
+    """
+    render_figures(bar_figure_jobs(models, datasets, task_name, metric, result_dir, fig_dir, metric_key, results_index),
+                   num_workers=1)